@@ -0,0 +1,374 @@
+import argparse
+import os
+import struct
+import sys
+from array import array
+from vpc_log_parser import PortProtocolCounter, Writer, _merge_counts
+from sketches import HeavyHitterSketch
+
+STATE_MAGIC = b"FLST"
+STATE_VERSION = 1
+STATE_HEADER = struct.Struct("<4sHHI")  # magic, format version, flags, number of sections
+SECTION_HEADER = struct.Struct("<4sQ")  # section name, payload length in bytes
+ITEM_COUNT = struct.Struct("<I")
+FIVE_TUPLES_COUNTED = 0x1
+
+
+def _pack_array(typecode, values):
+    """
+    Encode integers as an item count followed by a little-endian array.
+    """
+    column = array(typecode, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return ITEM_COUNT.pack(len(column)) + column.tobytes()
+
+
+def _pack_strings(strings):
+    """
+    Encode strings as an array of UTF-8 lengths followed by the concatenated UTF-8 bytes.
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    return _pack_array('I', [len(string) for string in encoded]) + b"".join(encoded)
+
+
+class _PayloadReader:
+    """
+    Read the arrays and strings of a section payload in the order they were packed.
+    """
+    def __init__(self, payload):
+        self.payload = payload
+        self.offset = 0
+
+    def _take(self, size):
+        if self.offset + size > len(self.payload):
+            raise ValueError("Truncated aggregate state section")
+        data = self.payload[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def array(self, typecode):
+        column = array(typecode)
+        count, = ITEM_COUNT.unpack(self._take(ITEM_COUNT.size))
+        column.frombytes(self._take(count * column.itemsize))
+        if sys.byteorder != "little":
+            column.byteswap()
+        return column
+
+    def strings(self):
+        lengths = self.array('I')
+        blob = bytes(self._take(sum(lengths)))
+        # decode the blob once and slice it, instead of decoding every string separately
+        text = blob.decode('ascii') if blob.isascii() else None
+        strings = []
+        start = 0
+        for length in lengths:
+            end = start + length
+            strings.append(text[start:end] if text is not None else blob[start:end].decode('utf-8'))
+            start = end
+        return strings
+
+
+class AggregateState:
+    """
+    This class holds the aggregate counts of one or more flow log runs in a form that can
+    be merged and shipped between hosts.
+
+    A state holds the tag counts, port-protocol counts, exact five tuple counts (or None if
+    five tuples were not counted) and the per-reason rejection counts. merge() adds another
+    state into this one and is associative, so a roll-up can merge the states of many
+    nodes in any grouping, and keys keep their first-seen order in merge order, like the
+    partial results of a parallel run.
+
+    to_bytes() encodes a state as a compact binary blob: a header with a magic number,
+    a format version, flags and the number of sections, followed by length-prefixed
+    sections of little-endian columns. Tags, protocols, rejection reasons and the five
+    tuples' IP addresses are stored once as UTF-8 strings and referred to by index. Readers
+    skip sections they do not know, so sections can be added without a version bump.
+    """
+    def __init__(self, count_five_tuples=True):
+        """
+        Initialize the AggregateState class.
+
+        Args:
+            count_five_tuples (bool): Whether the state holds five tuple counts.
+        """
+        self.tag_counts = {}
+        self.port_protocol_counts = PortProtocolCounter()
+        self.five_tuple_counts = {} if count_five_tuples else None
+        self.rejection_counts = {}
+
+    @classmethod
+    def from_processor(cls, processor):
+        """
+        Copy the aggregates of a FlowLogProcessor into a new state.
+
+        Args:
+            processor (FlowLogProcessor): A processor that has processed its flow log.
+
+        Returns:
+            AggregateState: The state of the processor's counts.
+
+        Raises:
+            ValueError: If the processor counted five tuples approximately; sketch
+                estimates are not exact counts and cannot be merged with them.
+        """
+        if isinstance(processor.five_tuple_counts, HeavyHitterSketch):
+            raise ValueError("Approximate five tuple counts cannot be stored in an aggregate state")
+        state = cls(processor.five_tuple_counts is not None)
+        state.tag_counts.update(processor.tag_counts)
+        state.port_protocol_counts.merge(processor.port_protocol_counts)
+        if state.five_tuple_counts is not None:
+            state.five_tuple_counts.update(processor.get_five_tuple_counts_dict())
+        state.rejection_counts.update(processor.error_sink.rejection_counts)
+        return state
+
+    def merge(self, other):
+        """
+        Add the counts of another state into this one.
+
+        Args:
+            other (AggregateState): The state to add.
+
+        Returns:
+            AggregateState: This state, so merges can be chained.
+
+        Raises:
+            ValueError: If only one of the states holds five tuple counts.
+
+        Time Complexity:
+            O(k + m + t + r), the number of keys in other.
+
+        Space Complexity:
+            O(k + m + t + r) - New keys are added to this state.
+        """
+        if (self.five_tuple_counts is None) != (other.five_tuple_counts is None):
+            raise ValueError("Cannot merge aggregate states with and without five tuple counts")
+        _merge_counts(self.tag_counts, other.tag_counts)
+        self.port_protocol_counts.merge(other.port_protocol_counts)
+        if self.five_tuple_counts is not None:
+            _merge_counts(self.five_tuple_counts, other.five_tuple_counts)
+        _merge_counts(self.rejection_counts, other.rejection_counts)
+        return self
+
+    def to_bytes(self):
+        """
+        Encode the state as a versioned binary blob.
+
+        Returns:
+            bytes: The encoded state.
+
+        Time Complexity:
+            O(k + m + t + r), the number of keys in the state.
+
+        Space Complexity:
+            O(k + m + t + r) - The columns are built before they are joined.
+        """
+        sections = {}
+        sections[b"TAGS"] = _pack_strings(self.tag_counts) + _pack_array('Q', self.tag_counts.values())
+
+        protocols = list(self.port_protocol_counts.counts)
+        protocol_ids = {protocol: protocol_id for protocol_id, protocol in enumerate(protocols)}
+        port_protocols = list(self.port_protocol_counts.items())
+        sections[b"PORT"] = (_pack_strings(protocols)
+                             + _pack_array('H', [port for (port, _), _ in port_protocols])
+                             + _pack_array('B', [protocol_ids[protocol] for (_, protocol), _ in port_protocols])
+                             + _pack_array('Q', [count for _, count in port_protocols]))
+
+        flags = 0
+        if self.five_tuple_counts is not None:
+            flags |= FIVE_TUPLES_COUNTED
+            addresses = {}
+            protocols = {}
+            columns = ([], [], [], [], [])
+            for source_ip, dest_ip, source_port, dst_port, protocol in self.five_tuple_counts:
+                columns[0].append(addresses.setdefault(source_ip, len(addresses)))
+                columns[1].append(addresses.setdefault(dest_ip, len(addresses)))
+                columns[2].append(source_port)
+                columns[3].append(dst_port)
+                columns[4].append(protocols.setdefault(protocol, len(protocols)))
+            sections[b"FIVE"] = (_pack_strings(addresses) + _pack_strings(protocols)
+                                 + b"".join(_pack_array(typecode, column)
+                                            for typecode, column in zip("IIHHB", columns))
+                                 + _pack_array('Q', self.five_tuple_counts.values()))
+
+        sections[b"REJS"] = _pack_strings(self.rejection_counts) + _pack_array('Q', self.rejection_counts.values())
+
+        parts = [STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, flags, len(sections))]
+        for name, payload in sections.items():
+            parts.append(SECTION_HEADER.pack(name, len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+    @staticmethod
+    def _read_header(blob):
+        """
+        Validate the header of a blob.
+
+        Returns:
+            tuple: (flags, number of sections).
+        """
+        if len(blob) < STATE_HEADER.size:
+            raise ValueError("Truncated aggregate state")
+        magic, version, flags, section_count = STATE_HEADER.unpack_from(blob)
+        if magic != STATE_MAGIC:
+            raise ValueError("Not an aggregate state")
+        if version != STATE_VERSION:
+            raise ValueError(f"Unsupported aggregate state version: {version}")
+        return flags, section_count
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """
+        Decode a state encoded by to_bytes.
+
+        Args:
+            blob (bytes): The encoded state.
+
+        Returns:
+            AggregateState: The decoded state.
+
+        Raises:
+            ValueError: If the blob is not a valid aggregate state of this version.
+        """
+        flags, _ = cls._read_header(blob)
+        state = cls(bool(flags & FIVE_TUPLES_COUNTED))
+        state.merge_bytes(blob)
+        return state
+
+    def merge_bytes(self, blob):
+        """
+        Add the counts of an encoded state into this one, without building an intermediate state.
+
+        Args:
+            blob (bytes): A state encoded by to_bytes.
+
+        Returns:
+            AggregateState: This state, so merges can be chained.
+
+        Raises:
+            ValueError: If the blob is invalid, or only one of the states holds five tuple counts.
+
+        Time Complexity:
+            O(b), where b is the size of the blob.
+
+        Space Complexity:
+            O(b) - The columns of one section are decoded at a time.
+        """
+        flags, section_count = self._read_header(blob)
+        if bool(flags & FIVE_TUPLES_COUNTED) != (self.five_tuple_counts is not None):
+            raise ValueError("Cannot merge aggregate states with and without five tuple counts")
+        view = memoryview(blob)
+        offset = STATE_HEADER.size
+        for _ in range(section_count):
+            if offset + SECTION_HEADER.size > len(blob):
+                raise ValueError("Truncated aggregate state")
+            name, length = SECTION_HEADER.unpack_from(blob, offset)
+            offset += SECTION_HEADER.size
+            reader = _PayloadReader(view[offset:offset + length])
+            offset += length
+            if name == b"TAGS":
+                _merge_counts(self.tag_counts, dict(zip(reader.strings(), reader.array('Q'))))
+            elif name == b"PORT":
+                protocols = reader.strings()
+                ports, protocol_ids, counts = reader.array('H'), reader.array('B'), reader.array('Q')
+                for port, protocol_id, count in zip(ports, protocol_ids, counts):
+                    self.port_protocol_counts.add(port, protocols[protocol_id], count)
+            elif name == b"FIVE":
+                addresses, protocols = reader.strings(), reader.strings()
+                columns = [reader.array(typecode) for typecode in "IIHHBQ"]
+                five_tuple_counts = self.five_tuple_counts
+                for source_id, dest_id, source_port, dst_port, protocol_id, count in zip(*columns):
+                    key = (addresses[source_id], addresses[dest_id], source_port, dst_port, protocols[protocol_id])
+                    five_tuple_counts[key] = five_tuple_counts.get(key, 0) + count
+            elif name == b"REJS":
+                _merge_counts(self.rejection_counts, dict(zip(reader.strings(), reader.array('Q'))))
+        return self
+
+    @classmethod
+    def merge_all(cls, blobs):
+        """
+        Merge many encoded states, in order, into one state.
+
+        Args:
+            blobs (iterable): States encoded by to_bytes.
+
+        Returns:
+            AggregateState: The merged state, or None if there were no blobs.
+        """
+        state = None
+        for blob in blobs:
+            if state is None:
+                state = cls.from_bytes(blob)
+            else:
+                state.merge_bytes(blob)
+        return state
+
+    def save(self, state_file):
+        """
+        Atomically write the encoded state to a file.
+
+        Args:
+            state_file (str or Path): The path of the state file.
+        """
+        temporary_file = f"{state_file}.tmp"
+        with open(temporary_file, "wb") as output_file:
+            output_file.write(self.to_bytes())
+        os.replace(temporary_file, state_file)
+
+    @classmethod
+    def load(cls, state_file):
+        """
+        Read a state file written by save.
+
+        Args:
+            state_file (str or Path): The path of the state file.
+
+        Returns:
+            AggregateState: The decoded state.
+        """
+        with open(state_file, "rb") as input_file:
+            return cls.from_bytes(input_file.read())
+
+    def writer(self):
+        """
+        Get a Writer for the counts of this state.
+
+        Returns:
+            Writer: A Writer whose output files are those of a run over all merged inputs.
+        """
+        return Writer(self.tag_counts, dict(self.port_protocol_counts), self.five_tuple_counts)
+
+
+def main():
+    """
+    Merge aggregate state files from the command line and write the merged counts.
+    """
+    parser = argparse.ArgumentParser(description="Merge flow log aggregate states.")
+    parser.add_argument("state_files", nargs="+", help="state files written with aggregate_state_path")
+    parser.add_argument("--output", help="write the merged state to this file")
+    parser.add_argument("--write-counts", action="store_true",
+                        help="write tag_counts.txt, pp_counts.txt and five_tuple_counts.txt for the merged state")
+    args = parser.parse_args()
+
+    def read_blobs():
+        for state_file in args.state_files:
+            with open(state_file, "rb") as input_file:
+                yield input_file.read()
+
+    state = AggregateState.merge_all(read_blobs())
+    if args.output:
+        state.save(args.output)
+    if args.write_counts:
+        writer = state.writer()
+        writer.output_tag_counts(False, None)
+        writer.output_port_protocol_counts(False, None)
+        if state.five_tuple_counts is not None:
+            writer.output_five_tuple_counts()
+    print(f"Merged {len(args.state_files)} states: {len(state.tag_counts)} tags, "
+          f"{len(state.port_protocol_counts)} port-protocol combinations, "
+          f"{sum(state.rejection_counts.values())} rejected lines")
+
+
+if __name__ == "__main__":
+    main()
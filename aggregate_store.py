@@ -0,0 +1,620 @@
+import argparse
+import bisect
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from itertools import islice
+from service import WindowedAggregates
+from vpc_log_parser import iter_flow_log_lines, resolve_flow_log_files
+
+SEGMENT_MAGIC = b"FLOWAGG1"
+SEGMENT_HEADER = struct.Struct("<8sqII")  # magic, bucket start, bucket seconds, number of columns
+COLUMN_ENTRY = struct.Struct("<16sc7xQQ")  # column name, array typecode, byte offset, number of items
+SEGMENT_SUFFIX = ".seg"
+AGGREGATES = ("tag_counts", "port_protocol_counts", "five_tuple_counts")
+
+
+def _string_column(strings):
+    """
+    Encode strings as an offsets column and a UTF-8 blob column.
+    """
+    offsets = array('I', [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, array('B', blob)
+
+
+def encode_segment_columns(tag_counts, port_protocol_counts, five_tuple_counts):
+    """
+    Encode the aggregates of one time bucket as sorted columns.
+
+    Tags and the five tuples' IP addresses are stored as offsets into UTF-8 blobs, ports as
+    16-bit integers and protocols as indices into a sorted protocol dictionary. Port-protocol
+    keys are packed into one 32-bit code, protocol index << 16 | port. Every aggregate is
+    sorted by its keys, so a single key can be found with a binary search.
+
+    Args:
+        tag_counts (dict): A dictionary mapping tag to count.
+        port_protocol_counts (Mapping): A mapping of (port, protocol) to count.
+        five_tuple_counts (dict): A dictionary mapping five tuple to count, or None.
+
+    Returns:
+        dict: A dictionary mapping column name to array.
+
+    Time Complexity:
+        O(n log n), where n is the number of keys in all aggregates.
+
+    Space Complexity:
+        O(n) - The columns hold every key and count.
+    """
+    five_tuple_counts = five_tuple_counts or {}
+    protocols = sorted({protocol for _, protocol in port_protocol_counts} | {key[4] for key in five_tuple_counts})
+    protocol_ids = {protocol: protocol_id for protocol_id, protocol in enumerate(protocols)}
+    columns = {}
+    columns["protocol_offsets"], columns["protocol_blob"] = _string_column(protocols)
+
+    tags = sorted(tag_counts)
+    columns["tag_offsets"], columns["tag_blob"] = _string_column(tags)
+    columns["tag_counts"] = array('Q', [tag_counts[tag] for tag in tags])
+
+    codes = sorted(protocol_ids[protocol] << 16 | port for port, protocol in port_protocol_counts)
+    columns["pp_keys"] = array('I', codes)
+    columns["pp_counts"] = array('Q', [port_protocol_counts[(code & 0xFFFF, protocols[code >> 16])] for code in codes])
+
+    five_tuples = sorted(five_tuple_counts)
+    columns["ft_src_offsets"], columns["ft_src_blob"] = _string_column([key[0] for key in five_tuples])
+    columns["ft_dst_offsets"], columns["ft_dst_blob"] = _string_column([key[1] for key in five_tuples])
+    columns["ft_src_ports"] = array('H', [key[2] for key in five_tuples])
+    columns["ft_dst_ports"] = array('H', [key[3] for key in five_tuples])
+    columns["ft_protocols"] = array('B', [protocol_ids[key[4]] for key in five_tuples])
+    columns["ft_counts"] = array('Q', [five_tuple_counts[key] for key in five_tuples])
+    return columns
+
+
+def write_segment(segment_path, bucket_start, bucket_seconds, columns):
+    """
+    Atomically write a segment file.
+
+    A segment is a header, a directory of (name, typecode, offset, length) column entries and
+    the little-endian column data, each column aligned to 8 bytes so it can be used in place
+    from a memory map.
+
+    Args:
+        segment_path (str): The path of the segment.
+        bucket_start (int): The first timestamp of the bucket.
+        bucket_seconds (int): The length of the bucket.
+        columns (dict): A dictionary mapping column name to array.
+    """
+    offset = SEGMENT_HEADER.size + COLUMN_ENTRY.size * len(columns)
+    entries = []
+    for name, column in columns.items():
+        offset += -offset % 8
+        entries.append(COLUMN_ENTRY.pack(name.encode('utf-8'), column.typecode.encode('ascii'), offset, len(column)))
+        offset += len(column) * column.itemsize
+
+    temporary_file = f"{segment_path}.tmp"
+    with open(temporary_file, "wb") as segment_file:
+        segment_file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, bucket_start, bucket_seconds, len(columns)))
+        segment_file.write(b"".join(entries))
+        for column in columns.values():
+            segment_file.write(bytes(-segment_file.tell() % 8))
+            if sys.byteorder != "little":
+                column = array(column.typecode, column)
+                column.byteswap()
+            segment_file.write(column.tobytes())
+    os.replace(temporary_file, segment_path)
+
+
+class _StringColumn(Sequence):
+    """
+    A sequence view of strings stored as an offsets column and a UTF-8 blob column.
+    """
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __getitem__(self, index):
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        # decode the blob once and slice it, instead of decoding every string separately
+        blob = bytes(self.blob)
+        offsets = self.offsets
+        if not blob.isascii():  # byte offsets are only character offsets for ASCII text
+            return (blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:]))
+        text = blob.decode('ascii')
+        return (text[start:end] for start, end in zip(offsets, offsets[1:]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class _FiveTupleColumn(Sequence):
+    """
+    A sequence view of the sorted five tuples of a segment.
+    """
+    def __init__(self, segment):
+        self.source_ips = segment.strings("ft_src")
+        self.dest_ips = segment.strings("ft_dst")
+        self.source_ports = segment.columns["ft_src_ports"]
+        self.dst_ports = segment.columns["ft_dst_ports"]
+        self.protocol_ids = segment.columns["ft_protocols"]
+        self.protocols = segment.protocols
+
+    def __getitem__(self, index):
+        return (self.source_ips[index], self.dest_ips[index], self.source_ports[index],
+                self.dst_ports[index], self.protocols[self.protocol_ids[index]])
+
+    def __iter__(self):
+        return zip(self.source_ips, self.dest_ips, self.source_ports, self.dst_ports,
+                   map(self.protocols.__getitem__, self.protocol_ids))
+
+    def __len__(self):
+        return len(self.source_ports)
+
+
+class Segment:
+    """
+    This class reads a memory-mapped segment file holding the aggregates of one time bucket.
+
+    Columns are memoryviews into the memory map, so opening a segment reads only its header
+    and a query touches only the pages of the columns it needs.
+    """
+    def __init__(self, segment_path):
+        """
+        Initialize the Segment class.
+
+        Args:
+            segment_path (str): The path of the segment.
+
+        Raises:
+            ValueError: If the file is not a segment.
+        """
+        with open(segment_path, "rb") as segment_file:
+            self._mapped = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mapped)
+        magic, self.bucket_start, self.bucket_seconds, column_count = SEGMENT_HEADER.unpack_from(view)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Not an aggregate segment: {segment_path}")
+        self.columns = {}
+        for index in range(column_count):
+            name, typecode, offset, length = COLUMN_ENTRY.unpack_from(view, SEGMENT_HEADER.size + index * COLUMN_ENTRY.size)
+            typecode = typecode.decode('ascii')
+            column = view[offset:offset + length * array(typecode).itemsize].cast(typecode)
+            if sys.byteorder != "little":
+                column = array(typecode, column)
+                column.byteswap()
+            self.columns[name.rstrip(b"\0").decode('utf-8')] = column
+        self.protocols = list(self.strings("protocol"))
+        self._protocol_ids = {protocol: protocol_id for protocol_id, protocol in enumerate(self.protocols)}
+
+    def strings(self, prefix):
+        """
+        Get a sequence view of a string column stored as prefix_offsets and prefix_blob.
+        """
+        return _StringColumn(self.columns[f"{prefix}_offsets"], self.columns[f"{prefix}_blob"])
+
+    def keys(self, aggregate):
+        """
+        Get the sorted keys of an aggregate.
+
+        Args:
+            aggregate (str): "tag_counts", "port_protocol_counts" or "five_tuple_counts".
+
+        Returns:
+            Sequence: The keys, decoded as they are accessed. Port-protocol keys are sorted by
+            protocol, then port.
+        """
+        if aggregate == "tag_counts":
+            return self.strings("tag")
+        if aggregate == "port_protocol_counts":
+            protocols = self.protocols
+            return [(code & 0xFFFF, protocols[code >> 16]) for code in self.columns["pp_keys"]]
+        if aggregate == "five_tuple_counts":
+            return _FiveTupleColumn(self)
+        raise ValueError(f"Unknown aggregate: {aggregate}")
+
+    def counts(self, aggregate):
+        """
+        Get the count column of an aggregate, in the order of its keys.
+        """
+        return self.columns[{"tag_counts": "tag_counts", "port_protocol_counts": "pp_counts",
+                             "five_tuple_counts": "ft_counts"}[aggregate]]
+
+    def items(self, aggregate):
+        """
+        Get the (key, count) pairs of an aggregate in key order.
+        """
+        return zip(self.keys(aggregate), self.counts(aggregate))
+
+    def get(self, aggregate, key):
+        """
+        Get the count of one key with a binary search.
+
+        Args:
+            aggregate (str): The aggregate name.
+            key: A tag, a (port, protocol) tuple or a five tuple.
+
+        Returns:
+            int: The count of the key, 0 if it is not in the segment.
+
+        Time Complexity:
+            O(log n), where n is the number of keys in the aggregate.
+
+        Space Complexity:
+            O(1) - Only the probed keys are decoded.
+        """
+        if aggregate == "port_protocol_counts":
+            port, protocol = key
+            if protocol not in self._protocol_ids:
+                return 0
+            keys, key = self.columns["pp_keys"], self._protocol_ids[protocol] << 16 | port
+        else:
+            keys = self.keys(aggregate)
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            return self.counts(aggregate)[index]
+        return 0
+
+    def close(self):
+        """
+        Release the memory map once no column views are in use.
+        """
+        self.columns = {}
+        try:
+            self._mapped.close()
+        except BufferError:  # a caller still holds a column view; the map is released with it
+            pass
+
+
+class AggregateStore:
+    """
+    This class persists time-bucketed aggregates as a directory of columnar segment files,
+    one per bucket, and answers range-sum and top-K queries from them without the raw logs.
+
+    Every bucket is also merged into a rollup segment covering rollup_seconds (a day by
+    default). A query uses the rollups of the periods it covers completely and the bucket
+    segments only at its edges, so a query over months opens a few hundred segments instead
+    of thousands. Segment files are named after the start of the period they cover, so the
+    segments of a time range are found from the directory listing alone.
+    """
+    def __init__(self, store_path, bucket_seconds=3600, rollup_seconds=86400):
+        """
+        Initialize the AggregateStore class.
+
+        Args:
+            store_path (str or Path): The directory of the store. It is created if needed.
+            bucket_seconds (int): The length of the buckets written to the store.
+            rollup_seconds (int): The length of the rollup segments, a multiple of
+                bucket_seconds, or None to write no rollups.
+        """
+        if rollup_seconds is not None and (rollup_seconds <= bucket_seconds or rollup_seconds % bucket_seconds):
+            raise ValueError("rollup_seconds must be a multiple of bucket_seconds")
+        self.store_path = store_path
+        self.bucket_seconds = bucket_seconds
+        self.rollup_seconds = rollup_seconds
+        self._segments = {}
+        os.makedirs(store_path, exist_ok=True)
+        self._check_segment_seconds()
+
+    def _check_segment_seconds(self):
+        """
+        Check that the segments already in the store cover buckets and rollups of the
+        configured lengths, so that segments of different lengths are never mixed.
+
+        Raises:
+            ValueError: If a stored segment has another length.
+        """
+        bucket_starts, rollup_starts = self._stored_starts()
+        for kind, starts, seconds in (("bucket", bucket_starts, self.bucket_seconds),
+                                      ("rollup", rollup_starts, self.rollup_seconds)):
+            if not starts or seconds is None:
+                continue
+            with open(self.segment_path(starts[0], kind), "rb") as segment_file:
+                magic, _, stored_seconds, _ = SEGMENT_HEADER.unpack(segment_file.read(SEGMENT_HEADER.size))
+            if magic == SEGMENT_MAGIC and stored_seconds != seconds:
+                raise ValueError(f"The store {self.store_path} has {kind} segments of {stored_seconds} seconds, "
+                                 f"not {seconds}")
+
+    def segment_path(self, bucket_start, kind="bucket"):
+        """
+        Get the path of the bucket or rollup segment starting at a timestamp.
+        """
+        return os.path.join(self.store_path, f"{kind}-{bucket_start}{SEGMENT_SUFFIX}")
+
+    def _stored_starts(self):
+        """
+        Get the sorted start timestamps of the stored bucket and rollup segments.
+        """
+        starts = {"bucket": [], "rollup": []}
+        for name in os.listdir(self.store_path):
+            kind, separator, start = name[:-len(SEGMENT_SUFFIX)].partition("-")
+            if separator and kind in starts and name.endswith(SEGMENT_SUFFIX):
+                starts[kind].append(int(start))
+        return sorted(starts["bucket"]), sorted(starts["rollup"])
+
+    def bucket_starts(self, start=None, end=None):
+        """
+        Get the sorted start timestamps of the stored buckets that overlap [start, end).
+
+        Args:
+            start (int): The first timestamp of the range, or None for no lower bound.
+            end (int): The timestamp after the range, or None for no upper bound.
+
+        Returns:
+            list: The bucket start timestamps.
+        """
+        return [bucket_start for bucket_start in self._stored_starts()[0]
+                if (start is None or bucket_start + self.bucket_seconds > start) and (end is None or bucket_start < end)]
+
+    def plan(self, start=None, end=None):
+        """
+        Choose the segments that cover the buckets overlapping [start, end) exactly once.
+
+        Returns:
+            list: (kind, start) tuples of the segments to read.
+
+        Time Complexity:
+            O(s log s), where s is the number of stored segments.
+        """
+        bucket_starts, rollup_starts = self._stored_starts()
+        covered = []
+        if self.rollup_seconds is not None:
+            first = None if start is None else start - start % self.bucket_seconds
+            last = None if end is None else end + -end % self.bucket_seconds
+            covered = [rollup_start for rollup_start in rollup_starts
+                       if (first is None or rollup_start >= first) and (last is None or rollup_start + self.rollup_seconds <= last)]
+        covered_set = set(covered)
+        segments = [("rollup", rollup_start) for rollup_start in covered]
+        for bucket_start in bucket_starts:
+            if (start is not None and bucket_start + self.bucket_seconds <= start) or (end is not None and bucket_start >= end):
+                continue
+            if self.rollup_seconds is None or bucket_start - bucket_start % self.rollup_seconds not in covered_set:
+                segments.append(("bucket", bucket_start))
+        return segments
+
+    def segment(self, bucket_start, kind="bucket"):
+        """
+        Open a segment, reusing it while the file is unchanged.
+        """
+        segment_path = self.segment_path(bucket_start, kind)
+        stat = os.stat(segment_path)
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self._segments.get((kind, bucket_start))
+        if cached is None or cached[0] != version:
+            cached = (version, Segment(segment_path))
+            self._segments[(kind, bucket_start)] = cached
+        return cached[1]
+
+    def write_bucket(self, bucket_start, tag_counts, port_protocol_counts, five_tuple_counts=None):
+        """
+        Add the aggregates of one bucket to the store. See write_buckets.
+        """
+        self.write_buckets({bucket_start: (tag_counts, port_protocol_counts, five_tuple_counts)})
+
+    def write_buckets(self, buckets):
+        """
+        Add the aggregates of buckets to the store.
+
+        Every bucket is merged into its bucket segment if that already exists. The buckets of
+        each rollup period are added up in memory first, so every rollup segment is rewritten
+        once per call rather than once per bucket.
+
+        Args:
+            buckets (dict): A dictionary mapping bucket start to (tag_counts,
+                port_protocol_counts, five_tuple_counts), where five_tuple_counts may be None.
+
+        Time Complexity:
+            O((n + r) log (n + r)), where n is the number of keys in the buckets and r the
+            number of keys already in their segments.
+
+        Space Complexity:
+            O(n + r) - The merged aggregates of a segment are encoded in memory before they are written.
+        """
+        rollups = {}
+        for bucket_start in sorted(buckets):
+            tag_counts, port_protocol_counts, five_tuple_counts = buckets[bucket_start]
+            aggregates = (tag_counts, port_protocol_counts, five_tuple_counts or {})
+            self._merge_segment("bucket", bucket_start, self.bucket_seconds, aggregates)
+            if self.rollup_seconds is None:
+                continue
+            rollup = rollups.setdefault(bucket_start - bucket_start % self.rollup_seconds, ({}, {}, {}))
+            for rollup_counts, counts in zip(rollup, aggregates):
+                for key, count in counts.items():
+                    rollup_counts[key] = rollup_counts.get(key, 0) + count
+        for rollup_start, aggregates in rollups.items():
+            self._merge_segment("rollup", rollup_start, self.rollup_seconds, aggregates)
+
+    def _merge_segment(self, kind, segment_start, segment_seconds, aggregates):
+        """
+        Add aggregates to a segment, creating it if it does not exist.
+        """
+        if os.path.exists(self.segment_path(segment_start, kind)):
+            segment = self.segment(segment_start, kind)
+            merged = []
+            for aggregate, counts in zip(AGGREGATES, aggregates):
+                merged_counts = dict(segment.items(aggregate))
+                for key, count in counts.items():
+                    merged_counts[key] = merged_counts.get(key, 0) + count
+                merged.append(merged_counts)
+            aggregates = merged
+            self._segments.pop((kind, segment_start))[1].close()
+        write_segment(self.segment_path(segment_start, kind), segment_start, segment_seconds,
+                      encode_segment_columns(*aggregates))
+
+    def range_sum(self, aggregate, start=None, end=None, key=None):
+        """
+        Sum an aggregate over the buckets that overlap a time range.
+
+        Args:
+            aggregate (str): "tag_counts", "port_protocol_counts" or "five_tuple_counts".
+            start (int): The first timestamp of the range, or None for no lower bound.
+            end (int): The timestamp after the range, or None for no upper bound.
+            key: A single key to sum, or None to sum every key.
+
+        Returns:
+            int or dict: The total count of key, or a dictionary mapping every key to its total.
+
+        Time Complexity:
+            O(s log n) for a single key, otherwise O(s * n), where s is the number of segments
+            in the plan and n the number of keys per segment.
+
+        Space Complexity:
+            O(1) for a single key, otherwise O(u), where u is the number of distinct keys.
+        """
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {aggregate}")
+        segments = [self.segment(segment_start, kind) for kind, segment_start in self.plan(start, end)]
+        if key is not None:
+            return sum(segment.get(aggregate, key) for segment in segments)
+        if aggregate == "port_protocol_counts":
+            return self._sum_port_protocols(segments)
+        totals = {}
+        for segment in segments:
+            if not totals:
+                totals = dict(segment.items(aggregate))
+                continue
+            for segment_key, count in segment.items(aggregate):
+                totals[segment_key] = totals.get(segment_key, 0) + count
+        return totals
+
+    @staticmethod
+    def _sum_port_protocols(segments):
+        """
+        Sum port-protocol counts in dense per-protocol arrays indexed by port, straight from
+        the packed key columns, so no key tuples are built until the totals are returned.
+        """
+        totals = {}
+        for segment in segments:
+            codes, counts = segment.columns["pp_keys"], segment.counts("port_protocol_counts")
+            for protocol_id, protocol in enumerate(segment.protocols):
+                base = protocol_id << 16
+                low, high = bisect.bisect_left(codes, base), bisect.bisect_left(codes, base + 0x10000)
+                port_totals = totals.get(protocol)
+                if port_totals is None:
+                    totals[protocol] = port_totals = array('Q', bytes(8 * 0x10000))
+                for code, count in zip(codes[low:high], counts[low:high]):
+                    port_totals[code - base] += count
+        return {(port, protocol): count for protocol in sorted(totals)
+                for port, count in enumerate(totals[protocol]) if count}
+
+    def top_k(self, aggregate, k=10, start=None, end=None):
+        """
+        Get the k keys of an aggregate with the highest totals over a time range.
+
+        Args:
+            aggregate (str): "tag_counts", "port_protocol_counts" or "five_tuple_counts".
+            k (int): The number of keys.
+            start (int): The first timestamp of the range, or None for no lower bound.
+            end (int): The timestamp after the range, or None for no upper bound.
+
+        Returns:
+            list: (key, count) tuples, highest count first.
+
+        Time Complexity:
+            O(s * n + u log k), where s is the number of segments in the plan, n the number of
+            keys per segment and u the number of distinct keys.
+
+        Space Complexity:
+            O(u) - The totals of every distinct key.
+        """
+        totals = self.range_sum(aggregate, start, end)
+        return heapq.nlargest(k, totals.items(), key=lambda item: item[1])
+
+
+def write_flow_logs_to_store(lookup_table, flow_log_path, store, error_sink, time_field="start", batch_lines=100000,
+                             lateness_seconds=None):
+    """
+    Process flow logs in one pass and add their aggregates to a store, bucketed by time.
+
+    Buckets are written as soon as the latest bucket seen is more than lateness_seconds past
+    them, so only the buckets near the front of the logs are held in memory. A line that
+    arrives for a bucket that was already written starts that bucket again, and it is merged
+    into the stored segment when it is written, so late lines are never lost.
+
+    Args:
+        lookup_table (LookupTable): The lookup table used to tag flows.
+        flow_log_path (str or Path): A flow log file, directory or glob pattern.
+        store (AggregateStore): The store to write to.
+        error_sink (ErrorSink): The sink that receives rejected lines. It is closed at the end.
+        time_field (str): "start" or "end", the timestamp that assigns a line to a bucket.
+        batch_lines (int): The number of lines aggregated at a time.
+        lateness_seconds (int): How far behind the latest bucket a bucket is kept before it is
+            written. Defaults to one bucket.
+
+    Returns:
+        list: The start timestamps of the buckets that were written.
+
+    Time Complexity:
+        O(n + b * m log m), where n is the number of lines, b the number of buckets and m
+        the number of keys per bucket.
+
+    Space Complexity:
+        O(c * m), where c is the number of buckets within lateness_seconds of the latest one.
+    """
+    if lateness_seconds is None:
+        lateness_seconds = store.bucket_seconds
+    aggregates = WindowedAggregates(lookup_table, error_sink, store.bucket_seconds, retention_seconds=None,
+                                    time_field=time_field, count_five_tuples=True)
+    written = set()
+    try:
+        for flow_log_file in resolve_flow_log_files(flow_log_path):
+            lines = iter_flow_log_lines(flow_log_file)
+            while True:
+                batch = list(islice(lines, batch_lines))
+                if not batch:
+                    break
+                aggregates.add_lines(batch)
+                if aggregates.watermark is None:
+                    continue
+                oldest_bucket = aggregates.watermark - lateness_seconds
+                finished = [bucket_start for bucket_start in aggregates.buckets if bucket_start < oldest_bucket]
+                if finished:
+                    _write_finished_buckets(store, aggregates, finished)
+                    written.update(finished)
+    finally:
+        error_sink.close()
+    written.update(aggregates.buckets)
+    _write_finished_buckets(store, aggregates, list(aggregates.buckets))
+    return sorted(written)
+
+
+def _write_finished_buckets(store, aggregates, bucket_starts):
+    """
+    Remove buckets from the windowed aggregates and add them to the store.
+    """
+    buckets = {}
+    for bucket_start in bucket_starts:
+        bucket = aggregates.buckets.pop(bucket_start)
+        buckets[bucket_start] = (bucket.tag_counts, bucket.port_protocol_counts, bucket.get_five_tuple_counts_dict())
+    store.write_buckets(buckets)
+
+
+def main():
+    """
+    Query an aggregate store from the command line and print the result as JSON.
+    """
+    parser = argparse.ArgumentParser(description="Query the aggregates of a flow log store.")
+    parser.add_argument("store_path")
+    parser.add_argument("aggregate", choices=AGGREGATES)
+    parser.add_argument("--start", type=int, help="first timestamp of the range")
+    parser.add_argument("--end", type=int, help="timestamp after the range")
+    parser.add_argument("--top", type=int, default=10, help="number of keys to list")
+    parser.add_argument("--bucket-seconds", type=int, default=3600)
+    parser.add_argument("--rollup-seconds", type=int, default=86400)
+    args = parser.parse_args()
+
+    store = AggregateStore(args.store_path, args.bucket_seconds, args.rollup_seconds)
+    top = store.top_k(args.aggregate, args.top, args.start, args.end)
+    print(json.dumps([{"key": key, "count": count} for key, count in top], indent=2))
+
+
+if __name__ == "__main__":
+    main()
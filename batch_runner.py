@@ -0,0 +1,377 @@
+import glob
+import os
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import chain
+from flow_log_schema import DEFAULT_SCHEMA, FlowLogSchema
+from vpc_log_parser import (ErrorSink, FlowLogProcessor, _init_shard_worker, _partial_results, _worker_processor,
+                            compute_shards, detect_flow_log_schema, is_compressed, iter_flow_log_lines)
+
+BATCH_BYTES = 8 * 1024 * 1024  # small files are grouped into batches of about this many bytes
+BATCH_FILES = 512  # and at most this many files, so one batch never holds up the end of the run
+SHARD_BYTES = 64 * 1024 * 1024  # uncompressed files larger than this are split into shards of this size
+MANIFEST_PREFIX = "@"
+
+
+def _walk_files(directory):
+    """
+    Yield the (path, size) of every file below a directory, recursively, in sorted order.
+    """
+    with os.scandir(directory) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            yield from _walk_files(entry.path)
+        elif entry.is_file():
+            yield entry.path, entry.stat().st_size
+
+
+def _read_manifest(manifest_path):
+    """
+    Read the entries of a manifest file. Relative entries are relative to the manifest.
+    """
+    base = os.path.dirname(manifest_path)
+    with open(manifest_path, "r", encoding="utf-8") as manifest:
+        for line in manifest:
+            entry = line.strip()
+            if entry and not entry.startswith("#"):
+                yield os.path.join(base, entry)
+
+
+def resolve_batch_inputs(inputs):
+    """
+    Expand the inputs of a batch run into the flow log files they refer to.
+
+    Args:
+        inputs (iterable): Paths. A directory expands to every file below it, recursively;
+            a glob pattern to the files it matches, where ** also matches nested
+            directories; and a path prefixed with "@" to the entries of a manifest file,
+            one path, directory or glob pattern per line (blank lines and lines starting
+            with # are skipped). Any other path is a single file.
+
+    Returns:
+        tuple: The list of (path, size) of the files, in input order and with every file
+        once, and the list of (path, error message) of the inputs that could not be read.
+
+    Time Complexity:
+        O(f log f), where f is the number of files, since directories and matches are sorted.
+
+    Space Complexity:
+        O(f) - The list of files.
+    """
+    files = []
+    failures = []
+    seen = set()
+
+    def expand(entry):
+        if entry.startswith(MANIFEST_PREFIX):
+            manifest_path = entry[len(MANIFEST_PREFIX):]
+            try:
+                manifest_entries = list(_read_manifest(manifest_path))
+            except (OSError, UnicodeDecodeError) as e:
+                failures.append((manifest_path, f"Could not read manifest: {e}"))
+                return
+            for manifest_entry in manifest_entries:
+                expand(manifest_entry)
+            return
+        if os.path.isdir(entry):
+            matches = _walk_files(entry)
+        elif glob.has_magic(entry):
+            matches = ((path, None) for path in sorted(glob.glob(entry, recursive=True)) if os.path.isfile(path))
+        else:
+            matches = [(entry, None)]
+        for path, size in matches:
+            key = os.path.normpath(path)
+            if key in seen:
+                continue
+            seen.add(key)
+            if size is None:
+                try:
+                    size = os.path.getsize(path)
+                except OSError as e:
+                    failures.append((path, f"Could not read file: {e}"))
+                    continue
+            files.append((path, size))
+
+    for entry in inputs:
+        expand(str(entry))
+    return files, failures
+
+
+def _read_entry(flow_log_path, start, end, schema, buffered=False):
+    """
+    Open a whole flow log file, or a byte range of one, for a worker's processor.
+
+    A whole file is read once: its first line is checked for a header before the rest is
+    streamed, so no file is opened twice. Byte ranges come with the schema of their file.
+    With buffered, a whole file is read completely before its lines are returned, so a file
+    that cannot be read fails here rather than halfway through being aggregated.
+
+    Returns:
+        tuple: The lines of the entry and their schema.
+    """
+    if end is not None:
+        return iter_flow_log_lines(flow_log_path, start, end), schema
+    lines = iter_flow_log_lines(flow_log_path)
+    if buffered:
+        lines = iter(list(lines))
+    first_line = next(lines, None)
+    if first_line is None:
+        return (), schema
+    header_schema = FlowLogSchema.from_header(first_line)
+    return chain((first_line,), lines), header_schema if header_schema is not None else schema
+
+
+def _process_batch(batch, initargs=None):
+    """
+    Process a batch of flow log files, or one shard of a large file, inside a worker process.
+
+    The files are aggregated by one processor, so a file costs no more than opening it. The
+    files of a batch of several are small, and each is read completely before it is
+    aggregated, so a file that cannot be read is simply left out. Only if a file fails while
+    it is being aggregated does the batch start over with a new processor and without that
+    file, so that no partial counts of a failed file end up in the results; a file that
+    fails while the batch starts over is left out in the same way.
+
+    Args:
+        batch (tuple): The schema of files without a header line, and a list of
+            (path, start, end, schema) entries: end and schema are None for a whole file.
+        initargs (tuple): The arguments of _init_shard_worker, when the batch is processed
+            outside a worker process.
+
+    Returns:
+        tuple: The partial results of the files that were processed, as _process_shard returns
+        them, and the list of (path, error message) of the files that failed, in file order.
+    """
+    default_schema, entries = batch
+    buffered = len(entries) > 1
+    failures = {}
+    while True:
+        processor = _worker_processor(None, default_schema, initargs)
+        for index, (flow_log_path, start, end, schema) in enumerate(entries):
+            if index in failures:
+                continue
+            schema = schema if schema is not None else default_schema
+            try:  # a corrupt or unreadable file must not abort the run
+                lines, lines_schema = _read_entry(flow_log_path, start, end, schema, buffered)
+            except Exception as e:
+                failures[index] = (flow_log_path, f"{type(e).__name__}: {e}")
+                continue
+            try:
+                processor._process_lines(lines, lines_schema)
+            except Exception as e:
+                failures[index] = (flow_log_path, f"{type(e).__name__}: {e}")
+                break  # the processor holds part of the file, so the batch starts over without it
+        else:
+            return _partial_results(processor), [failures[index] for index in sorted(failures)]
+
+
+class BatchRunner:
+    """
+    This class processes many flow log files with a process pool and merges them into one set
+    of aggregates.
+
+    The lookup table is loaded once and frozen, and every worker receives it once when it
+    starts rather than with every file. Small files are grouped into batches so that a file
+    costs little more than being opened, and files larger than shard_bytes are split into
+    shards. The batches and shards are submitted largest first to a pool whose idle
+    workers take the next one from a shared queue, so a huge file starts early and is
+    spread over several workers instead of stalling the end of the run.
+
+    The partial results are merged in file order, whatever order they finish in, so the
+    counts, their ordering and the error log are the same as a serial run over the files.
+    Results that finish before an earlier file's wait for it, so at most max_pending units
+    are submitted but not yet merged; once that many are outstanding, only the units of the
+    next file to merge are submitted, and a slow early file holds back new work instead of
+    letting later results pile up in memory. With one worker the units run in file order.
+    A file that cannot be read is reported in self.failures and left out of the counts,
+    and the run carries on.
+    """
+    def __init__(self, lookup_table, error_sink=None, workers=None, five_tuple_sketch=None, volume_metrics=False,
+                 schema=None, batch_bytes=BATCH_BYTES, batch_files=BATCH_FILES, shard_bytes=SHARD_BYTES,
+                 max_pending=None):
+        """
+        Initialize the BatchRunner class.
+
+        Args:
+            lookup_table (LookupTable): The lookup table, shared by all workers.
+            error_sink (ErrorSink): Where the rejected lines of all files are reported.
+            workers (int): The number of worker processes. Defaults to os.cpu_count(). With
+                one worker, the files are processed in this process.
+            five_tuple_sketch (HeavyHitterSketch): Count five tuples approximately when given.
+            volume_metrics (bool): Also sum packets, bytes and durations.
+            schema (FlowLogSchema): The schema of files without a header line.
+            batch_bytes (int): The approximate size of a batch of small files.
+            batch_files (int): The largest number of files in a batch.
+            shard_bytes (int): The size above which an uncompressed file is split into shards.
+            max_pending (int): The largest number of units submitted to the pool whose
+                results have not been merged yet. Defaults to four per worker.
+        """
+        self.lookup_table = lookup_table
+        self.error_sink = error_sink if error_sink is not None else ErrorSink()
+        self.workers = workers or os.cpu_count() or 1
+        self.five_tuple_sketch = five_tuple_sketch
+        self.volume_metrics = volume_metrics
+        self.schema = schema if schema is not None else DEFAULT_SCHEMA
+        self.batch_bytes = batch_bytes
+        self.batch_files = batch_files
+        self.shard_bytes = shard_bytes
+        self.max_pending = max_pending or 4 * self.workers
+        self.failures = []
+        self.files_processed = 0
+
+    def plan(self, files):
+        """
+        Split the files of a run into units of work.
+
+        Args:
+            files (list): (path, size) tuples in file order.
+
+        Returns:
+            list: (group, size, entries) units in file order, where groups are numbered from
+            0 in file order and entries are the
+            (path, start, end, schema) entries of _process_batch. A batch of small files is
+            a group of its own; the shards of a large file share a group, which is only
+            merged if all of its shards succeed.
+
+        Time Complexity:
+            O(f + s), where f is the number of files and s the number of shards.
+
+        Space Complexity:
+            O(f + s) - The list of units.
+        """
+        units = []
+        groups = 0
+        batch, batch_size = [], 0
+
+        def flush_batch():
+            nonlocal groups, batch, batch_size
+            if batch:
+                units.append((groups, batch_size, batch))
+                groups += 1
+            batch, batch_size = [], 0
+
+        for flow_log_path, size in files:
+            if size > self.shard_bytes and not is_compressed(flow_log_path):
+                flush_batch()
+                schema = detect_flow_log_schema(flow_log_path, self.schema)
+                for shard_path, start, end in compute_shards(flow_log_path, self.workers, self.shard_bytes):
+                    units.append((groups, end - start, [(shard_path, start, end, schema)]))
+                groups += 1
+                continue
+            if batch and (batch_size + size > self.batch_bytes or len(batch) >= self.batch_files):
+                flush_batch()
+            batch.append((flow_log_path, 0, None, None))
+            batch_size += size
+        flush_batch()
+        return units
+
+    def run(self, inputs):
+        """
+        Process the flow log files of the inputs and merge their aggregates.
+
+        Args:
+            inputs (iterable): Directories, glob patterns, manifests and files, as taken by
+                resolve_batch_inputs.
+
+        Returns:
+            FlowLogProcessor: A processor holding the merged aggregates of all files, to be
+            written with a Writer or saved as an AggregateState.
+
+        Time Complexity:
+            O(n / w + s), where n is the number of lines, w is the number of workers and s
+            is the total size of the partial results that have to be merged.
+
+        Space Complexity:
+            O(p * (m + k + t)), where p is max_pending plus the shards of one file - Partial
+            results are held until the results of every earlier file have been merged.
+        """
+        files, self.failures = resolve_batch_inputs(inputs)
+        units = self.plan(files)
+        merged = FlowLogProcessor(self.lookup_table, None, self.error_sink, self.five_tuple_sketch,
+                                  volume_metrics=self.volume_metrics, schema=self.schema)
+        group_sizes = Counter(group for group, size, entries in units)
+        finished = {}
+        progress = {"next_group": 0, "merged_units": 0}
+        try:
+            for unit_index, results in self._run_units(merged, units, progress):
+                group = units[unit_index][0]
+                finished.setdefault(group, {})[unit_index] = results
+                next_group = progress["next_group"]
+                while next_group in finished and len(finished[next_group]) == group_sizes[next_group]:
+                    self._merge_group(merged, units, finished.pop(next_group))
+                    progress["merged_units"] += group_sizes[next_group]
+                    next_group = progress["next_group"] = next_group + 1
+        finally:
+            self.error_sink.close()
+        return merged
+
+    def _run_units(self, merged, units, progress):
+        """
+        Run the units and yield (unit index, results) as they finish.
+
+        With one worker the units run in file order, so every result can be merged at once.
+        With a pool they are submitted largest first, as long as fewer than max_pending units
+        are outstanding (submitted but not merged, according to progress, which the caller
+        updates between results); beyond that only the units of progress["next_group"], the
+        group the caller waits for, are submitted.
+        """
+        initargs = merged.worker_initargs()
+        if self.workers == 1 or len(units) <= 1:
+            for unit_index, (group, size, entries) in enumerate(units):
+                yield unit_index, _process_batch((self.schema, entries), initargs)
+            return
+        by_size = deque(sorted(range(len(units)), key=lambda unit_index: units[unit_index][1], reverse=True))
+        unsubmitted = set(range(len(units)))
+        group_units = {}
+        for unit_index, (group, size, entries) in enumerate(units):
+            group_units.setdefault(group, []).append(unit_index)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_shard_worker,
+                                 initargs=initargs) as executor:
+            futures = {}
+            while True:
+                while unsubmitted:
+                    outstanding = len(units) - len(unsubmitted) - progress["merged_units"]
+                    if outstanding >= self.max_pending:
+                        # only the next group to merge may start, or the results waiting for it would grow
+                        unit_index = next((unit_index for unit_index in group_units.get(progress["next_group"], ())
+                                           if unit_index in unsubmitted), None)
+                        if unit_index is None:
+                            break
+                    else:
+                        unit_index = by_size.popleft()
+                        if unit_index not in unsubmitted:
+                            continue
+                    unsubmitted.discard(unit_index)
+                    futures[executor.submit(_process_batch, (self.schema, units[unit_index][2]))] = unit_index
+                if not futures:
+                    return
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    unit_index = futures.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:  # for example a worker that died; its files are reported as failed
+                        results = (None, [(entry[0], f"{type(e).__name__}: {e}") for entry in units[unit_index][2]])
+                    yield unit_index, results
+
+    def _merge_group(self, merged, units, group_results):
+        """
+        Merge the results of the units of a group in order, or report its file as failed if a shard failed.
+        """
+        unit_indexes = sorted(group_results)
+        first_entry = units[unit_indexes[0]][2][0]
+        if first_entry[2] is not None:  # the shards of one file have an end offset
+            failures = [failure for unit_index in unit_indexes for failure in group_results[unit_index][1]]
+            if failures:
+                self.failures.append(failures[0])
+                return
+            for unit_index in unit_indexes:
+                merged.merge_partial_results(group_results[unit_index][0])
+            self.files_processed += 1
+            return
+        partial_results, failures = group_results[unit_indexes[0]]
+        self.failures.extend(failures)
+        if partial_results is not None:
+            merged.merge_partial_results(partial_results)
+        self.files_processed += len(units[unit_indexes[0]][2]) - len(failures)
@@ -0,0 +1,193 @@
+import argparse
+import random
+
+BATCH_LINES = 100000
+BASE_TIMESTAMP = 1700000000
+TAG_COUNT = 50
+PROTOCOLS = ("tcp", "udp")
+ERROR_LINE_KINDS = ("field_count", "invalid_port", "port_range", "protocol")
+
+
+def zipf_weights(count, skew):
+    """
+    Get Zipf weights for ranks 1 to count.
+
+    Args:
+        count (int): The number of ranks.
+        skew (float): The Zipf exponent. 0 gives a uniform distribution; larger values
+            concentrate the weight on the first ranks.
+
+    Returns:
+        list: The weight of every rank.
+    """
+    return [1 / rank ** skew for rank in range(1, count + 1)]
+
+
+def ranked_ports(seed):
+    """
+    Get every port in a fixed, shuffled popularity order.
+
+    Args:
+        seed (int): The seed of the shuffle.
+
+    Returns:
+        list: The ports 0 to 65535, most popular first.
+    """
+    ports = list(range(65536))
+    random.Random(seed).shuffle(ports)
+    return ports
+
+
+def random_ip(rng):
+    return f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def generate_flow_prefixes(cardinality, port_skew, seed):
+    """
+    Generate the distinct flows of a synthetic flow log.
+
+    Every flow is the first ten fields of a version 2 flow log record, up to and including
+    the bytes field, followed by a comma. The destination ports follow a Zipf distribution
+    over the port popularity order of ranked_ports.
+
+    Args:
+        cardinality (int): The number of distinct flows.
+        port_skew (float): The Zipf exponent of the destination ports.
+        seed (int): The seed of the generator.
+
+    Returns:
+        list: The flow prefixes.
+    """
+    rng = random.Random(seed)
+    ports = ranked_ports(seed)
+    dst_ports = rng.choices(ports, weights=zipf_weights(len(ports), port_skew), k=cardinality)
+    flows = []
+    for dst_port in dst_ports:
+        flows.append(f"2,123456789012,eni-{rng.randrange(16 ** 8):08x},{random_ip(rng)},{random_ip(rng)},"
+                     f"{rng.randrange(1024, 65536)},{dst_port},{rng.choice(PROTOCOLS)},"
+                     f"{rng.randrange(1, 100)},{rng.randrange(40, 100000)},")
+    return flows
+
+
+def generate_error_prefixes(count, seed):
+    """
+    Generate flow prefixes that the parser rejects, cycling through ERROR_LINE_KINDS.
+
+    Args:
+        count (int): The number of prefixes.
+        seed (int): The seed of the generator.
+
+    Returns:
+        list: The flow prefixes.
+    """
+    rng = random.Random(seed + 1)
+    errors = []
+    for index in range(count):
+        kind = ERROR_LINE_KINDS[index % len(ERROR_LINE_KINDS)]
+        source_ip, dest_ip = random_ip(rng), random_ip(rng)
+        if kind == "field_count":
+            errors.append(f"2,123456789012,eni-0a1b2c3d,{source_ip},{dest_ip},{rng.randrange(1024, 65536)},443,tcp,")
+        elif kind == "invalid_port":
+            errors.append(f"2,123456789012,eni-0a1b2c3d,{source_ip},{dest_ip},{rng.randrange(1024, 65536)},https,tcp,5,500,")
+        elif kind == "port_range":
+            errors.append(f"2,123456789012,eni-0a1b2c3d,{source_ip},{dest_ip},{rng.randrange(1024, 65536)},{rng.randrange(65536, 100000)},tcp,5,500,")
+        else:
+            errors.append(f"2,123456789012,eni-0a1b2c3d,{source_ip},{dest_ip},{rng.randrange(1024, 65536)},0,icmp,5,500,")
+    return errors
+
+
+def write_flow_log(flow_log_path, lines, error_rate=0.01, cardinality=100000, port_skew=1.1, seed=0):
+    """
+    Write a synthetic version 2 flow log.
+
+    Lines are drawn from a pool of distinct flows and, with probability error_rate, from a
+    pool of invalid lines, and written in batches, so the generator's memory use depends on
+    the cardinality and not on the number of lines. The start field increases by one second
+    per line and every flow lasts a minute.
+
+    Args:
+        flow_log_path (str or Path): The path of the flow log to write.
+        lines (int): The number of lines.
+        error_rate (float): The fraction of lines that the parser rejects.
+        cardinality (int): The number of distinct valid flows.
+        port_skew (float): The Zipf exponent of the destination ports.
+        seed (int): The seed of the generator; the same arguments always give the same file.
+
+    Returns:
+        int: The size of the flow log in bytes.
+
+    Time Complexity:
+        O(n + c), where n is the number of lines and c the cardinality.
+
+    Space Complexity:
+        O(c + b), where b is the number of lines per batch.
+    """
+    rng = random.Random(seed)
+    flows = generate_flow_prefixes(cardinality, port_skew, seed)
+    errors = generate_error_prefixes(max(1, min(cardinality, 1000)), seed) if error_rate > 0 else []
+    population = flows + errors
+    cum_weights = []
+    total = 0.0
+    for index in range(len(population)):
+        total += (1 - error_rate) / len(flows) if index < len(flows) else error_rate / len(errors)
+        cum_weights.append(total)
+
+    size = 0
+    with open(flow_log_path, "w", encoding="utf-8") as flow_log_file:
+        for batch_start in range(0, lines, BATCH_LINES):
+            batch_lines = min(BATCH_LINES, lines - batch_start)
+            prefixes = rng.choices(population, cum_weights=cum_weights, k=batch_lines)
+            start = BASE_TIMESTAMP + batch_start
+            batch = "".join([f"{prefix}{timestamp},{timestamp + 60},ACCEPT,OK\n"
+                             for timestamp, prefix in enumerate(prefixes, start)])
+            size += flow_log_file.write(batch)
+    return size
+
+
+def write_lookup_table(lookup_table_path, size, seed=0):
+    """
+    Write a lookup table for a synthetic flow log.
+
+    The entries are the most popular ports of ranked_ports, so with a skewed port
+    distribution a small table already tags most of the traffic.
+
+    Args:
+        lookup_table_path (str or Path): The path of the lookup table to write.
+        size (int): The number of (port, protocol) entries, at most 131072.
+        seed (int): The seed of the generator; it must match the flow log's seed.
+
+    Returns:
+        int: The number of entries written.
+    """
+    size = min(size, 65536 * len(PROTOCOLS))
+    ports = ranked_ports(seed)
+    with open(lookup_table_path, "w", encoding="utf-8") as lookup_table_file:
+        lookup_table_file.write("dstport,protocol,tag\n")
+        for index in range(size):
+            port = ports[index // len(PROTOCOLS)]
+            protocol = PROTOCOLS[index % len(PROTOCOLS)]
+            lookup_table_file.write(f"{port},{protocol},sv_P{index % TAG_COUNT}\n")
+    return size
+
+
+def main():
+    """
+    Write a synthetic flow log and lookup table from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Generate a synthetic version 2 flow log and lookup table.")
+    parser.add_argument("flow_log_path")
+    parser.add_argument("lookup_table_path")
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--cardinality", type=int, default=100000)
+    parser.add_argument("--port-skew", type=float, default=1.1)
+    parser.add_argument("--lookup-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_flow_log(args.flow_log_path, args.lines, args.error_rate, args.cardinality, args.port_skew, args.seed)
+    write_lookup_table(args.lookup_table_path, args.lookup_size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
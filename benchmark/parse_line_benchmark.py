@@ -0,0 +1,91 @@
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from benchmark.generate_flow_logs import write_flow_log
+from vpc_log_parser import ErrorSink, FlowLogProcessor
+
+
+def time_per_line(parse, lines, repeat):
+    """
+    Measure the fastest time a parser takes per line.
+
+    Args:
+        parse (callable): The parser, called with every line.
+        lines (list): The lines, as bytes.
+        repeat (int): The number of times the lines are parsed.
+
+    Returns:
+        float: The fastest time per line in nanoseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            parse(line)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best / len(lines) * 1e9
+
+
+def run_parse_line_benchmark(lines=200000, error_rate=0.01, cardinality=100000, repeat=5, seed=0):
+    """
+    Compare the per-line cost of FlowLogProcessor.parse_line with validate_line.
+
+    validate_line splits every line into all of its fields and converts the ports with int(),
+    which is what parse_line did before it got its fast path. Both parsers run on the same
+    synthetic lines, after a warm-up pass that fills the port table, and rejected lines are
+    only counted so writing the error log is not measured.
+
+    Args:
+        lines (int): The number of lines parsed per repeat.
+        error_rate (float): The fraction of invalid lines.
+        cardinality (int): The number of distinct valid flows.
+        repeat (int): The number of timed passes per parser; the fastest is reported.
+        seed (int): The seed of the generator.
+
+    Returns:
+        dict: The nanoseconds per line of both parsers and the speedup of parse_line.
+
+    Time Complexity:
+        O(r * n), where r is the number of repeats and n the number of lines.
+
+    Space Complexity:
+        O(n) - The lines are held in memory so reading them is not measured.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        flow_log_path = Path(work_dir) / "flow_log.txt"
+        write_flow_log(flow_log_path, lines, error_rate, cardinality, seed=seed)
+        flow_lines = flow_log_path.read_bytes().splitlines(keepends=True)
+        processor = FlowLogProcessor(None, flow_log_path, ErrorSink(Path(work_dir) / "error_log.txt", mode="counts"))
+        for line in flow_lines:
+            processor.parse_line(line)
+        results = {"validate_line": time_per_line(processor.validate_line, flow_lines, repeat),
+                   "parse_line": time_per_line(processor.parse_line, flow_lines, repeat)}
+        processor.error_sink.close()
+    return {
+        "lines": lines,
+        "ns_per_line": results,
+        "speedup": results["validate_line"] / results["parse_line"],
+    }
+
+
+def main():
+    """
+    Run the line parser micro-benchmark and print the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description="Compare the per-line cost of the flow log line parsers.")
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--cardinality", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run_parse_line_benchmark(args.lines, args.error_rate, args.cardinality, args.repeat, args.seed),
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from pathlib import Path
+
+from benchmark.generate_flow_logs import write_flow_log, write_lookup_table
+from instrumentation import peak_rss_bytes
+from vpc_log_parser import ErrorSink, FlowLogProcessor, LookupTable, Writer
+
+WRITER_OUTPUTS = ("output_tag_counts", "output_port_protocol_counts", "output_five_tuple_counts")
+
+
+def timed(function, *args):
+    """
+    Call a function and measure its wall clock time.
+
+    Returns:
+        tuple: (result, seconds).
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def create_processor(lookup_table, flow_log_path, error_log_path, error_log_mode, engine):
+    """
+    Create the flow log processor of an engine.
+    """
+    error_sink = ErrorSink(error_log_path, mode=error_log_mode)
+    if engine == "numpy":
+        from numpy_engine import NumpyFlowLogProcessor  # NumPy is only needed for this engine
+        return NumpyFlowLogProcessor(lookup_table, flow_log_path, error_sink)
+    return FlowLogProcessor(lookup_table, flow_log_path, error_sink)
+
+
+def run_benchmark(flow_log_path, lookup_table_path, work_dir, repeat=1, engine="python", workers=1, error_log_mode="full"):
+    """
+    Time every stage of a run over a flow log.
+
+    Every stage is run repeat times and its fastest time is reported. The Writer outputs are
+    written to work_dir, which is the current directory while they run.
+
+    Args:
+        flow_log_path (Path): The flow log to process.
+        lookup_table_path (Path): The lookup table to load.
+        work_dir (Path): The directory the error log and output files are written to.
+        repeat (int): The number of times every stage is run.
+        engine (str): "python" or "numpy".
+        workers (int): The number of worker processes; 1 processes the flow log serially.
+        error_log_mode (str): The ErrorSink mode.
+
+    Returns:
+        dict: The input size, the time of every stage with lines and megabytes per second for
+        processing, the number of rejected lines and the peak RSS of this process.
+
+    Time Complexity:
+        O(r * n), where r is the number of repeats and n the number of lines.
+
+    Space Complexity:
+        O(u), where u is the number of distinct keys in the aggregates.
+    """
+    flow_log_path, work_dir = Path(flow_log_path).resolve(), Path(work_dir).resolve()
+    lookup_table_path = Path(lookup_table_path).resolve()
+    error_log_path = work_dir / "error_log.txt"
+    size = flow_log_path.stat().st_size
+    with open(flow_log_path, "rb") as flow_log_file:
+        lines = sum(chunk.count(b"\n") for chunk in iter(lambda: flow_log_file.read(1024 * 1024), b""))
+
+    stages = {}
+    lookup_table, stages["lookup_table_load"] = min((timed(LookupTable, lookup_table_path) for _ in range(repeat)),
+                                                     key=lambda result: result[1])
+
+    process_seconds = None
+    for _ in range(repeat):
+        if error_log_path.exists():
+            error_log_path.unlink()
+        processor = create_processor(lookup_table, flow_log_path, error_log_path, error_log_mode, engine)
+        if workers == 1:
+            _, seconds = timed(processor.process_log)
+        else:
+            _, seconds = timed(processor.process_log_parallel, workers)
+        process_seconds = seconds if process_seconds is None else min(process_seconds, seconds)
+    stages["process_log"] = process_seconds
+
+    writer = Writer(processor.get_tag_counts_dict(), processor.get_port_protocol_counts_dict(),
+                    processor.get_packed_five_tuple_counts())
+    writer_args = {"output_tag_counts": (False, None), "output_port_protocol_counts": (False, None),
+                   "output_five_tuple_counts": ()}
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for output in WRITER_OUTPUTS:
+            stages[output] = min(timed(getattr(writer, output), *writer_args[output])[1] for _ in range(repeat))
+    finally:
+        os.chdir(previous_dir)
+
+    return {
+        "input": {"lines": lines, "bytes": size},
+        "seconds": stages,
+        "lines_per_second": lines / process_seconds if process_seconds else None,
+        "mb_per_second": size / (1024 * 1024) / process_seconds if process_seconds else None,
+        "rejected_lines": sum(processor.get_error_summary().values()),
+        "distinct": {"tags": len(writer.tag_counts), "port_protocols": len(writer.port_protocol_counts),
+                     "five_tuples": len(writer.five_tuple_counts)},
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def main():
+    """
+    Generate a synthetic flow log, benchmark it and print the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the flow log parser on a synthetic flow log.")
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--cardinality", type=int, default=100000)
+    parser.add_argument("--port-skew", type=float, default=1.1)
+    parser.add_argument("--lookup-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flow-log", help="benchmark this flow log instead of generating one")
+    parser.add_argument("--lookup-table", help="lookup table to use with --flow-log")
+    parser.add_argument("--engine", choices=("python", "numpy"), default="python")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--error-log-mode", choices=ErrorSink.MODES, default="full")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        parameters = {"engine": args.engine, "workers": args.workers, "error_log_mode": args.error_log_mode,
+                      "repeat": args.repeat}
+        if args.flow_log:
+            flow_log_path = Path(args.flow_log)
+            lookup_table_path = Path(args.lookup_table or "sample_files/lookup_table.csv")
+            parameters.update(flow_log=str(flow_log_path), lookup_table=str(lookup_table_path))
+        else:
+            flow_log_path, lookup_table_path = work_dir / "flow_log.txt", work_dir / "lookup_table.csv"
+            _, generate_seconds = timed(write_flow_log, flow_log_path, args.lines, args.error_rate,
+                                        args.cardinality, args.port_skew, args.seed)
+            write_lookup_table(lookup_table_path, args.lookup_size, args.seed)
+            parameters.update(lines=args.lines, error_rate=args.error_rate, cardinality=args.cardinality,
+                              port_skew=args.port_skew, lookup_size=args.lookup_size, seed=args.seed,
+                              generate_seconds=generate_seconds)
+        results = {"parameters": parameters, "python": platform.python_version()}
+        results.update(run_benchmark(flow_log_path, lookup_table_path, work_dir, args.repeat, args.engine,
+                                     args.workers, args.error_log_mode))
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
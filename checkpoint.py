@@ -0,0 +1,87 @@
+import os
+import pickle
+
+
+class Checkpoint:
+    """
+    This class persists the progress of an incremental flow log run.
+
+    A checkpoint records, for every input file, the identity of the file (device and inode)
+    and the byte offset up to which it has been processed, together with the aggregate
+    counts at that point and a fingerprint of the lookup table and schema they were counted
+    with. The checkpoint is written to a temporary file and renamed over the previous one,
+    so a crash while saving never leaves a half-written checkpoint behind.
+    """
+    VERSION = 4
+
+    def __init__(self, checkpoint_file):
+        """
+        Initialize the Checkpoint class.
+
+        Args:
+            checkpoint_file (str or Path): The path to the checkpoint file.
+        """
+        self.checkpoint_file = checkpoint_file
+
+    @staticmethod
+    def file_identity(flow_log_path):
+        """
+        Get the identity and current size of a file.
+
+        Args:
+            flow_log_path (str): The path to the file.
+
+        Returns:
+            tuple: ((device, inode), size). A rotated file has a new identity, a truncated
+            file a smaller size.
+        """
+        stat = os.stat(flow_log_path)
+        return (stat.st_dev, stat.st_ino), stat.st_size
+
+    def load(self):
+        """
+        Load the checkpoint.
+
+        Returns:
+            tuple: (files, aggregates, fingerprint), where files maps each path to its
+            (identity, offset), aggregates maps each aggregate name to its saved value and
+            fingerprint is the value passed to save. (None, None, None) if there is no
+            checkpoint or it was written by an incompatible version.
+
+        Time Complexity:
+            O(s), where s is the size of the saved aggregates.
+
+        Space Complexity:
+            O(s) - The saved aggregates are loaded into memory.
+        """
+        try:
+            with open(self.checkpoint_file, "rb") as checkpoint:
+                saved = pickle.load(checkpoint)
+        except FileNotFoundError:
+            return None, None, None
+        if saved.get("version") != self.VERSION:
+            return None, None, None
+        return saved["files"], saved["aggregates"], saved["fingerprint"]
+
+    def save(self, files, aggregates, fingerprint=None):
+        """
+        Atomically replace the checkpoint.
+
+        Args:
+            files (dict): A dictionary mapping each path to its (identity, offset).
+            aggregates (dict): A dictionary mapping each aggregate name to its value.
+            fingerprint: A picklable value identifying what the aggregates were counted with,
+                such as the lookup table and schema; a run with another one starts over.
+
+        Time Complexity:
+            O(s), where s is the size of the aggregates.
+
+        Space Complexity:
+            O(s) - The aggregates are serialized before they are written.
+        """
+        temporary_file = f"{self.checkpoint_file}.tmp"
+        with open(temporary_file, "wb") as checkpoint:
+            pickle.dump({"version": self.VERSION, "files": files, "aggregates": aggregates,
+                         "fingerprint": fingerprint},
+                        checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, self.checkpoint_file)
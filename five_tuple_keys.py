@@ -0,0 +1,132 @@
+import socket
+from functools import lru_cache
+
+PROTOCOL_IDS = {"tcp": 0, "udp": 1}
+PROTOCOLS_BY_ID = ("tcp", "udp")
+IPV4_LIMIT = 1 << 32
+IPV6_FLAG = 1 << 128  # set on the code of an IPv6 address, so "::a00:1" and "10.0.0.1" stay distinct
+IPV6_ADDRESS_BITS = 129  # 128 address bits and the flag
+RAW_ADDRESS = -1  # the code of an address that is not canonical IPv4 or IPv6 text
+IP_CACHE_SIZE = 1 << 16
+_IP_CODES = {}  # interned address codes, cleared when it reaches IP_CACHE_SIZE entries
+
+
+def _encode_ip(ip):
+    """
+    Encode the text of an IP address as an integer code.
+
+    Returns:
+        int: The 32-bit address of an IPv4 address, the 128-bit address with IPV6_FLAG set
+        for an IPv6 address, or RAW_ADDRESS if the text is not an address or is not written
+        the way inet_ntop writes it back (for example "2001:DB8::1"), so that decoding
+        always gives back the original text.
+    """
+    family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+    try:
+        packed = socket.inet_pton(family, ip)
+    except (OSError, ValueError):
+        return RAW_ADDRESS
+    if socket.inet_ntop(family, packed) != ip:
+        return RAW_ADDRESS
+    code = int.from_bytes(packed, 'big')
+    return code | IPV6_FLAG if family == socket.AF_INET6 else code
+
+
+def ip_code(ip):
+    """
+    Get the integer code of an IP address, interning it in a bounded cache.
+
+    Args:
+        ip (str): The text of the address.
+
+    Returns:
+        int: The code of the address, or RAW_ADDRESS (see _encode_ip).
+
+    Time Complexity:
+        O(1) amortized - Addresses are only parsed the first time they are seen after the
+        cache was last cleared.
+
+    Space Complexity:
+        O(1) - The cache holds at most IP_CACHE_SIZE addresses.
+    """
+    code = _IP_CODES.get(ip)
+    if code is None:
+        code = _encode_ip(ip)
+        if len(_IP_CODES) >= IP_CACHE_SIZE:
+            _IP_CODES.clear()
+        _IP_CODES[ip] = code
+    return code
+
+
+@lru_cache(maxsize=65536)
+def ip_text(code):
+    """
+    Get the text of an IP address from its integer code.
+    """
+    if code & IPV6_FLAG:
+        return socket.inet_ntop(socket.AF_INET6, (code ^ IPV6_FLAG).to_bytes(16, 'big'))
+    return socket.inet_ntop(socket.AF_INET, code.to_bytes(4, 'big'))
+
+
+def pack_five_tuple(source_ip, dest_ip, source_port, dst_port, protocol):
+    """
+    Pack a five tuple into a single integer key.
+
+    From the least significant bit, the key holds a layout bit, the protocol ID (8 bits), the
+    destination port (16 bits), the source port (16 bits), and then the destination and
+    source address codes. With two IPv4 addresses the layout bit is 0 and each address takes
+    32 bits, so the key fits in 105 bits; otherwise it is 1 and each address takes 129 bits.
+    A five tuple with an address that has no code, or a protocol without an ID, is returned
+    as the plain tuple, which decode_five_tuple passes through unchanged.
+
+    Args:
+        source_ip (str): The source address.
+        dest_ip (str): The destination address.
+        source_port (int): The source port.
+        dst_port (int): The destination port.
+        protocol (str): The protocol.
+
+    Returns:
+        int or tuple: The key of the five tuple.
+
+    Time Complexity:
+        O(1) - A few integer operations once both addresses are interned.
+
+    Space Complexity:
+        O(1) - One integer of at most 299 bits.
+    """
+    source_code = _IP_CODES.get(source_ip)  # ip_code is only called for addresses that are not interned
+    if source_code is None:
+        source_code = ip_code(source_ip)
+    dest_code = _IP_CODES.get(dest_ip)
+    if dest_code is None:
+        dest_code = ip_code(dest_ip)
+    protocol_id = PROTOCOL_IDS.get(protocol)
+    if source_code < 0 or dest_code < 0 or protocol_id is None:
+        return (source_ip, dest_ip, source_port, dst_port, protocol)
+    if (source_code | dest_code) < IPV4_LIMIT:
+        return source_code << 73 | dest_code << 41 | source_port << 25 | dst_port << 9 | protocol_id << 1
+    return (source_code << (41 + IPV6_ADDRESS_BITS) | dest_code << 41 | source_port << 25 | dst_port << 9
+            | protocol_id << 1 | 1)
+
+
+def decode_five_tuple(key):
+    """
+    Unpack a key built by pack_five_tuple into the (source_ip, dest_ip, source_port,
+    dst_port, protocol) tuple it was built from.
+
+    Args:
+        key (int or tuple): The packed key, or a five tuple that could not be packed.
+
+    Returns:
+        tuple: The five tuple.
+    """
+    if type(key) is not int:
+        return key
+    addresses = key >> 41
+    if key & 1:
+        source_code, dest_code = addresses >> IPV6_ADDRESS_BITS, addresses & ((1 << IPV6_ADDRESS_BITS) - 1)
+    else:
+        source_code, dest_code = addresses >> 32, addresses & 0xFFFFFFFF
+    return (ip_text(source_code), ip_text(dest_code), (key >> 25) & 0xFFFF, (key >> 9) & 0xFFFF,
+            PROTOCOLS_BY_ID[(key >> 1) & 0xFF])
@@ -0,0 +1,143 @@
+import re
+
+DEFAULT_FIELDS = ("version", "account-id", "interface-id", "srcaddr", "dstaddr", "srcport", "dstport", "protocol",
+                  "packets", "bytes", "start", "end", "action", "log-status")  # the version 2 default format
+AGGREGATED_FIELDS = ("srcaddr", "dstaddr", "srcport", "dstport", "protocol")  # every schema needs these
+VOLUME_FIELDS = ("packets", "bytes", "start", "end")  # missing volume fields count as 0
+PROTOCOL_NAMES = {b"tcp": "tcp", b"udp": "udp"}  # accepted protocols, interned as str for the aggregates
+PROTOCOL_NUMBERS = {b"6": "tcp", b"17": "udp"}  # the IANA protocol numbers that custom format flow logs write
+HEADER_DELIMITERS = (b",", b" ", b"\t")
+FORMAT_FIELD = re.compile(r"\$\{([^}]+)\}")
+
+
+class FlowLogSchema:
+    """
+    This class describes the columns of a flow log: the field names in order, the delimiter
+    between them, and whether protocols may be written as IANA numbers (6 and 17) as well as
+    names. FlowLogProcessor compiles a schema once into parsing functions with the positions
+    of the fields it aggregates fixed, so a custom format is parsed as fast as the default one.
+
+    Schemas compare equal when they describe the same format, so compiled parsers can be
+    cached per schema.
+    """
+    def __init__(self, fields=DEFAULT_FIELDS, delimiter=",", protocol_numbers=False):
+        """
+        Initialize the FlowLogSchema class.
+
+        Args:
+            fields (iterable): The field names, in column order, as AWS names them (for
+                example srcaddr, dstport or log-status). Fields that are not aggregated may
+                have any name.
+            delimiter (str or bytes): The string between two fields.
+            protocol_numbers (bool): Also accept 6 for tcp and 17 for udp in the protocol field.
+
+        Raises:
+            ValueError: If a field is repeated, a field that is aggregated is missing, or the
+                delimiter is empty.
+        """
+        self.fields = tuple(fields)
+        self.delimiter = delimiter.encode('utf-8') if isinstance(delimiter, str) else bytes(delimiter)
+        self.protocol_numbers = bool(protocol_numbers)
+        if not self.delimiter:
+            raise ValueError("The flow log delimiter cannot be empty")
+        if len(set(self.fields)) != len(self.fields):
+            raise ValueError(f"Repeated fields in flow log schema: {', '.join(self.fields)}")
+        missing = [field for field in AGGREGATED_FIELDS if field not in self.fields]
+        if missing:
+            raise ValueError(f"Flow log schema is missing the fields: {', '.join(missing)}")
+        self.field_count = len(self.fields)
+        self.indices = {field: index for index, field in enumerate(self.fields)}
+        self.header = self.delimiter.join(field.encode('utf-8') for field in self.fields)
+        self.protocol_names = {**PROTOCOL_NAMES, **PROTOCOL_NUMBERS} if self.protocol_numbers else PROTOCOL_NAMES
+
+    @classmethod
+    def from_format(cls, log_format, protocol_numbers=True):
+        """
+        Create a schema from an AWS log format string such as "${version} ${srcaddr} ...".
+
+        Args:
+            log_format (str): The format string. The text between the first two fields is the delimiter.
+            protocol_numbers (bool): See __init__.
+
+        Returns:
+            FlowLogSchema: The schema of the format.
+        """
+        fields = FORMAT_FIELD.findall(log_format)
+        separators = FORMAT_FIELD.split(log_format)[2:-1:2]  # the text between consecutive fields
+        if not fields or len(set(separators)) > 1 or separators == [""]:
+            raise ValueError(f"Invalid flow log format: {log_format}")
+        return cls(fields, separators[0] if separators else " ", protocol_numbers)
+
+    @classmethod
+    def from_config(cls, schema_config):
+        """
+        Create a schema from the "flow_log_schema" entry of config.json.
+
+        Args:
+            schema_config: None to use the default schema of a file, a list of field names,
+                an AWS log format string, or a dictionary with "fields" (a list) or "format"
+                (a format string), and optionally "delimiter" and "protocol_numbers".
+                Protocol numbers are accepted unless "protocol_numbers" is false.
+
+        Returns:
+            FlowLogSchema: The schema, or None if none is configured.
+        """
+        if schema_config is None:
+            return None
+        if isinstance(schema_config, str):
+            return cls.from_format(schema_config)
+        if not isinstance(schema_config, dict):
+            return cls(schema_config, ",", True)
+        protocol_numbers = schema_config.get("protocol_numbers", True)
+        if "format" in schema_config:
+            schema = cls.from_format(schema_config["format"], protocol_numbers)
+            if "delimiter" not in schema_config:
+                return schema
+            return cls(schema.fields, schema_config["delimiter"], protocol_numbers)
+        return cls(schema_config["fields"], schema_config.get("delimiter", ","), protocol_numbers)
+
+    @classmethod
+    def from_header(cls, line):
+        """
+        Create a schema from the header line of a flow log, if the line is one.
+
+        A line is a header if, split on a comma, a space or a tab, it contains the names of
+        all the fields that are aggregated. Flow logs with a header line are custom format
+        logs, so protocol numbers are accepted.
+
+        Args:
+            line (bytes): The first line of a flow log.
+
+        Returns:
+            FlowLogSchema: The schema the header describes, or None if the line is not a header.
+
+        Time Complexity:
+            O(l), where l is the length of the line.
+
+        Space Complexity:
+            O(l) - The line is split into its fields.
+        """
+        line = line.strip()
+        for delimiter in HEADER_DELIMITERS:
+            names = line.split(delimiter)
+            if all(field.encode('utf-8') in names for field in AGGREGATED_FIELDS):
+                try:
+                    return cls((name.decode('utf-8') for name in names), delimiter, True)
+                except (UnicodeDecodeError, ValueError):
+                    return None
+        return None
+
+    def _key(self):
+        return self.fields, self.delimiter, self.protocol_numbers
+
+    def __eq__(self, other):
+        return isinstance(other, FlowLogSchema) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"FlowLogSchema({list(self.fields)!r}, {self.delimiter!r}, protocol_numbers={self.protocol_numbers})"
+
+
+DEFAULT_SCHEMA = FlowLogSchema()
@@ -0,0 +1,262 @@
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+
+try:
+    import resource
+except ImportError:  # peak RSS is only reported where the resource module exists
+    resource = None
+
+LINE_STAGES = ("read", "parse", "lookup", "aggregate")
+
+
+def peak_rss_bytes():
+    """
+    Get the peak resident set size of this process.
+
+    Returns:
+        int: The peak RSS in bytes, or None if it cannot be measured on this platform.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # macOS reports bytes, Linux kilobytes
+
+
+class Instrumentation:
+    """
+    This class collects where the time of a run goes and reports it as JSON.
+
+    Coarse stages, such as loading the lookup table, processing the flow log, writing the
+    error log and every Writer output, are timed with stage() as a whole. The per-line
+    stages (reading, parsing and validation, tag lookup, and aggregation) are only timed on
+    every sample_every-th line: FlowLogProcessor runs the sampled lines through the same
+    lookup and aggregation functions as the rest, with timers around them, so a processor
+    without instrumentation pays nothing and an instrumented one pays a generator step per
+    line. The totals of the per-line stages are estimated from the samples. A sampled line
+    runs on colder caches than the others, so the estimates are upper bounds; their shares of
+    the per-line time are the figures to compare, and the process_log stage is the real total.
+
+    Instrumentation only sees the lines of a serial run through FlowLogProcessor's loop;
+    with the numpy engine or worker processes only the coarse stages are timed.
+    """
+    def __init__(self, sample_every=1000, progress_seconds=None, report_path="instrumentation_report.json",
+                 progress_stream=None):
+        """
+        Initialize the Instrumentation class.
+
+        Args:
+            sample_every (int): Time the per-line stages of one line in this many.
+            progress_seconds (float): If given, print a progress line with the current
+                lines per second at most this often.
+            report_path (str or Path): Where write_report writes the JSON report.
+            progress_stream (file): Where progress lines are printed. Defaults to stderr.
+        """
+        if sample_every < 1:
+            raise ValueError(f"sample_every must be at least 1: {sample_every}")
+        self.sample_every = sample_every
+        self.progress_seconds = progress_seconds
+        self.report_path = report_path
+        self.progress_stream = progress_stream if progress_stream is not None else sys.stderr
+        self.stages = {}
+        self.line_seconds = dict.fromkeys(LINE_STAGES, 0.0)
+        self.sampled_lines = 0
+        self.lines_seen = 0
+        self.lookups = {"exact": 0, "rule": 0, "untagged": 0}
+        self._progress_time = None
+        self._progress_lines = 0
+
+    @classmethod
+    def from_config(cls, instrumentation_config):
+        """
+        Create instrumentation from the "instrumentation" entry of config.json.
+
+        Args:
+            instrumentation_config: false or missing to disable instrumentation, true to
+                enable it with the defaults, or a dictionary with sample_every,
+                progress_seconds and report_path.
+
+        Returns:
+            Instrumentation: The instrumentation, or None if it is disabled.
+        """
+        if not instrumentation_config:
+            return None
+        if instrumentation_config is True:
+            instrumentation_config = {}
+        return cls(instrumentation_config.get("sample_every", 1000), instrumentation_config.get("progress_seconds"),
+                   instrumentation_config.get("report_path", "instrumentation_report.json"))
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a coarse stage. A stage timed more than once accumulates its time and calls.
+
+        Args:
+            name (str): The name of the stage in the report.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds, calls = self.stages.get(name, (0.0, 0))
+            self.stages[name] = (seconds + time.perf_counter() - start, calls + 1)
+
+    def time_method(self, target, method_name, stage_name):
+        """
+        Time every call of a method of an object as a stage, by wrapping it on the instance.
+
+        Args:
+            target (object): The object, for example an ErrorSink.
+            method_name (str): The method to time, for example "flush".
+            stage_name (str): The name of the stage in the report.
+        """
+        method = getattr(target, method_name)
+
+        def timed_method(*args, **kwargs):
+            with self.stage(stage_name):
+                return method(*args, **kwargs)
+        setattr(target, method_name, timed_method)
+
+    def sample_lines(self, lines, process_sampled_line):
+        """
+        Pass lines through, handing every sample_every-th line to a timed callback instead.
+
+        The time spent reading a sampled line is measured here; the callback measures the
+        other per-line stages and reports them with record_line.
+
+        Args:
+            lines (iterable): The flow log lines.
+            process_sampled_line (callable): Processes a sampled line with stage timers.
+
+        Yields:
+            bytes: The lines that are not sampled.
+
+        Time Complexity:
+            O(n), where n is the number of lines.
+
+        Space Complexity:
+            O(1) - The lines are streamed.
+        """
+        lines = iter(lines)
+        clock = time.perf_counter
+        unsampled = self.sample_every - 1
+        if self._progress_time is None:
+            self._progress_time = clock()
+        while True:
+            passed = 0
+            for line in islice(lines, unsampled):
+                passed += 1
+                yield line
+            self.lines_seen += passed
+            if passed < unsampled:
+                return
+            start = clock()
+            line = next(lines, None)
+            if line is None:
+                return
+            self.lines_seen += 1
+            self.line_seconds["read"] += clock() - start
+            process_sampled_line(line)
+            if self.progress_seconds is not None and clock() - self._progress_time >= self.progress_seconds:
+                self.report_progress()
+
+    def record_line(self, parse_seconds, lookup_seconds=0.0, aggregate_seconds=0.0, lookup_source=None):
+        """
+        Record the stage times of a sampled line.
+
+        Args:
+            parse_seconds (float): The time spent parsing and validating the line.
+            lookup_seconds (float): The time spent looking up its tag.
+            aggregate_seconds (float): The time spent updating the aggregates.
+            lookup_source (str): "exact", "rule" or "untagged", or None for a rejected line.
+        """
+        self.sampled_lines += 1
+        line_seconds = self.line_seconds
+        line_seconds["parse"] += parse_seconds
+        line_seconds["lookup"] += lookup_seconds
+        line_seconds["aggregate"] += aggregate_seconds
+        if lookup_source is not None:
+            self.lookups[lookup_source] += 1
+
+    def report_progress(self):
+        """
+        Print the number of lines processed so far and the current lines per second.
+        """
+        now = time.perf_counter()
+        rate = (self.lines_seen - self._progress_lines) / (now - self._progress_time) if now > self._progress_time else 0.0
+        print(f"Processed {self.lines_seen} lines ({rate:,.0f} lines/s)", file=self.progress_stream, flush=True)
+        self._progress_time = now
+        self._progress_lines = self.lines_seen
+
+    def report(self, processor=None, lookup_table=None):
+        """
+        Build the report of the run.
+
+        Args:
+            processor (FlowLogProcessor): The processor of the run, for the line counts and
+                the sizes of its aggregates. Lines it restored from a checkpoint are not counted.
+            lookup_table (LookupTable): The lookup table of the run, for its cache statistics.
+
+        Returns:
+            dict: The stage timings, the accepted and rejected line counts, the sampled
+            per-line stage times with their estimated totals and shares, the lookup statistics, the
+            aggregate sizes and the peak RSS of the process.
+        """
+        report = {"stages": {name: {"seconds": seconds, "calls": calls}
+                             for name, (seconds, calls) in self.stages.items()}}
+        if processor is not None:
+            # lines restored from a checkpoint were processed by an earlier run
+            rejected = {reason: count - processor.restored_rejections.get(reason, 0)
+                        for reason, count in processor.get_error_summary().items()}
+            rejected = {reason: count for reason, count in rejected.items() if count}
+            accepted = sum(processor.tag_counts.values()) - processor.restored_lines
+            report["lines"] = {"accepted": accepted, "rejected": sum(rejected.values()),
+                               "rejected_by_reason": rejected}
+            report["aggregate_sizes"] = {name: len(getattr(processor, name)) for name in processor.AGGREGATES
+                                         if getattr(processor, name) is not None
+                                         and hasattr(getattr(processor, name), "__len__")}
+        if self.sampled_lines:
+            scale = self.lines_seen / self.sampled_lines
+            sampled_seconds = sum(self.line_seconds.values())
+            report["sampled_lines"] = {
+                "sample_every": self.sample_every,
+                "lines_seen": self.lines_seen,
+                "samples": self.sampled_lines,
+                "ns_per_line": {stage: seconds / self.sampled_lines * 1e9 for stage, seconds in self.line_seconds.items()},
+                "estimated_seconds": {stage: seconds * scale for stage, seconds in self.line_seconds.items()},
+                "share": {stage: seconds / sampled_seconds if sampled_seconds else 0.0
+                          for stage, seconds in self.line_seconds.items()},
+                "lookups": dict(self.lookups),
+            }
+        if lookup_table is not None:
+            report["lookup_table"] = lookup_table.get_stats()
+        report["peak_rss_bytes"] = peak_rss_bytes()
+        return report
+
+    def write_report(self, processor=None, lookup_table=None):
+        """
+        Write the report of the run as JSON to self.report_path.
+
+        Args:
+            processor (FlowLogProcessor): See report.
+            lookup_table (LookupTable): See report.
+        """
+        with open(self.report_path, "w", encoding="utf-8") as report_file:
+            json.dump(self.report(processor, lookup_table), report_file, indent=2)
+            report_file.write("\n")
+
+
+def timed_stage(instrumentation, name):
+    """
+    Time a stage if instrumentation is enabled.
+
+    Args:
+        instrumentation (Instrumentation): The instrumentation, or None.
+        name (str): The name of the stage.
+
+    Returns:
+        A context manager that times the stage, or does nothing.
+    """
+    return instrumentation.stage(name) if instrumentation is not None else nullcontext()
@@ -1,5 +1,8 @@
 from pathlib import Path
-from vpc_log_parser import LookupTable, FlowLogProcessor, Writer
+from vpc_log_parser import LookupTable, FlowLogProcessor, Writer, ErrorSink
+from sketches import HeavyHitterSketch
+from instrumentation import Instrumentation, timed_stage
+from flow_log_schema import DEFAULT_SCHEMA, FlowLogSchema
 import json
 
 def main():
@@ -10,19 +13,78 @@ def main():
         config = json.load(configuration)
 
     lookup_table_path = Path(config["lookup_table_path"])
-    flow_log_path = Path(config["flow_log_path"])
+    flow_log_path = Path(config["flow_log_path"]) if "flow_log_path" in config else None  # not needed with batch_inputs
 
-    lookup_table = LookupTable(lookup_table_path)
-    flow_log_processor = FlowLogProcessor(lookup_table, flow_log_path)
-    flow_log_processor.process_log()
+    instrumentation = Instrumentation.from_config(config.get("instrumentation"))
+    with timed_stage(instrumentation, "lookup_table_load"):
+        lookup_table = LookupTable(lookup_table_path)
+    error_sink = ErrorSink(config.get("error_log_path", "error_log.txt"),
+                           mode=config.get("error_log_mode", "full"),
+                           max_samples=config.get("error_log_samples", 10))
+    if instrumentation is not None:
+        instrumentation.time_method(error_sink, "flush", "error_log_write")
+    schema = FlowLogSchema.from_config(config.get("flow_log_schema"))
+    if schema is not None and schema != DEFAULT_SCHEMA:
+        if "service" in config or config.get("aggregate_store_path"):  # these modes parse the default format only
+            raise ValueError("flow_log_schema cannot be combined with service or aggregate_store_path")
+    if "service" in config:
+        from service import run_service
+        run_service(lookup_table, error_sink, config["service"])
+        return
+    if config.get("aggregate_store_path"):
+        from aggregate_store import AggregateStore, write_flow_logs_to_store
+        store = AggregateStore(config["aggregate_store_path"], config.get("store_bucket_seconds", 3600),
+                               config.get("store_rollup_seconds", 86400))
+        write_flow_logs_to_store(lookup_table, flow_log_path, store, error_sink)
+        return
+    five_tuple_sketch = None
+    if config.get("five_tuple_mode", "exact") == "approximate":
+        five_tuple_sketch = HeavyHitterSketch(config.get("five_tuple_memory_budget", 64 * 1024 * 1024),
+                                              config.get("five_tuple_top_k", 1000))
+    volume_metrics = config.get("volume_metrics", False)
+    workers = config.get("workers", 1)
+    if config.get("batch_inputs"):
+        from batch_runner import BatchRunner
+        batch_runner = BatchRunner(lookup_table, error_sink, workers, five_tuple_sketch, volume_metrics, schema)
+        with timed_stage(instrumentation, "process_log"):
+            flow_log_processor = batch_runner.run(config["batch_inputs"])
+        for failed_path, error_msg in batch_runner.failures:
+            print(f"Failed to process {failed_path}: {error_msg}")
+    else:
+        if config.get("engine", "python") == "numpy":
+            from numpy_engine import NumpyFlowLogProcessor  # NumPy is only needed for this engine
+            flow_log_processor = NumpyFlowLogProcessor(lookup_table, flow_log_path, error_sink, five_tuple_sketch,
+                                                       volume_metrics=volume_metrics, instrumentation=instrumentation,
+                                                       schema=schema)
+        else:
+            flow_log_processor = FlowLogProcessor(lookup_table, flow_log_path, error_sink, five_tuple_sketch,
+                                                  volume_metrics=volume_metrics, instrumentation=instrumentation,
+                                                  schema=schema)
+        with timed_stage(instrumentation, "process_log"):
+            if config.get("checkpoint_path"):
+                flow_log_processor.process_log_incremental(Path(config["checkpoint_path"]))
+            elif workers == 1:
+                flow_log_processor.process_log()
+            else:
+                flow_log_processor.process_log_parallel(workers)
+    if config.get("aggregate_state_path"):
+        from aggregate_state import AggregateState
+        AggregateState.from_processor(flow_log_processor).save(config["aggregate_state_path"])
     tag_counts = flow_log_processor.get_tag_counts_dict()
     port_protocol_counts = flow_log_processor.get_port_protocol_counts_dict()
-    five_tuple_counts = flow_log_processor.get_five_tuple_counts_dict()
+    five_tuple_counts = flow_log_processor.get_packed_five_tuple_counts()  # the Writer decodes the keys
 
-    writer = Writer(tag_counts, port_protocol_counts, five_tuple_counts)
-    writer.output_tag_counts(False, tag_counts) # tag_counts is only used for testing
-    writer.output_port_protocol_counts(False, port_protocol_counts) # port_protocol_counts is only used for testing
-    writer.output_five_tuple_counts()
+    writer = Writer(tag_counts, port_protocol_counts, five_tuple_counts, flow_log_processor.volume_counts,
+                    sort_by=config.get("output_sort"), compression=config.get("output_compression"),
+                    sort_memory_lines=config.get("output_sort_memory_lines", 1000000))
+    with timed_stage(instrumentation, "output_tag_counts"):
+        writer.output_tag_counts(False, tag_counts) # tag_counts is only used for testing
+    with timed_stage(instrumentation, "output_port_protocol_counts"):
+        writer.output_port_protocol_counts(False, port_protocol_counts) # port_protocol_counts is only used for testing
+    with timed_stage(instrumentation, "output_five_tuple_counts"):
+        writer.output_five_tuple_counts()
+    if instrumentation is not None:
+        instrumentation.write_report(flow_log_processor, lookup_table)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
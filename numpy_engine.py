@@ -0,0 +1,341 @@
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the pure-Python FlowLogProcessor does not need it
+    np = None
+
+from five_tuple_keys import pack_five_tuple
+from sketches import HeavyHitterSketch
+from flow_log_schema import AGGREGATED_FIELDS
+from vpc_log_parser import (FlowLogProcessor, MAX_PORT, detect_flow_log_schema, iter_flow_log_lines, open_flow_log,
+                            resolve_flow_log_files)
+
+NEWLINE = ord('\n')
+MAX_PORT_DIGITS = 5
+PROTOCOLS = ('tcp', 'udp')
+
+
+class NumpyFlowLogProcessor(FlowLogProcessor):
+    """
+    This class processes flow logs in large chunks with vectorized NumPy operations.
+
+    Every chunk is scanned for newlines and commas at once, the port and protocol fields
+    are parsed and validated with array masks, and the counts are aggregated with np.unique
+    instead of per-line dictionary updates. Lines the vectorized checks cannot accept (for
+    example ports with surrounding spaces, or invalid lines) are handed to
+    FlowLogProcessor.parse_line, so accepted lines, rejection reasons and error messages
+    are exactly those of the pure-Python processor, and the output files match it byte for byte.
+    The field positions and the delimiter come from the schema of every file; files with a
+    delimiter longer than one byte are processed line by line.
+    """
+    def __init__(self, lookup_table, flow_log_file, error_sink=None, five_tuple_sketch=None, chunk_size=8 * 1024 * 1024,
+                 volume_metrics=False, instrumentation=None, schema=None):
+        """
+        Initialize the NumpyFlowLogProcessor class.
+
+        Args:
+            lookup_table (LookupTable): The lookup table mapping port and protocol to a tag.
+            flow_log_file (str or Path): A flow log file, directory or glob pattern.
+            error_sink (ErrorSink): Where rejected lines are reported.
+            five_tuple_sketch (HeavyHitterSketch): Count five tuples approximately when given.
+            chunk_size (int): The number of bytes read and parsed at once.
+            volume_metrics (bool): Also sum packets, bytes and durations. These are not
+                vectorized, so the flow log is then processed line by line.
+            instrumentation (Instrumentation): Chunks are not timed line by line, so only
+                the coarse stages are reported, unless volume metrics are on.
+            schema (FlowLogSchema): The schema of files without a header line.
+        """
+        if np is None:
+            raise ImportError("The numpy engine requires NumPy to be installed")
+        super().__init__(lookup_table, flow_log_file, error_sink, five_tuple_sketch, volume_metrics=volume_metrics,
+                         instrumentation=instrumentation, schema=schema)
+        self.chunk_size = chunk_size
+        self._tag_table = self._build_tag_table()
+
+    def _build_tag_table(self):
+        """
+        Stack the lookup table's dense tag ID arrays into a (protocol, port) NumPy table.
+        """
+        tag_table = np.zeros((len(PROTOCOLS), MAX_PORT + 1), dtype=np.int64)
+        for protocol_id, protocol in enumerate(PROTOCOLS):
+            port_tags = self.lookup_table.tag_ids.get(protocol)
+            if port_tags is not None:
+                tag_table[protocol_id] = np.asarray(port_tags)
+        return tag_table
+
+    def process_log(self):
+        """
+        Process the flow log in chunks of self.chunk_size bytes that end on a newline.
+        Compressed flow logs are decompressed while they are read.
+
+        Time Complexity:
+            O(n log n) per chunk because of the sorting in np.unique, where n is the number
+            of lines in the chunk; the per-line work is done in NumPy rather than Python.
+
+        Space Complexity:
+            O(c), where c is the chunk size, plus the aggregated counts.
+        """
+        if self.volume_counts is not None:
+            super().process_log()
+            return
+        try:
+            for flow_log_path in resolve_flow_log_files(self.flow_log_file):
+                schema = detect_flow_log_schema(flow_log_path, self.schema)
+                if len(schema.delimiter) != 1:
+                    self._process_lines(iter_flow_log_lines(flow_log_path), schema)
+                    continue
+                with open_flow_log(flow_log_path) as flow_file:
+                    remainder = b""
+                    while True:
+                        block = flow_file.read(self.chunk_size)
+                        if not block:
+                            break
+                        block = remainder + block
+                        cut = block.rfind(b"\n") + 1
+                        remainder = block[cut:]
+                        if cut:
+                            self._process_chunk(block[:cut], schema)
+                    if remainder:
+                        self._process_chunk(remainder, schema)
+        finally:
+            self.error_sink.close()
+
+    def _process_chunk(self, chunk, schema=None):
+        """
+        Validate and aggregate every line of a chunk of the flow log.
+
+        Args:
+            chunk (bytes): Complete flow log lines.
+            schema (FlowLogSchema): The schema of the lines, with a one-byte delimiter.
+                Defaults to self.schema.
+        """
+        schema = schema if schema is not None else self.schema
+        parse_line = self.compile_schema(schema)[0]
+        buffer = np.frombuffer(chunk, dtype=np.uint8)
+        newlines = np.flatnonzero(buffer == NEWLINE)
+        line_ends = newlines if chunk.endswith(b"\n") else np.append(newlines, len(buffer))
+        line_starts = np.zeros(len(line_ends), dtype=np.int64)
+        line_starts[1:] = line_ends[:-1] + 1
+
+        separators = schema.field_count - 1
+        commas = np.flatnonzero(buffer == schema.delimiter[0])
+        first_comma = np.searchsorted(commas, line_starts)
+        sized = (np.searchsorted(commas, line_ends) - first_comma) == separators
+
+        # field k of a line with the right number of fields lies between its (k-1)-th and k-th delimiter
+        rows = np.flatnonzero(sized)
+        row_commas = first_comma[rows]
+        padded_commas = np.append(commas, 0)  # keeps the gathers below in bounds for unsized lines
+
+        def field_bounds(field):
+            starts = padded_commas[row_commas + field - 1] + 1 if field else line_starts[rows]
+            ends = padded_commas[row_commas + field] if field < separators else line_ends[rows]
+            return starts, ends
+
+        source_index, dest_index, source_port_index, dst_port_index, protocol_index = (
+            schema.indices[field] for field in AGGREGATED_FIELDS)
+        source_ip_bounds = field_bounds(source_index)
+        dest_ip_bounds = field_bounds(dest_index)
+        source_ports, source_ok = self._parse_ports(buffer, *field_bounds(source_port_index))
+        dst_ports, dst_ok = self._parse_ports(buffer, *field_bounds(dst_port_index))
+        protocol_ids, protocol_ok = self._parse_protocols(buffer, *field_bounds(protocol_index), schema.protocol_names)
+        fast = source_ok & dst_ok & protocol_ok
+
+        # every other line goes through the pure-Python validation, in line order
+        accepted = fast.copy()
+        slow_lines = np.ones(len(line_ends), dtype=bool)
+        slow_lines[rows[fast]] = False
+        row_of_line = np.full(len(line_ends), -1, dtype=np.int64)
+        row_of_line[rows] = np.arange(len(rows))
+        for line_index in np.flatnonzero(slow_lines).tolist():
+            record = parse_line(chunk[line_starts[line_index]:line_ends[line_index]])
+            if record is None:
+                continue
+            row = row_of_line[line_index]  # an accepted line always has the right number of fields
+            source_ports[row], dst_ports[row] = record[2], record[3]
+            protocol_ids[row] = PROTOCOLS.index(record[4])
+            accepted[row] = True
+
+        accepted_rows = np.flatnonzero(accepted)
+        if not len(accepted_rows):
+            return
+        source_ports = source_ports[accepted_rows]
+        dst_ports = dst_ports[accepted_rows]
+        protocol_ids = protocol_ids[accepted_rows]
+        source_ips = (source_ip_bounds[0][accepted_rows], source_ip_bounds[1][accepted_rows])
+        dest_ips = (dest_ip_bounds[0][accepted_rows], dest_ip_bounds[1][accepted_rows])
+
+        self._count_port_protocols(dst_ports, protocol_ids)
+        self._count_tags(chunk, buffer, dest_ips, dst_ports, protocol_ids)
+        if self.five_tuple_counts is not None:
+            self._count_five_tuples(chunk, buffer, source_ips, dest_ips, source_ports, dst_ports, protocol_ids)
+
+    @staticmethod
+    def _parse_ports(buffer, starts, ends):
+        """
+        Parse port fields of up to five plain digits into integers.
+
+        Returns:
+            tuple: The parsed ports and a mask of the fields that are valid ports. Fields
+            that are not plain digits are left to the pure-Python validation.
+        """
+        lengths = ends - starts
+        ok = (lengths >= 1) & (lengths <= MAX_PORT_DIGITS)
+        ports = np.zeros(len(starts), dtype=np.int64)
+        last = len(buffer) - 1
+        for position in range(MAX_PORT_DIGITS):
+            in_field = position < lengths
+            digits = buffer[np.minimum(starts + position, last)].astype(np.int64) - ord('0')
+            ok &= ~in_field | ((digits >= 0) & (digits <= 9))
+            ports = np.where(in_field, ports * 10 + digits, ports)
+        ok &= ports <= MAX_PORT
+        return ports, ok
+
+    @staticmethod
+    def _parse_protocols(buffer, starts, ends, protocol_names):
+        """
+        Match protocol fields against the protocol spellings of a schema, letters case-insensitively.
+
+        Args:
+            protocol_names (dict): The accepted spellings, such as b"tcp" or b"6", mapped to
+                their protocol name.
+
+        Returns:
+            tuple: The protocol IDs (indexes into PROTOCOLS) and a mask of the fields that matched.
+        """
+        lengths = ends - starts
+        last = len(buffer) - 1
+        characters = [buffer[np.minimum(starts + position, last)]
+                      for position in range(max(len(spelling) for spelling in protocol_names))]
+        protocol_ids = np.zeros(len(starts), dtype=np.int64)
+        matched = np.zeros(len(starts), dtype=bool)
+        for spelling, protocol in protocol_names.items():
+            is_protocol = lengths == len(spelling)
+            for position, character in enumerate(spelling):
+                if chr(character).isalpha():
+                    is_protocol &= (characters[position] | 0x20) == character
+                else:
+                    is_protocol &= characters[position] == character
+            protocol_ids[is_protocol] = PROTOCOLS.index(protocol)
+            matched |= is_protocol
+        return protocol_ids, matched
+
+    @staticmethod
+    def _first_seen_unique(keys):
+        """
+        Get the unique keys with their counts, ordered by their first occurrence.
+        """
+        unique_keys, first_index, counts = np.unique(keys, return_index=True, return_counts=True)
+        order = np.argsort(first_index, kind='stable')
+        return unique_keys[order], first_index[order], counts[order]
+
+    def _count_port_protocols(self, dst_ports, protocol_ids):
+        """
+        Add the port-protocol counts of the accepted lines of a chunk.
+        """
+        keys, _, counts = self._first_seen_unique(protocol_ids * (MAX_PORT + 1) + dst_ports)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.port_protocol_counts.add(key % (MAX_PORT + 1), PROTOCOLS[key // (MAX_PORT + 1)], count)
+
+    def _count_tags(self, chunk, buffer, dest_ips, dst_ports, protocol_ids):
+        """
+        Add the tag counts of the accepted lines of a chunk.
+
+        Tags of exact lookup table entries come straight from the dense tag table. Lines it
+        leaves untagged are matched against the lookup table's rules once per distinct
+        (port, protocol) pair, or (port, protocol, destination) triple if rules use CIDR blocks.
+        """
+        tag_names = self.lookup_table.tag_names
+        tag_ids = self._tag_table[protocol_ids, dst_ports]
+        rule_matcher = self.lookup_table.rule_matcher
+        untagged = np.flatnonzero(tag_ids == 0)
+        if rule_matcher is not None and len(untagged):
+            keys = protocol_ids[untagged] * (MAX_PORT + 1) + dst_ports[untagged]
+            if rule_matcher.uses_ips:
+                dest_starts, dest_ends = dest_ips[0][untagged], dest_ips[1][untagged]
+                key_matrix = np.ascontiguousarray(np.concatenate(
+                    [self._gather_field(buffer, dest_starts, dest_ends), self._key_bytes(keys, 3)], axis=1))
+                keys = key_matrix.view(np.dtype((np.void, key_matrix.shape[1]))).ravel()
+            _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            matched = []
+            for row in untagged[first_index].tolist():
+                dst_ip = chunk[dest_ips[0][row]:dest_ips[1][row]].decode('utf-8') if rule_matcher.uses_ips else None
+                matched.append(rule_matcher.match(int(dst_ports[row]), PROTOCOLS[protocol_ids[row]], dst_ip))
+            tag_ids[untagged] = np.array(matched, dtype=np.int64)[inverse.ravel()]
+        tag_ids, _, counts = self._first_seen_unique(tag_ids)
+        for tag_id, count in zip(tag_ids.tolist(), counts.tolist()):
+            tag = tag_names[tag_id]
+            self.tag_counts[tag] = self.tag_counts.get(tag, 0) + count
+
+    @staticmethod
+    def _key_bytes(values, width):
+        """
+        Split non-negative integers into a (rows, width) matrix of big-endian bytes.
+        """
+        return np.stack([(values >> (8 * (width - 1 - position))) & 0xFF for position in range(width)],
+                        axis=1).astype(np.uint8)
+
+    def _count_five_tuples(self, chunk, buffer, source_ips, dest_ips, source_ports, dst_ports, protocol_ids):
+        """
+        Add the five tuple counts of the accepted lines of a chunk.
+
+        The IP fields are gathered into fixed-width byte columns and combined with the ports
+        and protocol into one fixed-width key per line, so np.unique can group them. Exact
+        counts are added once per distinct key. A sketch keeps the candidates it has seen so
+        far, so its result depends on the order of its additions; it is given every line on
+        its own, in file order, like the pure-Python engine does, and only the packing of the
+        keys is shared between lines.
+        """
+        source_starts, source_ends = source_ips
+        dest_starts, dest_ends = dest_ips
+        columns = [
+            self._gather_field(buffer, source_starts, source_ends),
+            self._gather_field(buffer, dest_starts, dest_ends),
+            self._key_bytes(source_ports, 2),
+            self._key_bytes(dst_ports, 2),
+            self._key_bytes(protocol_ids, 1),
+        ]
+        key_matrix = np.ascontiguousarray(np.concatenate(columns, axis=1))
+        keys = key_matrix.view(np.dtype((np.void, key_matrix.shape[1]))).ravel()
+
+        five_tuple_counts = self.five_tuple_counts
+        if isinstance(five_tuple_counts, HeavyHitterSketch):
+            _, first_index, line_keys = np.unique(keys, return_index=True, return_inverse=True)
+            five_tuple_keys = self._pack_five_tuples(chunk, first_index, source_ips, dest_ips, source_ports,
+                                                     dst_ports, protocol_ids)
+            add = five_tuple_counts.add
+            for key_index in line_keys.ravel().tolist():
+                add(five_tuple_keys[key_index])
+            return
+        _, first_index, counts = self._first_seen_unique(keys)
+        five_tuple_keys = self._pack_five_tuples(chunk, first_index, source_ips, dest_ips, source_ports,
+                                                 dst_ports, protocol_ids)
+        for five_tuple_key, count in zip(five_tuple_keys, counts.tolist()):
+            five_tuple_counts[five_tuple_key] = five_tuple_counts.get(five_tuple_key, 0) + count
+
+    @staticmethod
+    def _pack_five_tuples(chunk, rows, source_ips, dest_ips, source_ports, dst_ports, protocol_ids):
+        """
+        Pack the five tuples of the given rows of a chunk's accepted lines into integer keys.
+        """
+        source_starts, source_ends = source_ips
+        dest_starts, dest_ends = dest_ips
+        columns = zip(source_starts[rows].tolist(), source_ends[rows].tolist(),
+                      dest_starts[rows].tolist(), dest_ends[rows].tolist(),
+                      source_ports[rows].tolist(), dst_ports[rows].tolist(), protocol_ids[rows].tolist())
+        return [pack_five_tuple(chunk[source_start:source_end].decode('utf-8'), chunk[dest_start:dest_end].decode('utf-8'),
+                                source_port, dst_port, PROTOCOLS[protocol_id])
+                for source_start, source_end, dest_start, dest_end, source_port, dst_port, protocol_id in columns]
+
+    @staticmethod
+    def _gather_field(buffer, starts, ends):
+        """
+        Copy variable-length fields into a zero-padded (rows, width) byte matrix, with the
+        field length in the last column so that fields ending in zero bytes stay distinct.
+        """
+        lengths = ends - starts
+        width = int(lengths.max()) if len(lengths) else 0
+        offsets = np.arange(width)
+        in_field = offsets < lengths[:, None]
+        gathered = buffer[np.minimum(starts[:, None] + offsets, len(buffer) - 1)]
+        field_matrix = np.where(in_field, gathered, 0).astype(np.uint8)
+        return np.concatenate([field_matrix, NumpyFlowLogProcessor._key_bytes(lengths, 2)], axis=1)
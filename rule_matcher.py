@@ -0,0 +1,331 @@
+import bisect
+import ipaddress
+from collections import OrderedDict, namedtuple
+
+MAX_PORT = 65535
+WILDCARD = "*"
+
+Rule = namedtuple("Rule", ["rule_id", "low_port", "high_port", "protocol", "network", "tag_id"])
+
+
+def parse_port_range(port_field):
+    """
+    Parse the port column of a lookup table rule.
+
+    Args:
+        port_field (str): A port ("443"), an inclusive range ("8000-8100") or "*" for any port.
+
+    Returns:
+        tuple: The (low, high) ports of the inclusive range.
+
+    Raises:
+        ValueError: If the field is not a valid port, range or wildcard.
+    """
+    port_field = port_field.strip()
+    if port_field == WILDCARD:
+        return 0, MAX_PORT
+    low, separator, high = port_field.partition("-")
+    low = int(low)
+    high = int(high) if separator else low
+    if not 0 <= low <= high <= MAX_PORT:
+        raise ValueError(f"Invalid port range: {port_field}")
+    return low, high
+
+
+class LRUCache:
+    """
+    This class represents a bounded least-recently-used cache that counts its hits and misses.
+    """
+    def __init__(self, maxsize=65536):
+        """
+        Initialize the LRUCache class.
+
+        Args:
+            maxsize (int): The maximum number of entries kept.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Get a cached value and mark it as recently used.
+
+        Time Complexity:
+            O(1) - Dictionary lookup and a move to the end of the ordering.
+
+        Space Complexity:
+            O(1) - No additional space is used.
+        """
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry when the cache is full.
+
+        Time Complexity:
+            O(1) - Dictionary insertion and eviction.
+
+        Space Complexity:
+            O(1) - The cache never holds more than maxsize entries.
+        """
+        entries = self.entries
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def hit_rate(self):
+        """
+        Get the fraction of lookups that were served from the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __reduce__(self):
+        # A copy starts empty: cached results are cheap to recompute, so they aren't pickled
+        return (LRUCache, (self.maxsize,))
+
+
+class NegativeCache:
+    """
+    This class represents a bounded set of keys that are known to have no match.
+
+    When the set is full, the oldest key is evicted, so memory stays bounded no matter how
+    many distinct misses are seen.
+    """
+    def __init__(self, maxsize=65536):
+        """
+        Initialize the NegativeCache class.
+
+        Args:
+            maxsize (int): The maximum number of keys kept.
+        """
+        self.maxsize = maxsize
+        self.keys = {}
+        self.hits = 0
+
+    def __contains__(self, key):
+        if key in self.keys:
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, key):
+        """
+        Remember a key that has no match, evicting the oldest key when the cache is full.
+
+        Time Complexity:
+            O(1) - Dictionary insertion and eviction.
+
+        Space Complexity:
+            O(1) - The cache never holds more than maxsize keys.
+        """
+        keys = self.keys
+        keys[key] = None
+        if len(keys) > self.maxsize:
+            del keys[next(iter(keys))]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __reduce__(self):
+        return (NegativeCache, (self.maxsize,))
+
+
+class PortIntervalIndex:
+    """
+    This class indexes inclusive port ranges so that the ranges containing a port are
+    found with one binary search.
+
+    The port space is cut at every range boundary into elementary segments, and every
+    segment stores the IDs of the rules whose range covers it, in rule order.
+    """
+    def __init__(self, ranges):
+        """
+        Initialize the PortIntervalIndex class.
+
+        Args:
+            ranges (list): (low, high, rule_id) tuples of inclusive port ranges.
+
+        Time Complexity:
+            O(r log r + s * o), where r is the number of ranges, s the number of segments
+            and o the number of ranges overlapping a segment.
+        """
+        boundaries = sorted({0} | {low for low, _, _ in ranges} | {high + 1 for _, high, _ in ranges if high < MAX_PORT})
+        segments = [[] for _ in boundaries]
+        for low, high, rule_id in ranges:
+            first = bisect.bisect_right(boundaries, low) - 1
+            last = bisect.bisect_right(boundaries, high) - 1
+            for segment in range(first, last + 1):
+                segments[segment].append(rule_id)
+        self.boundaries = boundaries
+        self.segments = [tuple(sorted(rule_ids)) for rule_ids in segments]
+
+    def lookup(self, port):
+        """
+        Get the IDs of the rules whose port range contains a port.
+
+        Args:
+            port (int): The port.
+
+        Returns:
+            tuple: The matching rule IDs in rule order.
+
+        Time Complexity:
+            O(log s), where s is the number of segments.
+
+        Space Complexity:
+            O(1) - The stored tuple is returned.
+        """
+        return self.segments[bisect.bisect_right(self.boundaries, port) - 1]
+
+
+class PrefixTrie:
+    """
+    This class represents a binary radix trie of IPv4 and IPv6 networks.
+
+    Every node is a [zero child, one child, rule IDs] list, and a network's rule ID is stored
+    at the node reached by following the bits of its prefix.
+    """
+    def __init__(self):
+        self.roots = {4: [None, None, []], 6: [None, None, []]}
+
+    def insert(self, network, rule_id):
+        """
+        Add a network to the trie.
+
+        Args:
+            network (ipaddress.IPv4Network or ipaddress.IPv6Network): The network.
+            rule_id (int): The ID of the rule the network belongs to.
+
+        Time Complexity:
+            O(p), where p is the prefix length of the network.
+        """
+        node = self.roots[network.version]
+        address = int(network.network_address)
+        for bit_index in range(network.prefixlen):
+            bit = (address >> (network.max_prefixlen - 1 - bit_index)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, []]
+            node = node[bit]
+        node[2].append(rule_id)
+
+    def matches(self, ip_address):
+        """
+        Get the IDs of the rules whose network contains an IP address.
+
+        Args:
+            ip_address (str): The IP address. An address that cannot be parsed matches no network.
+
+        Returns:
+            set: The matching rule IDs.
+
+        Time Complexity:
+            O(b), where b is the number of bits in the address (32 or 128).
+
+        Space Complexity:
+            O(m), where m is the number of matching rules.
+        """
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return set()
+        bits = address.max_prefixlen
+        address = int(address)
+        node = self.roots[6 if bits == 128 else 4]
+        matched = set(node[2])
+        for bit_index in range(bits):
+            node = node[(address >> (bits - 1 - bit_index)) & 1]
+            if node is None:
+                break
+            matched.update(node[2])
+        return matched
+
+
+class RuleMatcher:
+    """
+    This class compiles lookup table rules with port ranges, protocol wildcards and destination
+    CIDR blocks into an indexed matcher.
+
+    Candidate rules for a port come from a PortIntervalIndex, and destination networks are
+    checked against a PrefixTrie, so matching never scans the whole rule list. The first
+    matching rule in file order wins. Matches are memoized in a bounded LRUCache and misses
+    in a separate bounded NegativeCache, so random unmatched ports cannot evict the matches.
+    """
+    def __init__(self, rules, cache_size=65536, negative_cache_size=65536):
+        """
+        Initialize the RuleMatcher class.
+
+        Args:
+            rules (list): Rule tuples whose rule_id is their position in the list. protocol
+                and network are None for rules that match any protocol or destination.
+            cache_size (int): The maximum number of matches kept in the cache.
+            negative_cache_size (int): The maximum number of misses kept in the negative cache.
+        """
+        self.rules = rules
+        self.port_index = PortIntervalIndex([(rule.low_port, rule.high_port, rule.rule_id) for rule in rules])
+        self.ip_trie = PrefixTrie()
+        for rule in rules:
+            if rule.network is not None:
+                self.ip_trie.insert(rule.network, rule.rule_id)
+        self.uses_ips = any(rule.network is not None for rule in rules)
+        self.cache = LRUCache(cache_size)
+        self.negative_cache = NegativeCache(negative_cache_size)
+
+    def match(self, port, protocol, dst_ip=None):
+        """
+        Get the tag ID of the first rule matching a flow, using the cache.
+
+        Args:
+            port (int): The destination port.
+            protocol (str): The protocol.
+            dst_ip (str): The destination IP address, needed only for rules with a CIDR block.
+
+        Returns:
+            int: The tag ID of the matching rule, or 0 if no rule matches.
+
+        Time Complexity:
+            O(1) on a hit in either cache, otherwise O(log s + c + b), where s is the number of port
+            segments, c the number of candidate rules for the port and b the address length.
+
+        Space Complexity:
+            O(1) - Both caches have a bounded size.
+        """
+        key = (port, protocol, dst_ip) if self.uses_ips else (port, protocol)
+        if key in self.negative_cache:
+            return 0
+        tag_id = self.cache.get(key)
+        if tag_id is None:
+            tag_id = self._match_uncached(port, protocol, dst_ip)
+            if tag_id:
+                self.cache.put(key, tag_id)
+            else:
+                self.negative_cache.add(key)
+        return tag_id
+
+    def _match_uncached(self, port, protocol, dst_ip):
+        """
+        Find the tag ID of the first rule matching a flow without consulting the cache.
+        """
+        ip_rules = None
+        for rule_id in self.port_index.lookup(port):
+            rule = self.rules[rule_id]
+            if rule.protocol is not None and rule.protocol != protocol:
+                continue
+            if rule.network is not None:
+                if ip_rules is None:
+                    ip_rules = self.ip_trie.matches(dst_ip) if dst_ip is not None else set()
+                if rule_id not in ip_rules:
+                    continue
+            return rule.tag_id
+        return 0
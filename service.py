@@ -0,0 +1,456 @@
+import asyncio
+import json
+import os
+from urllib.parse import parse_qs, urlsplit
+from checkpoint import Checkpoint
+from five_tuple_keys import decode_five_tuple
+from vpc_log_parser import READ_BUFFER_SIZE, FlowLogProcessor, SparsePortProtocolCounter
+
+TIME_FIELDS = {"start": 10, "end": 11}  # indices of the start and end timestamps in a version 2 record
+
+
+class BucketCounts:
+    """
+    This class holds the tag, port-protocol and five tuple counts of one time bucket.
+
+    All counts are sparse dictionaries, so a bucket costs memory in proportion to the keys it
+    has seen; a quiet bucket with a single line stays a few hundred bytes.
+    """
+    __slots__ = ("tag_counts", "port_protocol_counts", "five_tuple_counts")
+    AGGREGATES = __slots__
+
+    def __init__(self, count_five_tuples=False):
+        """
+        Initialize the BucketCounts class.
+
+        Args:
+            count_five_tuples (bool): Whether five tuples are counted, keyed by packed five tuple.
+        """
+        self.tag_counts = {}
+        self.port_protocol_counts = SparsePortProtocolCounter()
+        self.five_tuple_counts = {} if count_five_tuples else None
+
+    def get_five_tuple_counts_dict(self):
+        """
+        Get the five tuple counts keyed by five tuple, or None if five tuples are not counted.
+        """
+        if self.five_tuple_counts is None:
+            return None
+        return {decode_five_tuple(key): count for key, count in self.five_tuple_counts.items()}
+
+
+class WindowedAggregates:
+    """
+    This class keeps tag and port-protocol counts per time bucket of a live flow log stream.
+
+    Every line is assigned to the tumbling bucket of bucket_seconds that contains its start
+    (or end) timestamp. Every bucket keeps its own sparse BucketCounts, and one shared
+    FlowLogProcessor aggregates each bucket's lines into them, so lines are validated and
+    tagged exactly like in a batch run while memory grows with the keys seen rather than with
+    the number of buckets. Five tuples are not counted per bucket unless count_five_tuples is set. The watermark is the latest bucket seen; buckets
+    more than retention_seconds older than the watermark are dropped, and lines that arrive
+    for a dropped bucket are counted as late and discarded, so memory stays bounded on an
+    endless stream. With retention_seconds=None every bucket is kept.
+
+    A sliding window is answered by adding up the buckets it covers, so window boundaries
+    are rounded to whole buckets.
+    """
+    def __init__(self, lookup_table, error_sink, bucket_seconds=60, retention_seconds=3600, time_field="start",
+                 count_five_tuples=False):
+        """
+        Initialize the WindowedAggregates class.
+
+        Args:
+            lookup_table (LookupTable): The lookup table used to tag flows.
+            error_sink (ErrorSink): The sink that receives rejected lines.
+            bucket_seconds (int): The length of a tumbling window.
+            retention_seconds (int): How far behind the watermark buckets are kept.
+            time_field (str): "start" or "end", the timestamp that assigns a line to a bucket.
+            count_five_tuples (bool): Whether every bucket also counts five tuples exactly.
+        """
+        if time_field not in TIME_FIELDS:
+            raise ValueError(f"Unknown time field: {time_field}")
+        self.lookup_table = lookup_table
+        self.error_sink = error_sink
+        self.bucket_seconds = bucket_seconds
+        self.retention_seconds = retention_seconds
+        self.time_field = time_field
+        self.time_index = TIME_FIELDS[time_field]
+        self.count_five_tuples = count_five_tuples
+        self.buckets = {}
+        self.watermark = None
+        self.lines = 0
+        self.late_lines = 0
+        self._processor = FlowLogProcessor(lookup_table, None, error_sink, count_five_tuples=False)
+
+    def add_lines(self, lines):
+        """
+        Validate and aggregate a batch of flow log lines.
+
+        Args:
+            lines (list): The flow log lines, as bytes.
+
+        Time Complexity:
+            O(n + b), where n is the number of lines and b the number of buckets touched or dropped.
+
+        Space Complexity:
+            O(n) - The lines are grouped by bucket before they are aggregated.
+        """
+        time_index = self.time_index
+        bucket_seconds = self.bucket_seconds
+        groups = {}
+        for line in lines:
+            fields = line.split(b',', time_index + 2)
+            try:
+                timestamp = int(fields[time_index])
+            except (IndexError, ValueError):
+                self._reject_timestamp(line, fields)
+                continue
+            bucket_start = timestamp - timestamp % bucket_seconds
+            group = groups.get(bucket_start)
+            if group is None:
+                groups[bucket_start] = group = []
+            group.append(line)
+        self.lines += len(lines)
+        if not groups:
+            return
+
+        latest_bucket = max(groups)
+        if self.watermark is None or latest_bucket > self.watermark:
+            self.watermark = latest_bucket
+            self._evict()
+        oldest_bucket = self.watermark - self.retention_seconds if self.retention_seconds is not None else None
+        for bucket_start, group in groups.items():
+            if oldest_bucket is not None and bucket_start < oldest_bucket:
+                self.late_lines += len(group)
+                continue
+            bucket = self.buckets.get(bucket_start)
+            if bucket is None:
+                bucket = self.buckets[bucket_start] = BucketCounts(self.count_five_tuples)
+            self._aggregate(bucket, group)
+
+    def _aggregate(self, bucket, lines):
+        """
+        Aggregate lines into the counts of a bucket with the shared processor.
+        """
+        processor = self._processor
+        for name in BucketCounts.AGGREGATES:
+            setattr(processor, name, getattr(bucket, name))
+        processor._process_lines(lines)
+
+    def _reject_timestamp(self, line, fields):
+        """
+        Reject a line whose timestamp cannot be read. Lines that are invalid anyway are
+        rejected by parse_line with the usual error message.
+        """
+        if self._processor.parse_line(line) is not None:
+            value = fields[self.time_index].decode('utf-8')
+            self.error_sink.record(line.decode('utf-8').strip(), f"Invalid {self.time_field} time: {value}")
+
+    def _evict(self):
+        """
+        Drop the buckets that have fallen out of the retention period.
+        """
+        if self.retention_seconds is None:
+            return
+        oldest_bucket = self.watermark - self.retention_seconds
+        for bucket_start in [bucket_start for bucket_start in self.buckets if bucket_start < oldest_bucket]:
+            del self.buckets[bucket_start]
+
+    def query(self, window="tumbling", seconds=None, at=None):
+        """
+        Get the tag and port-protocol counts of a time window.
+
+        Args:
+            window (str): "tumbling" for the single bucket containing at, or "sliding" for
+                the buckets of the seconds before at.
+            seconds (int): The length of a sliding window. Defaults to one bucket.
+            at (int): The timestamp the window ends at. Defaults to the watermark.
+
+        Returns:
+            dict: The window's start and end timestamps, its tag counts and its
+            port-protocol counts as [port, protocol, count] lists.
+
+        Raises:
+            ValueError: If the window type is unknown.
+
+        Time Complexity:
+            O(w * (k + m)), where w is the number of buckets in the window and k and m the
+            number of unique tags and port-protocol combinations per bucket.
+
+        Space Complexity:
+            O(k + m) - The counts of the window are merged into new dictionaries.
+        """
+        if window not in ("tumbling", "sliding"):
+            raise ValueError(f"Unknown window: {window}")
+        bucket_seconds = self.bucket_seconds
+        if at is None:
+            at = self.watermark if self.watermark is not None else 0
+        end = at - at % bucket_seconds + bucket_seconds
+        length = bucket_seconds if window == "tumbling" or not seconds else seconds
+        start = end - max(bucket_seconds, -(-length // bucket_seconds) * bucket_seconds)
+
+        tag_counts = {}
+        port_protocol_counts = {}
+        for bucket_start in range(start, end, bucket_seconds):
+            bucket = self.buckets.get(bucket_start)
+            if bucket is None:
+                continue
+            for tag, count in bucket.tag_counts.items():
+                tag_counts[tag] = tag_counts.get(tag, 0) + count
+            for key, count in bucket.port_protocol_counts.items():
+                port_protocol_counts[key] = port_protocol_counts.get(key, 0) + count
+        return {
+            "window": window,
+            "start": start,
+            "end": end,
+            "tag_counts": tag_counts,
+            "port_protocol_counts": [[port, protocol, count] for (port, protocol), count in port_protocol_counts.items()],
+        }
+
+    def get_stats(self):
+        """
+        Get the number of lines seen, late lines, retained buckets and the watermark.
+        """
+        return {
+            "lines": self.lines,
+            "late_lines": self.late_lines,
+            "buckets": len(self.buckets),
+            "watermark": self.watermark,
+            "rejections": self.error_sink.get_rejection_summary(),
+        }
+
+
+class FlowLogService:
+    """
+    This class runs the flow log processor continuously with asyncio.
+
+    Lines come from tailed flow log files and from clients that write them to a local TCP or
+    Unix socket. Producers put batches of lines on a bounded queue and a single consumer
+    aggregates them into WindowedAggregates. When the queue is full, producers wait: tailing
+    stops reading and sockets stop being read, so TCP flow control slows the clients down and
+    memory stays bounded by queue_batches * batch_lines lines.
+
+    The consumer yields to the event loop after every batch, so queries on the HTTP query
+    endpoint are answered between batches without stopping ingestion:
+        GET /counts?window=tumbling|sliding&seconds=300&at=1700000000
+        GET /stats
+    """
+    def __init__(self, aggregates, tail_paths=(), ingest_host=None, ingest_port=None, ingest_unix_path=None,
+                 query_host="127.0.0.1", query_port=8080, queue_batches=64, batch_lines=1000,
+                 poll_interval=0.5, tail_from_start=False):
+        """
+        Initialize the FlowLogService class.
+
+        Args:
+            aggregates (WindowedAggregates): The windowed aggregates that lines are fed into.
+            tail_paths (list): Flow log files to follow as they grow.
+            ingest_host (str): The host of the TCP ingest socket; None disables it.
+            ingest_port (int): The port of the TCP ingest socket.
+            ingest_unix_path (str): The path of the Unix ingest socket; None disables it.
+            query_host (str): The host of the query endpoint.
+            query_port (int): The port of the query endpoint; None disables it.
+            queue_batches (int): The maximum number of batches waiting to be aggregated.
+            batch_lines (int): The maximum number of lines in a batch.
+            poll_interval (float): Seconds between checks for new data in tailed files.
+            tail_from_start (bool): Read tailed files from the start instead of from their end.
+        """
+        self.aggregates = aggregates
+        self.tail_paths = list(tail_paths)
+        self.ingest_host = ingest_host
+        self.ingest_port = ingest_port
+        self.ingest_unix_path = ingest_unix_path
+        self.query_host = query_host
+        self.query_port = query_port
+        self.batch_lines = batch_lines
+        self.poll_interval = poll_interval
+        self.tail_from_start = tail_from_start
+        self.queue = asyncio.Queue(maxsize=queue_batches)
+        self.servers = []
+
+    async def start(self):
+        """
+        Start the consumer, the file tailers and the servers.
+
+        Returns:
+            list: The started tasks.
+        """
+        tasks = [asyncio.ensure_future(self.consume())]
+        tasks.extend(asyncio.ensure_future(self.tail_file(path)) for path in self.tail_paths)
+        if self.ingest_port is not None:
+            self.servers.append(await asyncio.start_server(self.handle_ingest, self.ingest_host, self.ingest_port))
+        if self.ingest_unix_path is not None:
+            self.servers.append(await asyncio.start_unix_server(self.handle_ingest, self.ingest_unix_path))
+        if self.query_port is not None:
+            self.servers.append(await asyncio.start_server(self.handle_query, self.query_host, self.query_port))
+        return tasks
+
+    async def run(self):
+        """
+        Run the service until it is cancelled, then flush the error log.
+        """
+        tasks = await self.start()
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for server in self.servers:
+                server.close()
+            self.aggregates.error_sink.close()
+
+    async def consume(self):
+        """
+        Aggregate batches of lines from the queue until the service stops.
+        """
+        queue = self.queue
+        aggregates = self.aggregates
+        while True:
+            lines = await queue.get()
+            aggregates.add_lines(lines)
+            queue.task_done()
+            await asyncio.sleep(0)  # let queries and producers run between batches
+
+    async def _put_lines(self, data, partial_line):
+        """
+        Split data into complete lines and queue them in batches.
+
+        Returns:
+            bytes: The incomplete last line, to be prefixed to the next data.
+        """
+        lines = (partial_line + data).split(b"\n")
+        partial_line = lines.pop()
+        batch_lines = self.batch_lines
+        for batch_start in range(0, len(lines), batch_lines):
+            await self.queue.put(lines[batch_start:batch_start + batch_lines])
+        return partial_line
+
+    async def tail_file(self, flow_log_path):
+        """
+        Follow a flow log file and queue the lines appended to it.
+
+        A file that is replaced (for example by log rotation) or truncated is reopened and
+        read from its start.
+
+        Args:
+            flow_log_path (str): The path to the flow log file.
+        """
+        flow_file = None
+        identity = None
+        from_start = self.tail_from_start
+        partial_line = b""
+        try:
+            while True:
+                if flow_file is None:
+                    try:
+                        identity, size = Checkpoint.file_identity(flow_log_path)
+                    except FileNotFoundError:
+                        await asyncio.sleep(self.poll_interval)
+                        from_start = True  # a file created later is new data from its first line
+                        continue
+                    flow_file = open(flow_log_path, "rb")
+                    if not from_start:
+                        flow_file.seek(size)
+                    partial_line = b""
+                data = flow_file.read(READ_BUFFER_SIZE)
+                if data:
+                    partial_line = await self._put_lines(data, partial_line)
+                    continue
+                await asyncio.sleep(self.poll_interval)
+                try:
+                    current_identity, size = Checkpoint.file_identity(flow_log_path)
+                except FileNotFoundError:
+                    continue
+                if current_identity != identity or size < flow_file.tell():
+                    flow_file.close()
+                    flow_file = None
+                    from_start = True  # a replaced or truncated file is new data from its first line
+        finally:
+            if flow_file is not None:
+                flow_file.close()
+
+    async def handle_ingest(self, reader, writer):
+        """
+        Queue the lines a client writes to an ingest socket until it disconnects.
+        """
+        partial_line = b""
+        try:
+            while True:
+                data = await reader.read(READ_BUFFER_SIZE)
+                if not data:
+                    break
+                partial_line = await self._put_lines(data, partial_line)
+            if partial_line:
+                await self._put_lines(b"\n", partial_line)
+        finally:
+            writer.close()
+
+    async def handle_query(self, reader, writer):
+        """
+        Answer one HTTP GET request on the query endpoint with JSON.
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            status, body = self.answer_query(request_line[1] if len(request_line) > 1 else "")
+            payload = json.dumps(body).encode('utf-8')
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\n\r\n".encode('latin-1') + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def answer_query(self, target):
+        """
+        Answer a query request target such as "/counts?window=sliding&seconds=300".
+
+        Returns:
+            tuple: The HTTP status line and the JSON-serializable body.
+        """
+        url = urlsplit(target)
+        parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == "/stats":
+            stats = self.aggregates.get_stats()
+            stats.update(queued_batches=self.queue.qsize(), queue_capacity=self.queue.maxsize)
+            return "200 OK", stats
+        if url.path != "/counts":
+            return "404 Not Found", {"error": f"Unknown path: {url.path}"}
+        try:
+            seconds = int(parameters["seconds"]) if "seconds" in parameters else None
+            at = int(parameters["at"]) if "at" in parameters else None
+            return "200 OK", self.aggregates.query(parameters.get("window", "tumbling"), seconds, at)
+        except ValueError as e:
+            return "400 Bad Request", {"error": str(e)}
+
+
+def run_service(lookup_table, error_sink, service_config):
+    """
+    Run the service described by the "service" section of config.json until interrupted.
+
+    Args:
+        lookup_table (LookupTable): The lookup table used to tag flows.
+        error_sink (ErrorSink): The sink that receives rejected lines.
+        service_config (dict): The service settings.
+    """
+    aggregates = WindowedAggregates(lookup_table, error_sink,
+                                    bucket_seconds=service_config.get("bucket_seconds", 60),
+                                    retention_seconds=service_config.get("retention_seconds", 3600),
+                                    time_field=service_config.get("time_field", "start"))
+    service = FlowLogService(aggregates,
+                             tail_paths=service_config.get("tail_paths", []),
+                             ingest_host=service_config.get("ingest_host", "127.0.0.1"),
+                             ingest_port=service_config.get("ingest_port"),
+                             ingest_unix_path=service_config.get("ingest_unix_path"),
+                             query_host=service_config.get("query_host", "127.0.0.1"),
+                             query_port=service_config.get("query_port", 8080),
+                             queue_batches=service_config.get("queue_batches", 64),
+                             batch_lines=service_config.get("batch_lines", 1000),
+                             poll_interval=service_config.get("poll_interval", 0.5),
+                             tail_from_start=service_config.get("tail_from_start", False))
+    if service.ingest_unix_path is not None and os.path.exists(service.ingest_unix_path):
+        os.unlink(service.ingest_unix_path)  # a stale socket file from a previous run
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        pass
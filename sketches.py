@@ -0,0 +1,271 @@
+import hashlib
+import math
+from array import array
+
+MASK_64 = (1 << 64) - 1
+GOLDEN_RATIO_64 = 0x9E3779B97F4A7C15  # an odd multiplier that spreads every input bit over the high bits
+
+
+def stable_hash(key):
+    """
+    Hash a key to a 64-bit integer that is identical in every process.
+
+    Python's built-in hash() is salted per process for strings, so it cannot be used on
+    tuples of addresses for sketches that are built in worker processes and merged in the
+    parent process. The hash of a non-negative integer is not salted: it is the integer
+    modulo 2**61 - 1. Integer keys, such as the packed five tuples of pack_five_tuple, are
+    therefore hashed with hash() and scrambled with one multiplication and a shift, about
+    four times faster than a digest; other keys fall back to a digest of their
+    representation. The sketch splits the one hash into the index of every row.
+
+    Args:
+        key (int or tuple): The key to hash.
+
+    Returns:
+        int: A 64-bit hash of the key.
+
+    Time Complexity:
+        O(b), where b is the number of bits of an integer key, else O(l), where l is the
+        length of the key's string representation.
+
+    Space Complexity:
+        O(1) for an integer key, else O(l) - The encoded key is hashed and discarded.
+    """
+    if type(key) is int and key >= 0:
+        key_hash = hash(key) * GOLDEN_RATIO_64 & MASK_64
+        return key_hash ^ (key_hash >> 29)
+    return int.from_bytes(hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class CountMinSketch:
+    """
+    This class represents a Count-Min sketch: a fixed-size table of counters that
+    overestimates the frequency of a key by at most (e / width) * total with
+    probability 1 - e^-depth.
+    """
+    def __init__(self, width, depth):
+        """
+        Initialize the CountMinSketch class.
+
+        Args:
+            width (int): The number of counters per row.
+            depth (int): The number of rows, i.e. independent hash functions.
+        """
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.table = array('Q', bytes(8 * width * depth))
+
+    def add(self, key_hash, count=1):
+        """
+        Add count occurrences of a key and return its new estimate.
+
+        Args:
+            key_hash (int): The stable 64-bit hash of the key.
+            count (int): The number of occurrences to add.
+
+        Returns:
+            int: The estimated frequency of the key after the update.
+
+        Time Complexity:
+            O(d), where d is the depth of the sketch.
+
+        Space Complexity:
+            O(1) - The table has a fixed size.
+        """
+        table = self.table
+        width = self.width
+        first_hash = key_hash & 0xFFFFFFFF
+        second_hash = (key_hash >> 32) | 1
+        estimate = None
+        for row in range(self.depth):
+            index = row * width + (first_hash + row * second_hash) % width
+            table[index] += count
+            if estimate is None or table[index] < estimate:
+                estimate = table[index]
+        self.total += count
+        return estimate
+
+    def estimate(self, key_hash):
+        """
+        Estimate the frequency of a key.
+
+        Args:
+            key_hash (int): The stable 64-bit hash of the key.
+
+        Returns:
+            int: An overestimate of the frequency of the key.
+
+        Time Complexity:
+            O(d), where d is the depth of the sketch.
+
+        Space Complexity:
+            O(1) - No additional space is used.
+        """
+        width = self.width
+        first_hash = key_hash & 0xFFFFFFFF
+        second_hash = (key_hash >> 32) | 1
+        return min(self.table[row * width + (first_hash + row * second_hash) % width]
+                   for row in range(self.depth))
+
+    def merge(self, other):
+        """
+        Add the counters of another sketch with the same dimensions into this one.
+
+        Args:
+            other (CountMinSketch): The sketch to merge.
+
+        Time Complexity:
+            O(w * d), where w is the width and d is the depth of the sketch.
+
+        Space Complexity:
+            O(1) - The table is updated in place.
+        """
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Cannot merge Count-Min sketches with different dimensions")
+        table = self.table
+        for index, count in enumerate(other.table):
+            if count:
+                table[index] += count
+        self.total += other.total
+
+    def error_bound(self):
+        """
+        Get the maximum amount by which an estimate exceeds the true frequency
+        (with probability 1 - e^-depth).
+
+        Returns:
+            int: The additive error bound, (e / width) * total rounded up.
+
+        Time Complexity:
+            O(1) - Simple arithmetic.
+
+        Space Complexity:
+            O(1) - No additional space is used.
+        """
+        return math.ceil(math.e / self.width * self.total)
+
+
+class HeavyHitterSketch:
+    """
+    This class tracks the most frequent keys of a stream under a fixed memory budget.
+
+    Every key is counted in a Count-Min sketch, and the top_k keys with the highest
+    estimates are kept as candidates. A key that is not a candidate replaces the
+    smallest candidate as soon as its estimate exceeds that candidate's estimate.
+    """
+    CANDIDATE_BYTES = 160  # rough size of a candidate: dict slot, packed five tuple key and its count
+
+    def __init__(self, memory_budget=64 * 1024 * 1024, top_k=1000, depth=4):
+        """
+        Initialize the HeavyHitterSketch class.
+
+        Args:
+            memory_budget (int): The approximate number of bytes the sketch may use.
+            top_k (int): The number of heavy hitters to track.
+            depth (int): The depth of the Count-Min sketch.
+
+        Raises:
+            ValueError: If the budget leaves no room for the Count-Min sketch once the
+                top_k candidates are accounted for.
+        """
+        self.memory_budget = memory_budget
+        self.top_k = top_k
+        self.depth = depth
+        width = (memory_budget - top_k * self.CANDIDATE_BYTES) // (depth * 8)
+        if width < 1:
+            minimum = top_k * self.CANDIDATE_BYTES + depth * 8
+            raise ValueError(f"A memory budget of {memory_budget} bytes is too small for {top_k} heavy hitters; "
+                             f"at least {minimum} bytes are needed")
+        self.count_min = CountMinSketch(width, depth)
+        self.candidates = {}
+        self._min_candidate = 0
+
+    def empty_copy(self):
+        """
+        Create an empty sketch with the same parameters, which can be merged with this one.
+
+        Returns:
+            HeavyHitterSketch: A new, empty sketch.
+        """
+        return HeavyHitterSketch(self.memory_budget, self.top_k, self.depth)
+
+    def add(self, key, count=1):
+        """
+        Add count occurrences of a key.
+
+        Args:
+            key (int or tuple): The key to count, usually a packed five tuple.
+            count (int): The number of occurrences to add.
+
+        Time Complexity:
+            O(d) on average, O(k) when a candidate is replaced, where d is the depth of
+            the Count-Min sketch and k is the number of candidates.
+
+        Space Complexity:
+            O(1) - The sketch and the candidate set have a fixed size.
+        """
+        estimate = self.count_min.add(stable_hash(key), count)
+        candidates = self.candidates
+        if key in candidates or len(candidates) < self.top_k:
+            candidates[key] = estimate
+            return
+        if estimate <= self._min_candidate:  # cached lower bound of the smallest candidate
+            return
+        min_key = min(candidates, key=candidates.get)
+        min_count = candidates[min_key]
+        if estimate > min_count:
+            del candidates[min_key]
+            candidates[key] = estimate
+        self._min_candidate = min_count
+
+    def merge(self, other):
+        """
+        Merge another sketch with the same parameters into this one.
+
+        Args:
+            other (HeavyHitterSketch): The sketch to merge.
+
+        Time Complexity:
+            O(w * d + k log k), where w and d are the dimensions of the Count-Min sketch
+            and k is the number of candidates.
+
+        Space Complexity:
+            O(k) - The union of both candidate sets is built before it is trimmed.
+        """
+        self.count_min.merge(other.count_min)
+        merged = dict.fromkeys(self.candidates)
+        merged.update(dict.fromkeys(other.candidates))
+        count_min = self.count_min
+        estimates = {key: count_min.estimate(stable_hash(key)) for key in merged}
+        top_keys = sorted(estimates, key=estimates.get, reverse=True)[:self.top_k]
+        self.candidates = {key: estimates[key] for key in top_keys}
+        self._min_candidate = 0
+
+    def items(self):
+        """
+        Get the heavy hitters ordered from most to least frequent.
+
+        Returns:
+            list: (key, estimated count) tuples. Every estimate overestimates the true
+            count by at most error_bound().
+
+        Time Complexity:
+            O(k log k), where k is the number of candidates.
+
+        Space Complexity:
+            O(k) - The sorted list of candidates.
+        """
+        return sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)
+
+    def error_bound(self):
+        """
+        Get the maximum overestimate of a reported count.
+
+        Returns:
+            int: The additive error bound of the Count-Min sketch.
+        """
+        return self.count_min.error_bound()
+
+    def __len__(self):
+        return len(self.candidates)
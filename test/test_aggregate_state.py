@@ -0,0 +1,76 @@
+import unittest
+import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from vpc_log_parser import ErrorSink, FlowLogProcessor, LookupTable
+from aggregate_state import AggregateState
+
+def process_to_blob(lookup_table_path, flow_log_path):
+    """
+    Process one flow log in a worker process and return its encoded aggregate state.
+    """
+    processor = FlowLogProcessor(LookupTable(lookup_table_path), flow_log_path, ErrorSink(None))
+    processor.process_log()
+    return AggregateState.from_processor(processor).to_bytes()
+
+class TestAggregateState(unittest.TestCase):
+    """
+    Test class for the AggregateState class.
+    """
+
+    def setUp(self):
+        with open('config.json', 'r') as config_file:
+            config = json.load(config_file)
+        self.lookup_table_path = Path(config['lookup_table_path'])
+        self.flow_log_path = Path(config['flow_log_path'])
+
+    def test_merged_blobs_match_single_run(self):
+        """
+        Test that merging the blobs of several processes gives the counts, in the same order, of one run over all files.
+        """
+        lines = self.flow_log_path.read_text(encoding='utf-8').splitlines()
+        lines.append("2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,https,tcp,1,1,1,2,ACCEPT,OK")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for file_index in range(3):
+                path = Path(temp_dir) / f"flow_log_{file_index}.txt"
+                path.write_text("\n".join(lines[file_index::3]) + "\n", encoding='utf-8')
+                paths.append(path)
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                blobs = list(executor.map(process_to_blob, [self.lookup_table_path] * len(paths), paths))
+
+            processor = FlowLogProcessor(LookupTable(self.lookup_table_path), temp_dir, ErrorSink(None))
+            processor.process_log()
+
+        merged = AggregateState.merge_all(blobs)
+        self.assertEqual(list(merged.tag_counts.items()), list(processor.tag_counts.items()))
+        self.assertEqual(list(merged.port_protocol_counts.items()), list(processor.port_protocol_counts.items()))
+        self.assertEqual(list(merged.five_tuple_counts.items()), list(processor.get_five_tuple_counts_dict().items()))
+        self.assertEqual(merged.rejection_counts, processor.get_error_summary())
+
+        regrouped = AggregateState.from_bytes(blobs[0]).merge(AggregateState.merge_all(blobs[1:]))
+        self.assertEqual(regrouped.to_bytes(), merged.to_bytes())
+        self.assertEqual(AggregateState.from_bytes(merged.to_bytes()).to_bytes(), merged.to_bytes())
+
+    def test_invalid_blobs(self):
+        """
+        Test that blobs of another format, another version or another five tuple setting are rejected.
+        """
+        state = AggregateState(count_five_tuples=False)
+        state.tag_counts["sv_P1"] = 3
+        blob = state.to_bytes()
+        self.assertEqual(AggregateState.from_bytes(blob).tag_counts, {"sv_P1": 3})
+        self.assertIsNone(AggregateState.from_bytes(blob).five_tuple_counts)
+
+        with self.assertRaises(ValueError):
+            AggregateState.from_bytes(b"not a state")
+        with self.assertRaises(ValueError):
+            AggregateState.from_bytes(blob[:4] + b"\x63\x00" + blob[6:])
+        with self.assertRaises(ValueError):
+            AggregateState.from_bytes(blob[:-3])
+        with self.assertRaises(ValueError):
+            AggregateState().merge_bytes(blob)
+
+if __name__ == '__main__':
+    unittest.main()
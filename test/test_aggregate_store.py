@@ -0,0 +1,84 @@
+import unittest
+import json
+import tempfile
+from pathlib import Path
+from vpc_log_parser import ErrorSink, FlowLogProcessor, LookupTable
+from aggregate_store import AggregateStore, write_flow_logs_to_store
+
+class TestAggregateStore(unittest.TestCase):
+    """
+    Test class for the AggregateStore class.
+    """
+
+    def setUp(self):
+        with open('config.json', 'r') as config_file:
+            config = json.load(config_file)
+        self.lookup_table = LookupTable(Path(config['lookup_table_path']))
+        self.flow_log_path = Path(config['flow_log_path'])
+
+    def test_range_queries_match_processor(self):
+        """
+        Test that summing every bucket of the store gives the counts of a batch run, and that
+        single-key, ranged and top-K queries agree with them.
+        """
+        processor = FlowLogProcessor(self.lookup_table, self.flow_log_path, ErrorSink(None))
+        processor.process_log()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = AggregateStore(temp_dir, bucket_seconds=3600, rollup_seconds=86400)
+            bucket_starts = write_flow_logs_to_store(self.lookup_table, self.flow_log_path, store, ErrorSink(None))
+
+            self.assertEqual(store.range_sum("tag_counts"), processor.get_tag_counts_dict())
+            self.assertEqual(store.range_sum("port_protocol_counts"), processor.get_port_protocol_counts_dict())
+            self.assertEqual(store.range_sum("five_tuple_counts"), processor.get_five_tuple_counts_dict())
+            self.assertEqual(store.range_sum("tag_counts", key="sv_P1"), processor.get_tag_counts("sv_P1"))
+            self.assertEqual(store.range_sum("port_protocol_counts", key=(25, "tcp")), processor.port_protocol_counts[(25, "tcp")])
+            self.assertEqual(store.top_k("tag_counts", 1)[0][1], max(processor.get_tag_counts_dict().values()))
+
+            first_bucket = bucket_starts[0]
+            self.assertEqual(store.range_sum("tag_counts", first_bucket, first_bucket + 1),
+                             dict(store.segment(first_bucket).items("tag_counts")))
+            self.assertEqual(store.range_sum("tag_counts", end=first_bucket), {})
+
+    def test_rollups_and_merges(self):
+        """
+        Test that whole days are read from rollups and that writing a bucket again adds to it.
+        """
+        day = 86400 * 19000
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = AggregateStore(temp_dir, bucket_seconds=3600, rollup_seconds=86400)
+            store.write_buckets({day + hour * 3600: ({"web": hour}, {(443, "tcp"): hour}, None) for hour in range(1, 25)})
+            store.write_bucket(day + 3600, {"web": 10, "dns": 1}, {(53, "udp"): 1})
+
+            self.assertEqual(store.plan(day, day + 86400), [("rollup", day)])
+            self.assertEqual(store.plan(day + 7200, day + 86400)[0], ("bucket", day + 7200))
+            self.assertEqual(store.range_sum("tag_counts", day, day + 86400), {"dns": 1, "web": 10 + sum(range(1, 24))})
+            self.assertEqual(store.range_sum("tag_counts", day + 3600, day + 7200), {"dns": 1, "web": 11})
+            self.assertEqual(store.range_sum("tag_counts"), {"dns": 1, "web": 10 + sum(range(1, 25))})
+            self.assertEqual(store.top_k("port_protocol_counts", 2, day, day + 86400),
+                             [((443, "tcp"), sum(range(1, 24))), ((53, "udp"), 1)])
+
+    def test_finished_buckets_are_written_early(self):
+        """
+        Test that buckets are flushed as the logs move past them, that late lines are merged
+        into their stored bucket, and that a store rejects another bucket length.
+        """
+        line = "2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,25,tcp,10,840,{start},{end},ACCEPT,OK\n"
+        starts = [hour * 3600 for hour in range(1, 50)] + [3600]  # the last line is late for its bucket
+        with tempfile.TemporaryDirectory() as temp_dir:
+            flow_log_path = Path(temp_dir) / "flow_log.txt"
+            flow_log_path.write_text("".join(line.format(start=start, end=start + 60) for start in starts), encoding='utf-8')
+            store = AggregateStore(Path(temp_dir) / "store", bucket_seconds=3600, rollup_seconds=86400)
+            written = []
+            write_buckets = store.write_buckets
+            store.write_buckets = lambda buckets: written.append(len(buckets)) or write_buckets(buckets)
+            bucket_starts = write_flow_logs_to_store(self.lookup_table, flow_log_path, store, ErrorSink(None), batch_lines=1)
+
+            self.assertEqual(bucket_starts, [hour * 3600 for hour in range(1, 50)])
+            self.assertLessEqual(max(written), 2)
+            self.assertEqual(store.range_sum("tag_counts", 3600, 7200), {"sv_P1": 2})
+            self.assertEqual(store.range_sum("tag_counts"), {"sv_P1": len(starts)})
+            with self.assertRaises(ValueError):
+                AggregateStore(Path(temp_dir) / "store", bucket_seconds=60, rollup_seconds=86400)
+
+if __name__ == '__main__':
+    unittest.main()
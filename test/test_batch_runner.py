@@ -0,0 +1,141 @@
+import unittest
+import gzip
+import os
+from collections import Counter
+import tempfile
+from pathlib import Path
+from vpc_log_parser import ErrorSink, FlowLogProcessor, LookupTable, iter_flow_log_lines
+from batch_runner import BatchRunner, _process_batch, resolve_batch_inputs
+
+class TestBatchRunner(unittest.TestCase):
+    """
+    Test class for the BatchRunner class.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.lookup_table_path = self.root / "lookup_table.csv"
+        self.lookup_table_path.write_text("dstport,protocol,tag\n443,tcp,sv_P1\n53,udp,sv_P2\n", encoding='utf-8')
+        self.logs = self.root / "logs"
+        lines = [f"2,123456789012,eni-0a1b2c3d,10.0.{index % 7}.1,10.0.{index % 5}.2,{49152 + index % 3},"
+                 f"{(443, 53, 80)[index % 3]},{('tcp', 'udp', 'tcp')[index % 3]},1,100,1,2,ACCEPT,OK"
+                 for index in range(600)]
+        lines[42] = "2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,https,tcp,1,100,1,2,ACCEPT,OK"
+        for day in range(3):
+            for hour in range(4):
+                path = self.logs / "2026" / "10" / f"{day + 1:02d}" / f"{hour:02d}.log"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                first = (day * 4 + hour) * 20
+                path.write_text("\n".join(lines[first:first + 20]) + "\n", encoding='utf-8')
+        (self.logs / "2026" / "big.log").write_text("\n".join(lines[240:]) + "\n", encoding='utf-8')
+        with gzip.open(self.logs / "2026" / "10" / "02" / "corrupt.gz", "wb") as corrupt_file:
+            corrupt_file.write(b"x" * 1000)
+        data = (self.logs / "2026" / "10" / "02" / "corrupt.gz").read_bytes()
+        (self.logs / "2026" / "10" / "02" / "corrupt.gz").write_bytes(data[:20])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_resolve_batch_inputs(self):
+        """
+        Test that directories, recursive globs and manifests expand to every file once, in input order.
+        """
+        manifest_path = self.root / "manifest.txt"
+        manifest_path.write_text("# hours of the first day\nlogs/2026/10/01/00.log\n\nlogs/2026/10/01/0[12].log\n"
+                                 "missing.log\n", encoding='utf-8')
+        files, failures = resolve_batch_inputs(["@" + str(manifest_path), str(self.logs / "**" / "03.log"),
+                                                self.logs / "2026" / "10" / "03"])
+        names = [os.path.relpath(path, self.logs) for path, size in files]
+        self.assertEqual(names, [os.path.join("2026", "10", "01", "00.log"), os.path.join("2026", "10", "01", "01.log"),
+                                 os.path.join("2026", "10", "01", "02.log"), os.path.join("2026", "10", "01", "03.log"),
+                                 os.path.join("2026", "10", "02", "03.log"), os.path.join("2026", "10", "03", "03.log"),
+                                 os.path.join("2026", "10", "03", "00.log"), os.path.join("2026", "10", "03", "01.log"),
+                                 os.path.join("2026", "10", "03", "02.log")])
+        self.assertEqual([size for path, size in files], [os.path.getsize(path) for path, size in files])
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0][0].endswith("missing.log"))
+
+    def test_merged_results_match_serial_run(self):
+        """
+        Test that batches and shards, run largest first, merge into the counts, ordering and errors of a serial run, with failed files reported and left out.
+        """
+        files, failures = resolve_batch_inputs([self.logs])
+        serial = FlowLogProcessor(LookupTable(self.lookup_table_path), None, ErrorSink(None))
+        for path, size in files:
+            if not path.endswith("corrupt.gz"):
+                serial._process_lines(iter_flow_log_lines(path))
+        for workers in (1, 2):
+            runner = BatchRunner(LookupTable(self.lookup_table_path), ErrorSink(None), workers, volume_metrics=True,
+                                 batch_bytes=4096, batch_files=3, shard_bytes=2048)
+            units = runner.plan(files)
+            self.assertGreater(len([unit for unit in units if unit[2][0][2] is not None]), 1)
+            merged = runner.run([self.logs])
+            self.assertEqual(list(merged.tag_counts.items()), list(serial.tag_counts.items()))
+            self.assertEqual(list(merged.port_protocol_counts.items()), list(serial.port_protocol_counts.items()))
+            self.assertEqual(list(merged.five_tuple_counts.items()), list(serial.five_tuple_counts.items()))
+            self.assertEqual(merged.get_error_summary(), {"Invalid port number": 1})
+            self.assertEqual(runner.files_processed, len(files) - 1)
+            self.assertEqual([Path(path).name for path, error_msg in runner.failures], ["corrupt.gz"])
+
+    def test_pending_results_are_bounded(self):
+        """
+        Test that no more than max_pending units wait to be merged, besides the shards of the file being merged.
+        """
+        class RecordingRunner(BatchRunner):
+            def _run_units(self, merged, units, progress):
+                self.largest_backlog = 0
+                yielded = 0
+                for unit_index, results in super()._run_units(merged, units, progress):
+                    yielded += 1
+                    self.largest_backlog = max(self.largest_backlog, yielded - progress["merged_units"])
+                    yield unit_index, results
+
+        files, failures = resolve_batch_inputs([self.logs])
+        unbounded = BatchRunner(LookupTable(self.lookup_table_path), ErrorSink(None), 2,
+                                batch_bytes=4096, batch_files=3, shard_bytes=2048).run([self.logs])
+        runner = RecordingRunner(LookupTable(self.lookup_table_path), ErrorSink(None), 2,
+                                 batch_bytes=4096, batch_files=3, shard_bytes=2048, max_pending=2)
+        shards = max(Counter(group for group, size, entries in runner.plan(files)).values())
+        merged = runner.run([self.logs])
+
+        self.assertLessEqual(runner.largest_backlog, 2 + shards)
+        self.assertEqual(list(merged.tag_counts.items()), list(unbounded.tag_counts.items()))
+        self.assertEqual(list(merged.five_tuple_counts.items()), list(unbounded.five_tuple_counts.items()))
+
+    def test_failed_file_is_left_out_of_its_batch(self):
+        """
+        Test that a file that cannot be read in the middle of a batch is left out and the other files are kept.
+        """
+        day = self.logs / "2026" / "10" / "02"
+        entries = [(str(day / "00.log"), 0, None, None), (str(day / "corrupt.gz"), 0, None, None),
+                   (str(day / "01.log"), 0, None, None)]
+        initargs = (LookupTable(self.lookup_table_path).freeze(), "counts", 0, None, False)
+        results, failures = _process_batch((None, entries), initargs)
+        expected, _ = _process_batch((None, entries[:1] + entries[2:]), initargs)
+
+        self.assertEqual([Path(path).name for path, error_msg in failures], ["corrupt.gz"])
+        self.assertEqual(results[0], expected[0])
+        self.assertEqual(results[2], expected[2])
+
+    def test_file_failing_mid_aggregation_is_left_out(self):
+        """
+        Test that a file that fails while it is being aggregated leaves no partial counts in its batch.
+        """
+        day = self.logs / "2026" / "10" / "02"
+        undecodable_path = day / "undecodable.log"  # a rejected line that is not UTF-8 fails after the line before it is counted
+        undecodable_path.write_bytes(b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,443,tcp,1,100,1,2,ACCEPT,OK\n"
+                                     b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,\xff,tcp,1,100,1,2,ACCEPT,OK\n")
+        entries = [(str(day / "00.log"), 0, None, None), (str(undecodable_path), 0, None, None),
+                   (str(day / "corrupt.gz"), 0, None, None), (str(day / "01.log"), 0, None, None)]
+        initargs = (LookupTable(self.lookup_table_path).freeze(), "counts", 0, None, False)
+        results, failures = _process_batch((None, entries), initargs)
+        expected, _ = _process_batch((None, entries[:1] + entries[3:]), initargs)
+
+        self.assertEqual([Path(path).name for path, error_msg in failures], ["undecodable.log", "corrupt.gz"])
+        self.assertEqual(results[0], expected[0])
+        self.assertEqual(list(results[1].items()), list(expected[1].items()))
+        self.assertEqual(results[2], expected[2])
+
+if __name__ == '__main__':
+    unittest.main()
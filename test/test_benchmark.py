@@ -0,0 +1,56 @@
+import unittest
+import tempfile
+from pathlib import Path
+from benchmark.generate_flow_logs import write_flow_log, write_lookup_table
+from benchmark.parse_line_benchmark import run_parse_line_benchmark
+from benchmark.run_benchmark import WRITER_OUTPUTS, run_benchmark
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Test class for the synthetic flow log generator and the benchmark harness.
+    """
+
+    def test_generated_flow_log(self):
+        """
+        Test that the generator is deterministic and honours the line count, error rate and cardinality.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first_path, second_path = Path(temp_dir) / "first.txt", Path(temp_dir) / "second.txt"
+            size = write_flow_log(first_path, 20000, error_rate=0.1, cardinality=500, seed=7)
+            write_flow_log(second_path, 20000, error_rate=0.1, cardinality=500, seed=7)
+            lines = first_path.read_text(encoding="utf-8").splitlines()
+
+            self.assertEqual(first_path.read_bytes(), second_path.read_bytes())
+            self.assertEqual(size, first_path.stat().st_size)
+        self.assertEqual(len(lines), 20000)
+        valid_lines = [line for line in lines if line.count(",") == 13 and line.split(",")[6].isdigit()
+                       and int(line.split(",")[6]) <= 65535 and line.split(",")[7] in ("tcp", "udp")]
+        self.assertAlmostEqual(1 - len(valid_lines) / len(lines), 0.1, delta=0.02)
+        self.assertLessEqual(len({tuple(line.split(",")[3:8]) for line in valid_lines}), 500)
+
+    def test_run_benchmark(self):
+        """
+        Test that the harness reports every stage and counts the input and the rejected lines.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            flow_log_path, lookup_table_path = Path(temp_dir) / "flow_log.txt", Path(temp_dir) / "lookup_table.csv"
+            write_flow_log(flow_log_path, 5000, error_rate=0.02, cardinality=200)
+            self.assertEqual(write_lookup_table(lookup_table_path, 100), 100)
+            results = run_benchmark(flow_log_path, lookup_table_path, temp_dir, error_log_mode="counts")
+            self.assertTrue((Path(temp_dir) / "tag_counts.txt").exists())
+
+        self.assertEqual(results["input"]["lines"], 5000)
+        self.assertEqual(set(results["seconds"]), {"lookup_table_load", "process_log", *WRITER_OUTPUTS})
+        self.assertGreater(results["lines_per_second"], 0)
+        self.assertGreater(results["rejected_lines"], 0)
+
+    def test_parse_line_benchmark(self):
+        """
+        Test that the line parser micro-benchmark times both parsers.
+        """
+        results = run_parse_line_benchmark(lines=2000, repeat=1)
+        self.assertEqual(set(results["ns_per_line"]), {"validate_line", "parse_line"})
+        self.assertGreater(results["speedup"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+from pathlib import Path
+from vpc_log_parser import ErrorSink
+
+class TestErrorSink(unittest.TestCase):
+    """
+    Test class for the ErrorSink class.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.error_log_path = Path(self.temp_dir.name) / "error_log.txt"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def record_errors(self, error_sink):
+        for port in range(5):
+            error_sink.record(f"bad line {port}", f"Port not within acceptable range: {70000 + port}")
+        error_sink.record("bad protocol line", "Protocol not within accepted values: tpp")
+        error_sink.close()
+
+    def test_full_mode(self):
+        """
+        Test that full mode writes every rejected line in the existing error log format.
+        """
+        self.record_errors(ErrorSink(self.error_log_path))
+        with open(self.error_log_path, "r", encoding='utf-8') as error_file:
+            content = error_file.read().splitlines()
+
+        self.assertEqual(len(content), 12)
+        self.assertEqual(content[0], "Error in line: bad line 0")
+        self.assertEqual(content[1], "Error message: Port not within acceptable range: 70000")
+
+    def test_sample_mode(self):
+        """
+        Test that sample mode only writes the first lines of every error reason but still counts all of them.
+        """
+        error_sink = ErrorSink(self.error_log_path, mode="sample", max_samples=2)
+        self.record_errors(error_sink)
+        with open(self.error_log_path, "r", encoding='utf-8') as error_file:
+            content = error_file.read().splitlines()
+
+        self.assertEqual(len(content), 6)
+        self.assertNotIn("Error in line: bad line 2", content)
+        self.assertEqual(error_sink.get_rejection_summary(),
+                         {"Port not within acceptable range": 5, "Protocol not within accepted values": 1})
+
+    def test_counts_mode(self):
+        """
+        Test that counts mode never creates the error log.
+        """
+        error_sink = ErrorSink(self.error_log_path, mode="counts")
+        self.record_errors(error_sink)
+
+        self.assertFalse(self.error_log_path.exists())
+        self.assertEqual(error_sink.get_rejection_summary()["Port not within acceptable range"], 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import os
+import socket
+import tempfile
+from pathlib import Path
+from vpc_log_parser import ErrorSink, FlowLogProcessor, LookupTable, Writer
+from five_tuple_keys import decode_five_tuple, pack_five_tuple
+
+class TestFiveTupleKeys(unittest.TestCase):
+    """
+    Test class for the packed five tuple keys.
+    """
+
+    def test_round_trip(self):
+        """
+        Test that IPv4, IPv6 and mixed five tuples are packed into distinct integers and decoded back unchanged.
+        """
+        ipv4_compatible = socket.inet_ntop(socket.AF_INET6, bytes(12) + bytes([10, 0, 0, 1]))  # same low 32 bits as 10.0.0.1
+        five_tuples = [
+            ("10.0.0.1", "10.0.0.2", 49152, 443, "tcp"),
+            ("255.255.255.255", "0.0.0.0", 65535, 0, "udp"),
+            ("2001:db8::1", "fe80::1", 1024, 53, "udp"),
+            ("10.0.0.1", "fe80::2", 49152, 443, "tcp"),
+            (ipv4_compatible, "10.0.0.2", 49152, 443, "tcp"),
+        ]
+        keys = [pack_five_tuple(*five_tuple) for five_tuple in five_tuples]
+        self.assertTrue(all(type(key) is int for key in keys))
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual([decode_five_tuple(key) for key in keys], five_tuples)
+
+    def test_unpackable_five_tuples_fall_back_to_tuples(self):
+        """
+        Test that addresses which would not decode to the same text are kept as plain tuples.
+        """
+        for five_tuple in [("2001:DB8::1", "10.0.0.2", 1, 2, "tcp"), ("-", "10.0.0.2", 1, 2, "tcp"),
+                           ("10.0.0.1", "010.0.0.2", 1, 2, "udp")]:
+            key = pack_five_tuple(*five_tuple)
+            self.assertEqual(key, five_tuple)
+            self.assertEqual(decode_five_tuple(key), five_tuple)
+
+    def test_processor_and_writer_decode_keys(self):
+        """
+        Test that the five tuple output of a processor with packed keys shows the addresses as they were logged.
+        """
+        lines = ["2,123456789012,eni-0a1b2c3d,2001:db8::1,2001:db8::2,49152,443,tcp,1,1,1,2,ACCEPT,OK",
+                 "2,123456789012,eni-0a1b2c3d,2001:db8::1,2001:db8::2,49152,443,tcp,1,1,1,2,ACCEPT,OK",
+                 "2,123456789012,eni-0a1b2c3d,2001:DB8::3,10.0.0.2,49153,53,udp,1,1,1,2,ACCEPT,OK"]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            lookup_table_path = Path(temp_dir) / "lookup_table.csv"
+            lookup_table_path.write_text("dstport,protocol,tag\n443,tcp,sv_P1\n", encoding='utf-8')
+            flow_log_path = Path(temp_dir) / "flow_log.txt"
+            flow_log_path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+            processor = FlowLogProcessor(LookupTable(lookup_table_path), flow_log_path, ErrorSink(None))
+            processor.process_log()
+            expected = {("2001:db8::1", "2001:db8::2", 49152, 443, "tcp"): 2,
+                        ("2001:DB8::3", "10.0.0.2", 49153, 53, "udp"): 1}
+            self.assertEqual(processor.get_five_tuple_counts_dict(), expected)
+            writer = Writer(processor.get_tag_counts_dict(), processor.get_port_protocol_counts_dict(),
+                            processor.get_packed_five_tuple_counts())
+            previous_dir = os.getcwd()
+            os.chdir(temp_dir)
+            try:
+                writer.output_five_tuple_counts()
+            finally:
+                os.chdir(previous_dir)
+            output = (Path(temp_dir) / "five_tuple_counts.txt").read_text(encoding='utf-8')
+            self.assertIn("(2001:db8::1,2001:db8::2,49152,443,tcp),2", output)
+            self.assertIn("(2001:DB8::3,10.0.0.2,49153,53,udp),1", output)
+
+if __name__ == '__main__':
+    unittest.main()
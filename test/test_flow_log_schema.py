@@ -0,0 +1,91 @@
+import unittest
+import tempfile
+from pathlib import Path
+from vpc_log_parser import ErrorSink, FlowLogProcessor, LookupTable
+from flow_log_schema import DEFAULT_FIELDS, DEFAULT_SCHEMA, FlowLogSchema
+
+V5_HEADER = ("version vpc-id subnet-id interface-id account-id srcaddr dstaddr srcport dstport pkt-srcaddr "
+             "pkt-dstaddr protocol bytes packets start end action log-status")
+
+class TestFlowLogSchema(unittest.TestCase):
+    """
+    Test class for the FlowLogSchema class and schema-driven parsing in FlowLogProcessor.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.lookup_table_path = Path(self.temp_dir.name) / "lookup_table.csv"
+        self.lookup_table_path.write_text("dstport,protocol,tag\n443,tcp,sv_P1\n53,udp,sv_P2\n", encoding='utf-8')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def process(self, name, text, schema=None, workers=1):
+        """
+        Write a flow log into the temporary directory, process it and return the processor.
+        """
+        flow_log_path = Path(self.temp_dir.name) / name
+        flow_log_path.write_text(text, encoding='utf-8')
+        processor = FlowLogProcessor(LookupTable(self.lookup_table_path), flow_log_path, ErrorSink(None),
+                                     volume_metrics=True, schema=schema)
+        if workers == 1:
+            processor.process_log()
+        else:
+            processor.process_log_parallel(workers, shard_size=64)
+        return processor
+
+    def test_schema_sources(self):
+        """
+        Test that schemas are built from field lists, AWS format strings and header lines, and that invalid ones are rejected.
+        """
+        self.assertEqual(FlowLogSchema.from_config(None), None)
+        self.assertEqual(FlowLogSchema.from_config(list(DEFAULT_FIELDS)), FlowLogSchema(DEFAULT_FIELDS, ",", True))
+        schema = FlowLogSchema.from_config("${" + "} ${".join(V5_HEADER.split()) + "}")
+        self.assertEqual(schema, FlowLogSchema.from_header(V5_HEADER.encode('utf-8') + b"\n"))
+        self.assertEqual((schema.delimiter, schema.indices["dstport"], schema.protocol_numbers), (b" ", 8, True))
+        self.assertEqual(FlowLogSchema.from_config({"format": "${srcaddr},${dstaddr},${srcport},${dstport},${protocol}",
+                                                    "protocol_numbers": False}).protocol_numbers, False)
+        self.assertIsNone(FlowLogSchema.from_header(b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,443,tcp\n"))
+        with self.assertRaises(ValueError):
+            FlowLogSchema(["srcaddr", "dstaddr", "srcport", "dstport"])
+        with self.assertRaises(ValueError):
+            FlowLogSchema.from_format("${srcaddr} ${dstaddr},${srcport} ${dstport} ${protocol}")
+
+    def test_header_schema_matches_default_format(self):
+        """
+        Test that a version 5 log with a header line and protocol numbers gives the counts of the same flows in the default format, serially and in parallel.
+        """
+        flows = [("10.0.0.1", "10.0.0.2", 49152, 443, "tcp", 6, 10, 1000, 100, 110),
+                 ("10.0.0.3", "10.0.0.4", 49153, 53, "udp", 17, 1, 80, 100, 101),
+                 ("10.0.0.1", "10.0.0.2", 49152, 443, "tcp", 6, 5, 500, 120, 130),
+                 ("10.0.0.5", "10.0.0.6", 49154, 8080, "tcp", 6, 2, 200, 100, 100)] * 5
+        v2_lines = [f"2,123456789012,eni-0a1b2c3d,{src},{dst},{sport},{dport},{name},{packets},{size},{start},{end},ACCEPT,OK"
+                    for src, dst, sport, dport, name, number, packets, size, start, end in flows]
+        v5_lines = [V5_HEADER] + [f"5 vpc-1 subnet-1 eni-0a1b2c3d 123456789012 {src} {dst} {sport} {dport} {src} {dst} "
+                                  f"{number} {size} {packets} {start} {end} ACCEPT OK"
+                                  for src, dst, sport, dport, name, number, packets, size, start, end in flows]
+        v2 = self.process("v2.txt", "\n".join(v2_lines) + "\n")
+        for workers in (1, 2):
+            v5 = self.process(f"v5_{workers}.txt", "\n".join(v5_lines) + "\n", workers=workers)
+            self.assertEqual(v5.get_error_summary(), {})
+            self.assertEqual(v5.get_tag_counts_dict(), v2.get_tag_counts_dict())
+            self.assertEqual(v5.get_port_protocol_counts_dict(), v2.get_port_protocol_counts_dict())
+            self.assertEqual(v5.get_five_tuple_counts_dict(), v2.get_five_tuple_counts_dict())
+            self.assertEqual(v5.volume_counts.for_tag("sv_P1"), v2.volume_counts.for_tag("sv_P1"))
+
+    def test_configured_schema(self):
+        """
+        Test that a configured schema with reordered columns parses lines like the default schema, with the same error messages.
+        """
+        schema = FlowLogSchema(["protocol", "dstport", "srcport", "dstaddr", "srcaddr"], "|")
+        processor = self.process("custom.txt", "tcp|443|49152|10.0.0.2|10.0.0.1\nTCP|443|49152|10.0.0.2|10.0.0.1\n"
+                                               "6|443|49152|10.0.0.2|10.0.0.1\nudp|https|1|10.0.0.2|10.0.0.1\n"
+                                               "udp|53|1|10.0.0.2\n", schema)
+        self.assertEqual(processor.get_five_tuple_counts_dict(), {("10.0.0.1", "10.0.0.2", 49152, 443, "tcp"): 2})
+        self.assertEqual(processor.get_error_summary(), {"Protocol not within accepted values": 1,
+                                                         "Invalid port number": 1, "Incorrect size of data": 1})
+        self.assertEqual(processor.compile_schema(schema), processor.compile_schema(FlowLogSchema(schema.fields, "|")))
+        self.assertEqual(FlowLogProcessor(None, None).schema, DEFAULT_SCHEMA)
+
+if __name__ == '__main__':
+    unittest.main()
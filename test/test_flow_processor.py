@@ -1,7 +1,15 @@
 import unittest
 from pathlib import Path
-from vpc_log_parser import LookupTable, FlowLogProcessor
+from vpc_log_parser import ErrorSink, LookupTable, FlowLogProcessor, PortProtocolCounter, VolumeCounter, Writer
+import bz2
+import gc
+import gzip
 import json
+import os
+import pickle
+import sys
+import tempfile
+import warnings
 
 class TestFlowLogProcessor(unittest.TestCase):
     """
@@ -50,5 +58,225 @@ class TestFlowLogProcessor(unittest.TestCase):
         self.assertEqual(pp_counts_dict, processor.port_protocol_counts)
         self.assertIsInstance(pp_counts_dict, dict)
 
+    def test_port_protocol_counter(self):
+        """
+        Test that the dense port-protocol counter behaves like the dictionary it replaces.
+        """
+        counter = PortProtocolCounter()
+        counter.add(443, 'tcp')
+        counter.add(53, 'udp', 2)
+        counter.add(443, 'tcp')
+
+        self.assertEqual(list(counter.items()), [((443, 'tcp'), 2), ((53, 'udp'), 2)])
+        self.assertIn((53, 'udp'), counter)
+        self.assertNotIn((53, 'tcp'), counter)
+        self.assertNotIn((70000, 'tcp'), counter)
+        self.assertEqual(pickle.loads(pickle.dumps(counter)), {(443, 'tcp'): 2, (53, 'udp'): 2})
+
+    def test_compressed_flow_logs(self):
+        """
+        Test that gzip and bz2 compressed flow logs are detected by their magic bytes and give the same counts.
+        """
+        with open(self.flow_log_path, 'rb') as flow_file:
+            content = flow_file.read()
+        plain = FlowLogProcessor(LookupTable(self.lookup_table_path), self.flow_log_path)
+        plain.process_log()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for compress, name in ((gzip.compress, "flow_log.gz"), (bz2.compress, "flow_log")):
+                compressed_path = Path(temp_dir) / name
+                with open(compressed_path, 'wb') as compressed_file:
+                    compressed_file.write(compress(content))
+                processor = FlowLogProcessor(LookupTable(self.lookup_table_path), compressed_path)
+                processor.process_log()
+
+                self.assertEqual(processor.tag_counts, plain.tag_counts)
+                self.assertEqual(list(processor.five_tuple_counts.items()), list(plain.five_tuple_counts.items()))
+
+    def test_compressed_flow_logs_close_their_files(self):
+        """
+        Test that reading a gzip or bz2 compressed flow log closes the underlying file as well.
+        """
+        with open(self.flow_log_path, 'rb') as flow_file:
+            content = flow_file.read()
+        unraisable = []
+        default_hook = sys.unraisablehook
+        sys.unraisablehook = unraisable.append  # a ResourceWarning raised from __del__ is only reported here
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir, warnings.catch_warnings():
+                warnings.simplefilter("error", ResourceWarning)
+                for compress, name in ((gzip.compress, "flow_log.gz"), (bz2.compress, "flow_log.bz2")):
+                    compressed_path = Path(temp_dir) / name
+                    with open(compressed_path, 'wb') as compressed_file:
+                        compressed_file.write(compress(content))
+                    processor = FlowLogProcessor(LookupTable(self.lookup_table_path), compressed_path)
+                    processor.process_log()
+                    del processor
+                    gc.collect()
+        finally:
+            sys.unraisablehook = default_hook
+
+        self.assertEqual([hook_args.exc_value for hook_args in unraisable], [])
+
+    def test_incremental_processing(self):
+        """
+        Test that incremental runs only fold in appended lines and rescan a truncated file.
+        """
+        with open(self.flow_log_path, 'r', encoding='utf-8') as flow_file:
+            lines = flow_file.read().splitlines()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            flow_log_path = Path(temp_dir) / "flow_log.txt"
+            checkpoint_path = Path(temp_dir) / "checkpoint.bin"
+
+            def incremental_run():
+                processor = FlowLogProcessor(LookupTable(self.lookup_table_path), flow_log_path)
+                processor.process_log_incremental(checkpoint_path)
+                return processor
+
+            def full_run():
+                processor = FlowLogProcessor(LookupTable(self.lookup_table_path), flow_log_path)
+                processor.process_log()
+                return processor
+
+            with open(flow_log_path, 'w', encoding='utf-8') as flow_file:
+                flow_file.write("\n".join(lines[:10]) + "\n" + lines[10][:20])  # last line is still being written
+            first = incremental_run()
+            self.assertEqual(sum(first.port_protocol_counts.values()), 8)
+
+            with open(flow_log_path, 'a', encoding='utf-8') as flow_file:
+                flow_file.write(lines[10][20:] + "\n" + "\n".join(lines[11:]) + "\n")
+            resumed = incremental_run()
+            expected = full_run()
+            self.assertEqual(resumed.tag_counts, expected.tag_counts)
+            self.assertEqual(dict(resumed.port_protocol_counts), dict(expected.port_protocol_counts))
+            self.assertEqual(resumed.five_tuple_counts, expected.five_tuple_counts)
+            self.assertEqual(resumed.get_error_summary(), expected.get_error_summary())
+
+            with open(flow_log_path, 'w', encoding='utf-8') as flow_file:
+                flow_file.write(lines[0] + "\n")
+            truncated = incremental_run()
+            self.assertEqual(truncated.tag_counts, {'sv_P1': 1})
+
+    def test_incremental_rescans_after_lookup_table_change(self):
+        """
+        Test that a checkpoint saved with another lookup table is discarded instead of crediting its sums to the wrong tags.
+        """
+        with open(self.flow_log_path, 'r', encoding='utf-8') as flow_file:
+            lines = flow_file.read().splitlines()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            flow_log_path = Path(temp_dir) / "flow_log.txt"
+            checkpoint_path = Path(temp_dir) / "checkpoint.bin"
+            lookup_table_path = Path(temp_dir) / "lookup_table.csv"
+            flow_log_path.write_text("\n".join(lines[:10]) + "\n", encoding='utf-8')
+            FlowLogProcessor(LookupTable(self.lookup_table_path), flow_log_path,
+                             volume_metrics=True).process_log_incremental(checkpoint_path)
+
+            # new tags come first, so every tag ID of the old table now belongs to another tag
+            lookup_table_path.write_text("dstport,protocol,tag\n80,tcp,web\n443,tcp,tls\n25,tcp,sv_P1\n68,udp,sv_P2\n",
+                                         encoding='utf-8')
+            with open(flow_log_path, 'a', encoding='utf-8') as flow_file:
+                flow_file.write("\n".join(lines[10:]) + "\n")
+            resumed = FlowLogProcessor(LookupTable(lookup_table_path), flow_log_path, volume_metrics=True)
+            resumed.process_log_incremental(checkpoint_path)
+            expected = FlowLogProcessor(LookupTable(lookup_table_path), flow_log_path, volume_metrics=True)
+            expected.process_log()
+
+        self.assertEqual(resumed.tag_counts, expected.tag_counts)
+        self.assertEqual(resumed.volume_counts.tag_sums, expected.volume_counts.tag_sums)
+        self.assertEqual(resumed.get_error_summary(), expected.get_error_summary())
+
+    def test_parallel_matches_serial(self):
+        """
+        Test that sharded parallel processing produces the same counts, in the same order, as a serial run.
+        """
+        with open(self.flow_log_path, 'r', encoding='utf-8') as flow_file:
+            sample_lines = flow_file.read().splitlines()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for file_index in range(2):
+                with open(Path(temp_dir) / f"flow_log_{file_index}.txt", 'w', encoding='utf-8') as flow_file:
+                    flow_file.write("\n".join(sample_lines * 20) + "\n")
+
+            serial = FlowLogProcessor(LookupTable(self.lookup_table_path), temp_dir, volume_metrics=True)
+            serial.process_log()
+            parallel = FlowLogProcessor(LookupTable(self.lookup_table_path), temp_dir, volume_metrics=True)
+            parallel.process_log_parallel(workers=2, shard_size=512)
+
+        self.assertEqual(list(parallel.tag_counts.items()), list(serial.tag_counts.items()))
+        self.assertEqual(list(parallel.port_protocol_counts.items()), list(serial.port_protocol_counts.items()))
+        self.assertEqual(list(parallel.five_tuple_counts.items()), list(serial.five_tuple_counts.items()))
+        self.assertEqual(serial.tag_counts['sv_P1'], 200)
+        self.assertEqual(parallel.volume_counts.tag_sums, serial.volume_counts.tag_sums)
+        self.assertEqual(parallel.volume_counts.for_port_protocol(25, 'tcp'), serial.volume_counts.for_port_protocol(25, 'tcp'))
+
+    def test_volume_metrics(self):
+        """
+        Test that packets, bytes and durations are summed per tag and port-protocol and written by the Writer.
+        """
+        lines = [
+            "2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,25,tcp,10,1000,100,110,ACCEPT,OK",
+            "2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49153,25,tcp,5,-,100,140,ACCEPT,OK",
+            "2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49154,9999,udp,1,300,200,150,ACCEPT,OK",
+            "2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49155,icmp,tcp,7,700,100,200,ACCEPT,OK",
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            flow_log_path = Path(temp_dir) / "flow_log.txt"
+            flow_log_path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+            processor = FlowLogProcessor(LookupTable(self.lookup_table_path), flow_log_path,
+                                         volume_metrics=True)
+            processor.process_log()
+            volume_counts = processor.volume_counts
+            self.assertEqual(volume_counts.for_tag('sv_P1'), (15, 1000, 50))
+            self.assertEqual(volume_counts.for_tag('untagged'), (1, 300, 0))
+            self.assertEqual(volume_counts.for_port_protocol(25, 'tcp'), (15, 1000, 50))
+            self.assertEqual(volume_counts.for_port_protocol(9999, 'udp'), (1, 300, 0))
+            self.assertEqual(pickle.loads(pickle.dumps(volume_counts)).for_port_protocol(25, 'tcp'), (15, 1000, 50))
+            with self.assertRaises(ValueError):
+                volume_counts.merge(VolumeCounter(['untagged', 'sv_P2', 'sv_P1']))
+
+            previous_dir = os.getcwd()
+            os.chdir(temp_dir)
+            try:
+                writer = Writer(processor.get_tag_counts_dict(), processor.get_port_protocol_counts_dict(),
+                                processor.get_five_tuple_counts_dict(), volume_counts)
+                writer.output_tag_counts(False, None)
+                writer.output_port_protocol_counts(False, None)
+                tag_lines = Path("tag_counts.txt").read_text(encoding='utf-8').splitlines()
+                pp_lines = Path("pp_counts.txt").read_text(encoding='utf-8').splitlines()
+            finally:
+                os.chdir(previous_dir)
+        self.assertEqual(tag_lines, ["tag,count,packets,bytes,bytes_per_second", "sv_P1,2,15,1000,20.00", "untagged,1,1,300,0.00"])
+        self.assertEqual(pp_lines[0], "port,protocol,count,packets,bytes,bytes_per_second")
+        self.assertIn("25,tcp,2,15,1000,20.00", pp_lines)
+
+    def test_fast_parse_line(self):
+        """
+        Test that the fast path of parse_line accepts and rejects lines exactly like validate_line.
+        """
+        lines = [
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,25,tcp,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,25,tcp,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,025,TCP,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2, 49152,25 ,udp,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,65536,tcp,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,-1,25,tcp,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,https,tcp,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,25,icmp,10,1000,100,110,ACCEPT,OK\n",
+            b"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,25,tcp,10,1000,100,110,ACCEPT,OK,extra\n",
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fast = FlowLogProcessor(None, temp_dir, ErrorSink(Path(temp_dir) / "fast.txt"))
+            slow = FlowLogProcessor(None, temp_dir, ErrorSink(Path(temp_dir) / "slow.txt"))
+            for line in lines:
+                self.assertEqual(fast.parse_line(line), slow.validate_line(line))
+            fast.error_sink.close()
+            slow.error_sink.close()
+            self.assertEqual((Path(temp_dir) / "fast.txt").read_text(encoding='utf-8'),
+                             (Path(temp_dir) / "slow.txt").read_text(encoding='utf-8'))
+        self.assertEqual(fast.parse_line(lines[2]), ('10.0.0.1', '10.0.0.2', 49152, 25, 'tcp'))
+        self.assertEqual(sum(fast.get_error_summary().values()), 5)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
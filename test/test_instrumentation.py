@@ -0,0 +1,108 @@
+import unittest
+import io
+import json
+import tempfile
+from pathlib import Path
+from vpc_log_parser import ErrorSink, FlowLogProcessor, LookupTable
+from instrumentation import Instrumentation
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Test class for the Instrumentation class.
+    """
+
+    def setUp(self):
+        with open('config.json', 'r') as config_file:
+            config = json.load(config_file)
+        self.lookup_table_path = Path(config['lookup_table_path'])
+        self.flow_log_path = Path(config['flow_log_path'])
+
+    def test_sampled_run_matches_plain_run(self):
+        """
+        Test that sampling lines does not change the counts or their order, and that the report accounts for every line.
+        """
+        lookup_table = LookupTable(self.lookup_table_path)
+        plain = FlowLogProcessor(lookup_table, self.flow_log_path, ErrorSink(None))
+        plain.process_log()
+        instrumentation = Instrumentation(sample_every=3)
+        instrumented = FlowLogProcessor(lookup_table, self.flow_log_path, ErrorSink(None), instrumentation=instrumentation)
+        with instrumentation.stage("process_log"):
+            instrumented.process_log()
+
+        self.assertEqual(list(instrumented.tag_counts.items()), list(plain.tag_counts.items()))
+        self.assertEqual(list(instrumented.port_protocol_counts.items()), list(plain.port_protocol_counts.items()))
+        self.assertEqual(list(instrumented.five_tuple_counts.items()), list(plain.five_tuple_counts.items()))
+
+        report = instrumentation.report(instrumented, lookup_table)
+        lines = report["lines"]["accepted"] + report["lines"]["rejected"]
+        self.assertEqual(report["sampled_lines"]["lines_seen"], lines)
+        self.assertEqual(report["sampled_lines"]["samples"], lines // 3)
+        self.assertEqual(report["lines"]["rejected_by_reason"], plain.get_error_summary())
+        self.assertEqual(report["stages"]["process_log"]["calls"], 1)
+        self.assertEqual(set(report["sampled_lines"]["estimated_seconds"]), {"read", "parse", "lookup", "aggregate"})
+        self.assertEqual(report["aggregate_sizes"]["tag_counts"], len(plain.tag_counts))
+        self.assertIn("build_time_seconds", report["lookup_table"])
+
+    def test_sampled_aggregates_match_with_volume_metrics(self):
+        """
+        Test that every aggregate, the volume sums included, is identical with instrumentation on and off.
+        """
+        lookup_table = LookupTable(self.lookup_table_path)
+        plain = FlowLogProcessor(lookup_table, self.flow_log_path, ErrorSink(None), volume_metrics=True)
+        plain.process_log()
+        instrumented = FlowLogProcessor(lookup_table, self.flow_log_path, ErrorSink(None), volume_metrics=True,
+                                        instrumentation=Instrumentation(sample_every=2))
+        instrumented.process_log()
+
+        self.assertEqual(list(instrumented.tag_counts.items()), list(plain.tag_counts.items()))
+        self.assertEqual(list(instrumented.port_protocol_counts.items()), list(plain.port_protocol_counts.items()))
+        self.assertEqual(instrumented.five_tuple_counts, plain.five_tuple_counts)
+        self.assertEqual(instrumented.volume_counts.tag_sums, plain.volume_counts.tag_sums)
+        self.assertEqual(list(instrumented.volume_counts._nonzero_ports()), list(plain.volume_counts._nonzero_ports()))
+
+    def test_report_counts_only_lines_of_this_run(self):
+        """
+        Test that the lines restored from a checkpoint are not reported as lines of the run.
+        """
+        lines = self.flow_log_path.read_text(encoding='utf-8').splitlines()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            flow_log_path = Path(temp_dir) / "flow_log.txt"
+            checkpoint_path = Path(temp_dir) / "checkpoint.bin"
+            flow_log_path.write_text("\n".join(lines[:10]) + "\n", encoding='utf-8')
+            FlowLogProcessor(LookupTable(self.lookup_table_path), flow_log_path,
+                             ErrorSink(None)).process_log_incremental(checkpoint_path)
+            with open(flow_log_path, 'a', encoding='utf-8') as flow_file:
+                flow_file.write("\n".join(lines[10:]) + "\n")
+            instrumentation = Instrumentation(sample_every=1)
+            processor = FlowLogProcessor(LookupTable(self.lookup_table_path), flow_log_path, ErrorSink(None),
+                                         instrumentation=instrumentation)
+            processor.process_log_incremental(checkpoint_path)
+
+        report = instrumentation.report(processor)
+        self.assertEqual(report["lines"]["accepted"] + report["lines"]["rejected"], len(lines) - 10)
+        self.assertEqual(report["sampled_lines"]["lines_seen"], len(lines) - 10)
+
+    def test_report_and_progress(self):
+        """
+        Test that timed methods are reported as stages, progress lines are printed and the report is written as JSON.
+        """
+        progress = io.StringIO()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            instrumentation = Instrumentation(sample_every=1, progress_seconds=0, progress_stream=progress,
+                                              report_path=Path(temp_dir) / "report.json")
+            error_sink = ErrorSink(Path(temp_dir) / "error_log.txt")
+            instrumentation.time_method(error_sink, "flush", "error_log_write")
+            processor = FlowLogProcessor(LookupTable(self.lookup_table_path), self.flow_log_path, error_sink,
+                                         instrumentation=instrumentation)
+            processor.process_log()
+            instrumentation.write_report(processor)
+            report = json.loads((Path(temp_dir) / "report.json").read_text(encoding='utf-8'))
+
+        self.assertGreaterEqual(report["stages"]["error_log_write"]["calls"], 1)
+        self.assertEqual(report["sampled_lines"]["samples"], report["lines"]["accepted"] + report["lines"]["rejected"])
+        self.assertIn("lines/s", progress.getvalue())
+        self.assertIsNone(Instrumentation.from_config(False))
+        self.assertEqual(Instrumentation.from_config({"sample_every": 10}).sample_every, 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import unittest
 import json
+import pickle
+import tempfile
 from pathlib import Path
 from vpc_log_parser import LookupTable
 
@@ -27,5 +29,60 @@ class TestLookupTable(unittest.TestCase):
         tag = lookup_table.get_tag(25, "tcp")
         self.assertEqual(tag, "sv_P1")
 
+    def test_rules(self):
+        """
+        Test port range, wildcard and CIDR rules, and that exact entries and earlier rules take precedence.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rules_path = Path(temp_dir) / "rules.csv"
+            with open(rules_path, 'w', encoding='utf-8') as rules_file:
+                rules_file.write("dstport,protocol,tag,dst_cidr\n"
+                                 "443,tcp,web\n"
+                                 "443,tcp,internal_web,10.0.0.0/8\n"
+                                 "8000-8100,tcp,dev\n"
+                                 "53,*,dns\n"
+                                 "*,udp,internal_udp,10.1.0.0/16\n"
+                                 "*,*,v6,2001:db8::/32\n")
+            lookup_table = LookupTable(rules_path)
+        self.assertEqual(lookup_table.get_stats()["exact_entries"], 1)
+
+        self.assertEqual(lookup_table.get_tag(443, "tcp", "10.0.0.1"), "web")
+        self.assertEqual(lookup_table.get_tag(8050, "tcp"), "dev")
+        self.assertEqual(lookup_table.get_tag(8101, "tcp"), "untagged")
+        self.assertEqual(lookup_table.get_tag(53, "udp", "10.1.2.3"), "dns")
+        self.assertEqual(lookup_table.get_tag(5000, "udp", "10.1.2.3"), "internal_udp")
+        self.assertEqual(lookup_table.get_tag(5000, "udp", "10.2.2.3"), "untagged")
+        self.assertEqual(lookup_table.get_tag(22, "tcp", "2001:db8::1"), "v6")
+        self.assertEqual(lookup_table.get_tag(5000, "udp", "10.1.2.3"), "internal_udp")
+
+        self.assertEqual(lookup_table.get_tag(8101, "tcp"), "untagged")
+
+        stats = lookup_table.get_stats()
+        self.assertEqual(stats["rules"], 5)
+        self.assertEqual(stats["exact_entries"], 1)
+        self.assertEqual(stats["cache_hits"], 1)
+        self.assertEqual(stats["negative_cache_hits"], 1)
+        self.assertGreaterEqual(stats["build_time_seconds"], 0)
+
+        frozen = pickle.loads(pickle.dumps(lookup_table.freeze()))
+        self.assertEqual(frozen.get_tag(443, "tcp", "10.0.0.1"), "web")
+        self.assertEqual(frozen.get_tag(5000, "udp", "10.1.2.3"), "internal_udp")
+        self.assertEqual(frozen.get_tag(8101, "tcp"), "untagged")
+
+    def test_frozen_lookup_table(self):
+        """
+        Test that a frozen lookup table cannot be modified and does not grow on misses.
+        """
+        frozen = LookupTable(self.lookup_table_path).freeze()
+        self.assertIs(frozen.freeze(), frozen)
+        self.assertEqual(frozen.get_tag(60000, "tcp"), "untagged")
+        self.assertNotIn((60000, "tcp"), frozen.lookup_table)
+        with self.assertRaises(TypeError):
+            frozen.lookup_table[(60000, "tcp")] = "sv_P1"
+        with self.assertRaises(TypeError):
+            frozen.tag_ids["tcp"][60000] = 1
+        with self.assertRaises(AttributeError):
+            frozen.lookup_table = {}
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,95 @@
+import unittest
+import tempfile
+import json
+from pathlib import Path
+from vpc_log_parser import LookupTable, FlowLogProcessor, ErrorSink
+from numpy_engine import NumpyFlowLogProcessor, np
+from sketches import HeavyHitterSketch
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestNumpyFlowLogProcessor(unittest.TestCase):
+    """
+    Test class for the NumpyFlowLogProcessor class.
+    """
+
+    def setUp(self):
+        with open('config.json', 'r') as config_file:
+            config = json.load(config_file)
+        self.lookup_table_path = Path(config['lookup_table_path'])
+        self.flow_log_path = Path(config['flow_log_path'])
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def process(self, processor_class, flow_log_path, lookup_table_path=None, **kwargs):
+        error_log_path = Path(self.temp_dir.name) / f"{processor_class.__name__}_errors.txt"
+        lookup_table = LookupTable(lookup_table_path or self.lookup_table_path)
+        processor = processor_class(lookup_table, flow_log_path, ErrorSink(error_log_path), **kwargs)
+        processor.process_log()
+        with open(error_log_path, 'r', encoding='utf-8') as error_file:
+            errors = error_file.read()
+        return processor, errors
+
+    def test_matches_python_engine(self):
+        """
+        Test that the numpy engine produces the same counts, ordering and error log as the pure-Python engine.
+        """
+        with open(self.flow_log_path, 'r', encoding='utf-8') as flow_file:
+            lines = flow_file.read().splitlines()
+        lines += [
+            "2,1,eni-1,10.0.0.1,10.0.0.2, 25,443,TCP,1,1,1,2,ACCEPT,OK",  # accepted, but only by int()
+            "2,1,eni-1,10.0.0.1,10.0.0.2,25,443,Udp,1,1,1,2,ACCEPT,OK",
+            "",
+            "2,1,eni-1,10.0.0.1,10.0.0.2,25,abc,tcp,1,1,1,2,ACCEPT,OK",
+            "2,1,eni-1,10.0.0.1,10.0.0.2,999999,443,tcp,1,1,1,2,ACCEPT,OK",
+            "2,1,eni-1,2001:db8::1,2001:db8::2,25,0443,tcp,1,1,1,2,ACCEPT,OK",
+        ]
+        flow_log_path = Path(self.temp_dir.name) / "flow_log.txt"
+        with open(flow_log_path, 'w', encoding='utf-8') as flow_file:
+            flow_file.write("\n".join(lines * 50))  # no trailing newline
+
+        python_processor, python_errors = self.process(FlowLogProcessor, flow_log_path)
+        numpy_processor, numpy_errors = self.process(NumpyFlowLogProcessor, flow_log_path, chunk_size=4096)
+
+        self.assertEqual(list(numpy_processor.tag_counts.items()), list(python_processor.tag_counts.items()))
+        self.assertEqual(list(numpy_processor.port_protocol_counts.items()), list(python_processor.port_protocol_counts.items()))
+        self.assertEqual(list(numpy_processor.five_tuple_counts.items()), list(python_processor.five_tuple_counts.items()))
+        self.assertEqual(numpy_errors, python_errors)
+        self.assertEqual(numpy_processor.get_error_summary(), python_processor.get_error_summary())
+
+    def test_sketch_matches_python_engine(self):
+        """
+        Test that approximate five tuple counts are the same as in the pure-Python engine, whose sketch sees every line in order.
+        """
+        with open(self.flow_log_path, 'r', encoding='utf-8') as flow_file:
+            lines = flow_file.read().splitlines()
+        flow_log_path = Path(self.temp_dir.name) / "flow_log.txt"
+        with open(flow_log_path, 'w', encoding='utf-8') as flow_file:
+            flow_file.write("\n".join(lines * 50) + "\n")
+
+        # few candidates and a narrow table, so the candidates replaced depend on the order of the additions
+        python_processor, _ = self.process(FlowLogProcessor, flow_log_path,
+                                           five_tuple_sketch=HeavyHitterSketch(4096, top_k=3, depth=2))
+        numpy_processor, _ = self.process(NumpyFlowLogProcessor, flow_log_path, chunk_size=4096,
+                                          five_tuple_sketch=HeavyHitterSketch(4096, top_k=3, depth=2))
+
+        self.assertEqual(list(numpy_processor.five_tuple_counts.items()), list(python_processor.five_tuple_counts.items()))
+        self.assertEqual(numpy_processor.five_tuple_counts.count_min.table, python_processor.five_tuple_counts.count_min.table)
+
+    def test_rules_match_python_engine(self):
+        """
+        Test that lines left untagged by exact entries are tagged by the same rules as in the pure-Python engine.
+        """
+        rules_path = Path(self.temp_dir.name) / "rules.csv"
+        with open(rules_path, 'w', encoding='utf-8') as rules_file:
+            rules_file.write("dstport,protocol,tag,dst_cidr\n25,tcp,sv_P1\n0-100,tcp,low_tcp\n*,udp,private_udp,172.16.0.0/12\n")
+
+        python_processor, _ = self.process(FlowLogProcessor, self.flow_log_path, rules_path)
+        numpy_processor, _ = self.process(NumpyFlowLogProcessor, self.flow_log_path, rules_path)
+
+        self.assertEqual(list(numpy_processor.tag_counts.items()), list(python_processor.tag_counts.items()))
+        self.assertEqual(numpy_processor.tag_counts['private_udp'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
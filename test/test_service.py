@@ -0,0 +1,94 @@
+import asyncio
+import json
+import tracemalloc
+import unittest
+from vpc_log_parser import ErrorSink, LookupTable, SparsePortProtocolCounter
+from service import FlowLogService, WindowedAggregates
+
+def flow_line(start, dst_port, protocol="tcp"):
+    return f"2,123456789012,eni-0a1b2c3d,10.0.0.1,10.0.0.2,49152,{dst_port},{protocol},10,840,{start},{start + 60},ACCEPT,OK\n".encode('utf-8')
+
+class TestService(unittest.TestCase):
+    """
+    Test class for the WindowedAggregates and FlowLogService classes.
+    """
+
+    def setUp(self):
+        with open('config.json', 'r') as config_file:
+            config = json.load(config_file)
+        self.lookup_table = LookupTable(config['lookup_table_path'])
+
+    def test_windows(self):
+        """
+        Test tumbling and sliding windows, rejected lines and the eviction of old buckets.
+        """
+        aggregates = WindowedAggregates(self.lookup_table, ErrorSink(None, mode="counts"), bucket_seconds=60, retention_seconds=120)
+        aggregates.add_lines([flow_line(1000, 25), flow_line(1010, 25), flow_line(1070, 68, "udp"),
+                              flow_line(1130, 9999), b"2,bad\n", flow_line(1130, 25).replace(b",1130,", b",soon,")])
+
+        tumbling = aggregates.query("tumbling", at=1010)
+        self.assertEqual((tumbling["start"], tumbling["end"]), (960, 1020))
+        self.assertEqual(tumbling["tag_counts"], {"sv_P1": 2})
+        sliding = aggregates.query("sliding", seconds=180)
+        self.assertEqual(sliding["tag_counts"], {"sv_P1": 2, "sv_P2": 1, "untagged": 1})
+        self.assertEqual(sliding["port_protocol_counts"], [[25, "tcp", 2], [68, "udp", 1], [9999, "tcp", 1]])
+        self.assertEqual(aggregates.get_stats()["rejections"], {"Incorrect size of data": 1, "Invalid start time": 1})
+
+        aggregates.add_lines([flow_line(1200, 25), flow_line(1000, 25)])
+        self.assertEqual(aggregates.query("tumbling", at=1010)["tag_counts"], {})
+        self.assertEqual(aggregates.get_stats()["late_lines"], 1)
+
+    def test_sparse_buckets(self):
+        """
+        Test that many buckets with a single line each stay small instead of holding dense port arrays.
+        """
+        aggregates = WindowedAggregates(self.lookup_table, ErrorSink(None, mode="counts"), bucket_seconds=60,
+                                        retention_seconds=None, count_five_tuples=True)
+        aggregates.add_lines([flow_line(0, 25)])
+        tracemalloc.start()
+        try:
+            aggregates.add_lines([flow_line(bucket * 60, 25) for bucket in range(1, 1000)])
+            allocated, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(len(aggregates.buckets), 1000)
+        self.assertIsInstance(aggregates.buckets[60].port_protocol_counts, SparsePortProtocolCounter)
+        self.assertLess(allocated, 4 * 1024 * 1024)  # dense buckets would hold 1 MiB each
+        self.assertEqual(aggregates.query("sliding", seconds=60000)["port_protocol_counts"], [[25, "tcp", 1000]])
+        self.assertEqual(aggregates.buckets[60].get_five_tuple_counts_dict(),
+                         {("10.0.0.1", "10.0.0.2", 49152, 25, "tcp"): 1})
+
+    def test_socket_ingest_and_query(self):
+        """
+        Test that lines written to the ingest socket are aggregated and can be queried.
+        """
+        async def run():
+            aggregates = WindowedAggregates(self.lookup_table, ErrorSink(None, mode="counts"))
+            service = FlowLogService(aggregates, ingest_host="127.0.0.1", ingest_port=0, query_port=0, queue_batches=2, batch_lines=10)
+            tasks = await service.start()
+            ingest_port = service.servers[0].sockets[0].getsockname()[1]
+            query_port = service.servers[1].sockets[0].getsockname()[1]
+            _, writer = await asyncio.open_connection("127.0.0.1", ingest_port)
+            writer.write(b"".join(flow_line(1000 + index, 25) for index in range(100)))
+            await writer.drain()
+            writer.close()
+            while aggregates.get_stats()["lines"] < 100:
+                await asyncio.sleep(0.01)
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", query_port)
+            writer.write(b"GET /counts?window=sliding&seconds=180 HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            for task in tasks:
+                task.cancel()
+            for server in service.servers:
+                server.close()
+            return response
+
+        status, _, body = asyncio.run(run()).partition(b"\r\n\r\n")
+        self.assertTrue(status.startswith(b"HTTP/1.0 200"))
+        self.assertEqual(json.loads(body)["tag_counts"], {"sv_P1": 100})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from five_tuple_keys import pack_five_tuple
+from sketches import CountMinSketch, HeavyHitterSketch, stable_hash
+
+class TestHeavyHitterSketch(unittest.TestCase):
+    """
+    Test class for the CountMinSketch and HeavyHitterSketch classes.
+    """
+
+    def setUp(self):
+        # A skewed stream: two heavy flows hidden among many flows that occur once
+        self.stream = []
+        for source_port in range(5000):
+            self.stream.append(("10.0.0.1", "10.0.0.2", source_port, 443, "tcp"))
+            if source_port % 10 == 0:
+                self.stream.append(("10.0.0.9", "10.0.0.2", 5555, 443, "tcp"))
+            if source_port % 25 == 0:
+                self.stream.append(("10.0.0.8", "10.0.0.3", 6666, 53, "udp"))
+
+    def test_count_min_overestimates_within_bound(self):
+        """
+        Test that Count-Min estimates never undercount and stay within the error bound for a heavy key.
+        """
+        sketch = CountMinSketch(width=512, depth=4)
+        for key in self.stream:
+            sketch.add(stable_hash(key))
+        estimate = sketch.estimate(stable_hash(("10.0.0.9", "10.0.0.2", 5555, 443, "tcp")))
+        self.assertGreaterEqual(estimate, 500)
+        self.assertLessEqual(estimate, 500 + sketch.error_bound())
+
+    def test_top_k_under_memory_budget(self):
+        """
+        Test that the heavy hitters are found while the candidate set stays bounded.
+        """
+        sketch = HeavyHitterSketch(memory_budget=64 * 1024, top_k=10)
+        for key in self.stream:
+            sketch.add(key)
+        top_keys = [key for key, count in sketch.items()[:2]]
+
+        self.assertEqual(len(sketch), 10)
+        self.assertEqual(top_keys, [("10.0.0.9", "10.0.0.2", 5555, 443, "tcp"),
+                                    ("10.0.0.8", "10.0.0.3", 6666, 53, "udp")])
+
+    def test_merge(self):
+        """
+        Test that merging two partial sketches finds the same heavy hitters as one sketch over the whole stream.
+        """
+        first = HeavyHitterSketch(memory_budget=64 * 1024, top_k=10)
+        second = first.empty_copy()
+        middle = len(self.stream) // 2
+        for key in self.stream[:middle]:
+            first.add(key)
+        for key in self.stream[middle:]:
+            second.add(key)
+        first.merge(second)
+
+        self.assertEqual(first.count_min.total, len(self.stream))
+        self.assertEqual(first.items()[0][0], ("10.0.0.9", "10.0.0.2", 5555, 443, "tcp"))
+        self.assertGreaterEqual(first.items()[0][1], 500)
+
+    def test_packed_keys(self):
+        """
+        Test that heavy hitters are found among packed integer keys, which are hashed without a digest.
+        """
+        sketch = HeavyHitterSketch(memory_budget=64 * 1024, top_k=10)
+        for key in self.stream:
+            sketch.add(pack_five_tuple(*key))
+        heavy_key = pack_five_tuple("10.0.0.9", "10.0.0.2", 5555, 443, "tcp")
+
+        self.assertEqual(sketch.items()[0][0], heavy_key)
+        self.assertLessEqual(sketch.items()[0][1], 500 + sketch.error_bound())
+        self.assertEqual(stable_hash(heavy_key), stable_hash(pack_five_tuple("10.0.0.9", "10.0.0.2", 5555, 443, "tcp")))
+        self.assertLess(stable_hash(1 << 200), 1 << 64)
+
+    def test_budget_too_small_for_top_k(self):
+        """
+        Test that a memory budget that leaves no room for the Count-Min sketch is rejected instead of clamped.
+        """
+        with self.assertRaises(ValueError):
+            HeavyHitterSketch(memory_budget=1024, top_k=1000)
+        self.assertEqual(HeavyHitterSketch(memory_budget=1000 * HeavyHitterSketch.CANDIDATE_BYTES + 32,
+                                           top_k=1000).count_min.width, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import gzip
+import os
+import tempfile
+from vpc_log_parser import Writer
+
+class TestWriterOptions(unittest.TestCase):
+    """
+    Test class for the sorting, chunking and compression options of the Writer class.
+    """
+
+    def write_five_tuples(self, five_tuple_counts, **options):
+        """
+        Write five tuple counts with the given Writer options in a temporary directory and return the file name and lines.
+        """
+        previous_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                Writer({}, {}, five_tuple_counts, **options).output_five_tuple_counts()
+                file_name = os.listdir(temp_dir)[0]
+                opener = gzip.open if file_name.endswith(".gz") else open
+                with opener(file_name, "rt", encoding='utf-8') as ftc_file:
+                    return file_name, ftc_file.read().splitlines()
+            finally:
+                os.chdir(previous_dir)
+
+    def test_sorted_output(self):
+        """
+        Test that rows are sorted by count (ties in first-seen order) or key, the same in memory and with an external merge sort.
+        """
+        five_tuple_counts = {(f"10.0.0.{index % 7}", "10.0.1.1", 49152 + index, 443, "tcp"): index % 5 + 1
+                             for index in range(50)}
+        _, unsorted = self.write_five_tuples(five_tuple_counts)
+        _, by_count = self.write_five_tuples(five_tuple_counts, sort_by="count")
+        _, by_count_external = self.write_five_tuples(five_tuple_counts, sort_by="count", sort_memory_lines=7,
+                                                      chunk_lines=3)
+        _, by_key_external = self.write_five_tuples(five_tuple_counts, sort_by="key", sort_memory_lines=7)
+
+        expected_keys = sorted(five_tuple_counts)
+        self.assertEqual(by_count, by_count_external)
+        self.assertEqual(sorted(by_count[1:]), sorted(unsorted[1:]))
+        self.assertEqual(by_count[1:], ["({},{},{},{},{}),{}".format(*key, count) for key, count
+                                        in sorted(five_tuple_counts.items(), key=lambda item: item[1], reverse=True)])
+        self.assertEqual(by_key_external[1:], ["({},{},{},{},{}),{}".format(*key, five_tuple_counts[key])
+                                               for key in expected_keys])
+        with self.assertRaises(ValueError):
+            Writer({}, {}, {}, sort_by="size")
+
+    def test_compressed_output(self):
+        """
+        Test that compressed outputs get the compression's suffix and hold the same rows.
+        """
+        five_tuple_counts = {("10.0.0.1", "10.0.1.1", 49152, 443, "tcp"): 2, ("10.0.0.2", "10.0.1.1", 49153, 25, "udp"): 1}
+        plain_name, plain = self.write_five_tuples(five_tuple_counts)
+        gzip_name, compressed = self.write_five_tuples(five_tuple_counts, compression="gzip")
+        self.assertEqual(plain_name, "five_tuple_counts.txt")
+        self.assertEqual(gzip_name, "five_tuple_counts.txt.gz")
+        self.assertEqual(compressed, plain)
+        self.assertEqual(plain[1:], ["(10.0.0.1,10.0.1.1,49152,443,tcp),2", "(10.0.0.2,10.0.1.1,49153,25,udp),1"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,954 @@
+import bz2
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import ipaddress
+import mmap
+import os
+import pickle
+import tempfile
+import time
+from types import MappingProxyType
+from array import array
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from checkpoint import Checkpoint
+from five_tuple_keys import decode_five_tuple, pack_five_tuple
+from flow_log_schema import AGGREGATED_FIELDS, DEFAULT_SCHEMA, VOLUME_FIELDS, FlowLogSchema
+from rule_matcher import Rule, RuleMatcher, WILDCARD, parse_port_range
+from sketches import HeavyHitterSketch
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional; gzip and bz2 only need the standard library
+    zstandard = None
+
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+READ_BUFFER_SIZE = 1024 * 1024
+PORT_NUMBERS = {}  # canonical port fields seen in accepted lines, bytes -> int, filled by the validate_line of FlowLogProcessor.compile_schema
+OUTPUT_SUFFIXES = {None: "", "gzip": ".gz", "bz2": ".bz2", "zstd": ".zst"}  # Writer compression -> file suffix
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+SORT_RUN_BLOCK_ITEMS = 10000  # items pickled at a time into the runs of an external sort
+NONZERO_SCAN_BLOCK = 1024  # bytes of an array compared with zero at a time by nonzero_indices
+
+
+def resolve_flow_log_files(flow_log_path):
+    """
+    Resolve a flow log path into the list of files it refers to.
+
+    Args:
+        flow_log_path (str or Path): A single file, a directory or a glob pattern.
+
+    Returns:
+        list: The matching file paths in sorted order. A directory expands to the files
+        it contains and a glob pattern to the files it matches.
+
+    Time Complexity:
+        O(f log f), where f is the number of matching files.
+
+    Space Complexity:
+        O(f) - The list of matching file paths.
+    """
+    flow_log_path = str(flow_log_path)
+    if os.path.isdir(flow_log_path):
+        return sorted(os.path.join(flow_log_path, name) for name in os.listdir(flow_log_path)
+                      if os.path.isfile(os.path.join(flow_log_path, name)))
+    if glob.has_magic(flow_log_path):
+        return sorted(path for path in glob.glob(flow_log_path) if os.path.isfile(path))
+    return [flow_log_path]
+
+
+def detect_compression(flow_file):
+    """
+    Detect the compression format of a flow log from its magic bytes.
+
+    Args:
+        flow_file (file): A binary file positioned at its start. The position is restored.
+
+    Returns:
+        str: "gzip", "bz2" or "zstd", or None for an uncompressed flow log.
+
+    Time Complexity:
+        O(1) - Only the first four bytes are read.
+
+    Space Complexity:
+        O(1) - No additional space is used.
+    """
+    magic = flow_file.read(4)
+    flow_file.seek(0)
+    for prefix, compression in COMPRESSION_MAGIC.items():
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+
+class _ClosingReader(io.BufferedReader):
+    """
+    A buffered reader over a decompressing stream that also closes the file the stream reads
+    from, which GzipFile and BZ2File leave open when they are given a file object.
+    """
+    def __init__(self, raw, source_file, buffer_size=READ_BUFFER_SIZE):
+        super().__init__(raw, buffer_size)
+        self._source_file = source_file
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source_file.close()
+
+
+def open_flow_log(flow_log_path, buffer_size=READ_BUFFER_SIZE):
+    """
+    Open a flow log as a binary stream, decompressing gzip, bz2 and zstd files on the fly.
+
+    Args:
+        flow_log_path (str): The path to the flow log file.
+        buffer_size (int): The size of the read buffer in bytes.
+
+    Returns:
+        file: A buffered binary stream of the uncompressed flow log.
+
+    Time Complexity:
+        O(1) - Decompression happens lazily as the stream is read.
+
+    Space Complexity:
+        O(b), where b is the buffer size.
+    """
+    flow_file = open(flow_log_path, "rb", buffering=buffer_size)
+    compression = detect_compression(flow_file)
+    if compression == "gzip":
+        return _ClosingReader(gzip.GzipFile(fileobj=flow_file), flow_file, buffer_size)
+    if compression == "bz2":
+        return _ClosingReader(bz2.BZ2File(flow_file), flow_file, buffer_size)
+    if compression == "zstd":
+        if zstandard is None:
+            flow_file.close()
+            raise ImportError(f"Reading {flow_log_path} requires the zstandard package to be installed")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(flow_file, closefd=True), buffer_size)
+    return flow_file
+
+
+def is_compressed(flow_log_path):
+    """
+    Check whether a flow log file is compressed.
+    """
+    with open(flow_log_path, "rb") as flow_file:
+        return detect_compression(flow_file) is not None
+
+
+def detect_flow_log_schema(flow_log_path, schema=DEFAULT_SCHEMA):
+    """
+    Get the schema of a flow log file from its header line.
+
+    Args:
+        flow_log_path (str): The path to the flow log file.
+        schema (FlowLogSchema): The schema of a file without a header line.
+
+    Returns:
+        FlowLogSchema: The schema described by the first line of the file if it is a header
+        line, or schema otherwise.
+
+    Time Complexity:
+        O(l), where l is the length of the first line.
+
+    Space Complexity:
+        O(l) - Only the first line is read.
+    """
+    with open_flow_log(flow_log_path) as flow_file:
+        header_schema = FlowLogSchema.from_header(flow_file.readline())
+    return header_schema if header_schema is not None else schema
+
+
+def iter_flow_log_lines(flow_log_path, start=0, end=None):
+    """
+    Yield the lines of a flow log as bytes.
+
+    Compressed files are streamed through open_flow_log. Uncompressed files are memory-mapped,
+    so lines are sliced straight out of the page cache without going through a file buffer
+    or being decoded into str objects; only the fields that are aggregated are decoded later.
+
+    Args:
+        flow_log_path (str): The path to the flow log file.
+        start (int): The byte offset of the first line to read. Only for uncompressed files.
+        end (int): The byte offset at which to stop, or None to read to the end of the file.
+            A line that starts before end is read completely.
+
+    Yields:
+        bytes: The lines, including their trailing newline.
+
+    Time Complexity:
+        O(n), where n is the size of the file.
+
+    Space Complexity:
+        O(b) for compressed files, where b is the read buffer size. Uncompressed files are
+        mapped into memory by the operating system rather than read into Python objects.
+    """
+    if is_compressed(flow_log_path):
+        if start or end is not None:
+            raise ValueError(f"Cannot read a byte range of the compressed flow log {flow_log_path}")
+        with open_flow_log(flow_log_path) as flow_file:
+            yield from flow_file
+        return
+
+    with open(flow_log_path, "rb") as flow_file:
+        file_size = os.fstat(flow_file.fileno()).st_size
+        if file_size == 0:  # an empty file cannot be memory-mapped
+            return
+        end = file_size if end is None else min(end, file_size)
+        with mmap.mmap(flow_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            mapped_file.seek(start)
+            readline = mapped_file.readline
+            position = start
+            while position < end:
+                line = readline()
+                position += len(line)
+                yield line
+
+
+def complete_lines_end(flow_log_path, start, file_size):
+    """
+    Find the end of the last complete line of an uncompressed flow log.
+
+    Args:
+        flow_log_path (str): The path to the flow log file.
+        start (int): The byte offset from which to look for complete lines.
+        file_size (int): The size of the file.
+
+    Returns:
+        int: The offset just after the last newline at or after start, or start if there
+        is no complete line. A partially written last line is left for a later run.
+
+    Time Complexity:
+        O(l), where l is the length of the partial last line.
+
+    Space Complexity:
+        O(1) - The file is memory-mapped, not read.
+    """
+    if file_size <= start:
+        return start
+    with open(flow_log_path, "rb") as flow_file:
+        with mmap.mmap(flow_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            return mapped_file.rfind(b"\n", start, file_size) + 1 or start
+
+
+def compute_shards(flow_log_path, workers, shard_size=None):
+    """
+    Split a flow log file into newline-aligned byte ranges.
+
+    Args:
+        flow_log_path (str): The path to the flow log file.
+        workers (int): The number of workers the shards will be distributed across.
+        shard_size (int): The approximate size of a shard in bytes. Defaults to four
+            shards per worker so that uneven shards still balance across the pool.
+
+    Returns:
+        list: (path, start, end) tuples covering the whole file. Every range starts at the
+        beginning of a line and ends just after a newline or at the end of the file.
+        A compressed file cannot be split and is a single (path, 0, None) shard.
+
+    Time Complexity:
+        O(s * l), where s is the number of shards and l is the length of a line,
+        since only one partial line is read at every boundary.
+
+    Space Complexity:
+        O(s) - The list of shard ranges.
+    """
+    file_size = os.path.getsize(flow_log_path)
+    if file_size == 0:
+        return []
+    if is_compressed(flow_log_path):
+        return [(flow_log_path, 0, None)]
+    if not shard_size:
+        shard_size = -(-file_size // (workers * 4))
+    shards = []
+    with open(flow_log_path, "rb") as flow_file:
+        start = 0
+        while start < file_size:
+            flow_file.seek(min(start + shard_size, file_size))
+            flow_file.readline()  # move the boundary to the start of the next line
+            end = min(flow_file.tell(), file_size)
+            shards.append((flow_log_path, start, end))
+            start = end
+    return shards
+
+
+_WORKER_LOOKUP_TABLE = None
+_WORKER_ERROR_MODE = ("full", 0)
+_WORKER_FIVE_TUPLE_SKETCH = None
+_WORKER_VOLUME_METRICS = False
+
+
+def _init_shard_worker(lookup_table, error_mode="full", max_samples=0, five_tuple_sketch=None, volume_metrics=False):
+    """
+    Store the lookup table once per worker process instead of pickling it with every shard.
+    """
+    global _WORKER_LOOKUP_TABLE, _WORKER_ERROR_MODE, _WORKER_FIVE_TUPLE_SKETCH, _WORKER_VOLUME_METRICS
+    _WORKER_LOOKUP_TABLE = lookup_table
+    _WORKER_ERROR_MODE = (error_mode, max_samples)
+    _WORKER_FIVE_TUPLE_SKETCH = five_tuple_sketch
+    _WORKER_VOLUME_METRICS = volume_metrics
+
+
+def _process_shard(shard, schema=DEFAULT_SCHEMA):
+    """
+    Process one byte range of a flow log file inside a worker process.
+
+    Args:
+        shard (tuple): A (path, start, end) tuple produced by compute_shards.
+        schema (FlowLogSchema): The schema of the file.
+
+    Returns:
+        tuple: The partial tag counts, port-protocol counts, five tuple counts and volume
+        counts (None unless volume metrics are enabled), the list of (line, error_msg)
+        errors kept by the worker's error sink in the order they were encountered, and the
+        per-reason rejection counts.
+    """
+    flow_log_path, start, end = shard
+    processor = _worker_processor(flow_log_path, schema)
+    processor._process_lines(iter_flow_log_lines(flow_log_path, start, end))
+    return _partial_results(processor)
+
+
+def _worker_processor(flow_log_path, schema=DEFAULT_SCHEMA, initargs=None):
+    """
+    Create a processor with empty aggregates from the state stored by _init_shard_worker, or
+    from initargs, the arguments of _init_shard_worker, so that files can be processed
+    outside a worker without touching its state.
+    """
+    if initargs is None:
+        error_mode, max_samples = _WORKER_ERROR_MODE
+        lookup_table, five_tuple_sketch, volume_metrics = (_WORKER_LOOKUP_TABLE, _WORKER_FIVE_TUPLE_SKETCH,
+                                                           _WORKER_VOLUME_METRICS)
+    else:
+        lookup_table, error_mode, max_samples, five_tuple_sketch, volume_metrics = initargs
+    error_sink = ErrorSink(None, mode=error_mode, max_samples=max_samples)
+    if five_tuple_sketch is not None:
+        five_tuple_sketch = five_tuple_sketch.empty_copy()
+    return FlowLogProcessor(lookup_table, flow_log_path, error_sink, five_tuple_sketch,
+                            volume_metrics=volume_metrics, schema=schema)
+
+
+def _partial_results(processor):
+    """
+    Get the partial results of a worker's processor, in the form merge_partial_results takes them.
+    """
+    return (processor.tag_counts, processor.port_protocol_counts, processor.five_tuple_counts,
+            processor.volume_counts, processor.error_sink.pending_errors, processor.error_sink.rejection_counts)
+
+
+def _merge_counts(counts, partial_counts):
+    """
+    Add partial counts into counts, keeping the first-seen ordering of the keys.
+    """
+    for key, count in partial_counts.items():
+        counts[key] = counts.get(key, 0) + count
+
+
+class ErrorSink:
+    """
+    This class collects rejected flow log lines for a whole run.
+
+    The error log is opened once and written in buffered batches instead of being reopened
+    for every rejected line. Three modes bound how much is written:
+        full:    every rejected line is written to the error log.
+        sample:  only the first max_samples lines of every error reason are written.
+        counts:  nothing is written; only the per-reason rejection counts are kept.
+    The error reason is the part of the error message before the colon, for example
+    "Port not within acceptable range".
+    """
+    MODES = ("full", "sample", "counts")
+
+    def __init__(self, error_log_file="error_log.txt", mode="full", max_samples=10, buffer_size=1000):
+        """
+        Initialize the ErrorSink class.
+
+        Args:
+            error_log_file (str): The path to the error log file, which is appended to.
+                If None, the kept errors are held in self.pending_errors instead, which is
+                how worker processes hand their errors back to the parent process.
+            mode (str): One of "full", "sample" or "counts".
+            max_samples (int): The number of lines written per error reason in sample mode.
+            buffer_size (int): The number of errors buffered before they are written.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown error log mode: {mode}")
+        self.error_log_file = error_log_file
+        self.mode = mode
+        self.max_samples = max_samples
+        self.buffer_size = buffer_size
+        self.rejection_counts = {}
+        self.pending_errors = [] if error_log_file is None else None
+        self._written_counts = {}
+        self._buffer = []
+        self._error_file = None
+
+    def record(self, line, error_msg):
+        """
+        Record a rejected line and keep it if the mode allows it.
+
+        Args:
+            line (str): The original log line that caused the error.
+            error_msg (str): The error message describing the issue.
+
+        Time Complexity:
+            O(1) amortized - Lines are only written once the buffer is full.
+
+        Space Complexity:
+            O(b), where b is the buffer size.
+        """
+        reason = error_msg.partition(':')[0]
+        self.rejection_counts[reason] = self.rejection_counts.get(reason, 0) + 1
+        if self.mode != "counts":
+            self._keep(reason, line, error_msg)
+
+    def absorb(self, errors, rejection_counts):
+        """
+        Fold the errors and rejection counts collected by another sink into this one.
+
+        Args:
+            errors (list): (line, error_msg) tuples in the order they were encountered.
+            rejection_counts (dict): The per-reason rejection counts of the other sink.
+
+        Time Complexity:
+            O(e + r), where e is the number of errors and r is the number of reasons.
+
+        Space Complexity:
+            O(b), where b is the buffer size.
+        """
+        if self.mode != "counts":
+            for line, error_msg in errors:
+                self._keep(error_msg.partition(':')[0], line, error_msg)
+        _merge_counts(self.rejection_counts, rejection_counts)
+
+    def _keep(self, reason, line, error_msg):
+        """
+        Buffer an error, respecting the per-reason limit of sample mode.
+        """
+        if self.mode == "sample":
+            written = self._written_counts.get(reason, 0)
+            if written >= self.max_samples:
+                return
+            self._written_counts[reason] = written + 1
+        if self.pending_errors is not None:
+            self.pending_errors.append((line, error_msg))
+            return
+        self._buffer.append(f"Error in line: {line}\nError message: {error_msg}\n")
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered errors to the error log, opening it on first use.
+
+        Time Complexity:
+            O(b), where b is the number of buffered errors.
+
+        Space Complexity:
+            O(1) - The buffer is emptied.
+        """
+        if not self._buffer:
+            return
+        if self._error_file is None:
+            self._error_file = open(self.error_log_file, "a", encoding='utf-8')
+        self._error_file.write("".join(self._buffer))
+        self._buffer.clear()
+
+    def close(self):
+        """
+        Flush the remaining errors and close the error log. The sink can still be used
+        afterwards, in which case the error log is reopened.
+        """
+        self.flush()
+        if self._error_file is not None:
+            self._error_file.close()
+            self._error_file = None
+
+    def get_rejection_summary(self):
+        """
+        Get the number of rejected lines per error reason.
+
+        Returns:
+            dict: A dictionary mapping error reason to the number of rejected lines.
+
+        Time Complexity:
+            O(r), where r is the number of error reasons.
+
+        Space Complexity:
+            O(r) - A copy of the rejection counts is returned.
+        """
+        return dict(self.rejection_counts)
+
+MAX_PORT = 65535
+
+
+class PortProtocolCounter(Mapping):
+    """
+    This class counts port-protocol combinations in one dense 65536-slot array per protocol.
+
+    Incrementing a count is an array index instead of building and hashing a (port, protocol)
+    tuple, and the memory used is fixed at 512 KB per protocol. The class is a read-only
+    mapping from (port, protocol) to count that iterates in first-seen order, like the
+    dictionary it replaces.
+    """
+    def __init__(self, protocols=('tcp', 'udp')):
+        """
+        Initialize the PortProtocolCounter class.
+
+        Args:
+            protocols (iterable): The protocols to allocate counters for up front.
+        """
+        self.counts = {}
+        self.order = []
+        for protocol in protocols:
+            self.counter_for(protocol)
+
+    def counter_for(self, protocol):
+        """
+        Get the array of per-port counts for a protocol, allocating it on first use.
+
+        Args:
+            protocol (str): The protocol.
+
+        Returns:
+            array: The 65536-slot array of counts indexed by port.
+        """
+        port_counts = self.counts.get(protocol)
+        if port_counts is None:
+            port_counts = self.counts[protocol] = array('Q', bytes(8 * (MAX_PORT + 1)))
+        return port_counts
+
+    def add(self, port, protocol, count=1):
+        """
+        Add count occurrences of a port-protocol combination.
+
+        Args:
+            port (int): The destination port.
+            protocol (str): The protocol.
+            count (int): The number of occurrences to add.
+
+        Time Complexity:
+            O(1) - An array update.
+
+        Space Complexity:
+            O(1) - The arrays have a fixed size.
+        """
+        port_counts = self.counter_for(protocol)
+        if not port_counts[port]:
+            self.order.append((port, protocol))
+        port_counts[port] += count
+
+    def merge(self, other):
+        """
+        Add the counts of another counter into this one, keeping the first-seen ordering.
+
+        Args:
+            other (Mapping): A PortProtocolCounter or a dictionary of (port, protocol) counts.
+
+        Time Complexity:
+            O(m), where m is the number of combinations in other.
+
+        Space Complexity:
+            O(1) - The arrays have a fixed size.
+        """
+        for (port, protocol), count in other.items():
+            self.add(port, protocol, count)
+
+    def __getitem__(self, key):
+        port, protocol = key
+        port_counts = self.counts.get(protocol)
+        if port_counts is None or not isinstance(port, int) or not 0 <= port <= MAX_PORT or not port_counts[port]:
+            raise KeyError(key)
+        return port_counts[port]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __reduce__(self):
+        # Only the non-zero counts are pickled, so results sent back by worker processes stay small
+        return (_port_protocol_counter_from_items, (list(self.items()),))
+
+
+def _port_protocol_counter_from_items(items):
+    """
+    Rebuild a PortProtocolCounter from its ((port, protocol), count) items.
+    """
+    counter = PortProtocolCounter()
+    for (port, protocol), count in items:
+        counter.add(port, protocol, count)
+    return counter
+
+
+class _SparsePortCounts(dict):
+    """
+    A dictionary of per-port counts that reads 0 for a port it does not hold, so it can be
+    indexed and incremented like the dense array of a PortProtocolCounter.
+    """
+    __slots__ = ()
+
+    def __missing__(self, port):
+        return 0
+
+
+class SparsePortProtocolCounter(PortProtocolCounter):
+    """
+    This class counts port-protocol combinations in one dictionary per protocol instead of a
+    dense array.
+
+    Its memory grows with the number of combinations seen rather than being fixed at 512 KB
+    per protocol, which suits the many small aggregates of time buckets. It is updated by
+    FlowLogProcessor exactly like a PortProtocolCounter.
+    """
+    def counter_for(self, protocol):
+        """
+        Get the dictionary of per-port counts for a protocol, creating it on first use.
+        """
+        port_counts = self.counts.get(protocol)
+        if port_counts is None:
+            port_counts = self.counts[protocol] = _SparsePortCounts()
+        return port_counts
+
+    def __reduce__(self):
+        return (_sparse_port_protocol_counter_from_items, (list(self.items()),))
+
+
+def _sparse_port_protocol_counter_from_items(items):
+    """
+    Rebuild a SparsePortProtocolCounter from its ((port, protocol), count) items.
+    """
+    counter = SparsePortProtocolCounter()
+    for (port, protocol), count in items:
+        counter.add(port, protocol, count)
+    return counter
+
+
+def nonzero_indices(values):
+    """
+    Get the indices of the non-zero items of an integer array.
+
+    The raw bytes of the array are compared with zeros one block at a time, and only the
+    blocks that are not all zero are scanned item by item, so a sparse 65536-slot array is
+    mostly scanned in C.
+
+    Args:
+        values (array): The array.
+
+    Returns:
+        list: The sorted indices of the non-zero items.
+
+    Time Complexity:
+        O(n / b + z * b), where n is the length of the array, b the number of items per
+        block and z the number of non-zero items.
+
+    Space Complexity:
+        O(n + z) - The raw bytes of the array are copied once.
+    """
+    raw = values.tobytes()
+    block_items = NONZERO_SCAN_BLOCK // values.itemsize
+    indices = []
+    for first in range(0, len(values), block_items):
+        block = raw[first * values.itemsize:(first + block_items) * values.itemsize]
+        if block.count(0) != len(block):
+            indices.extend(index for index in range(first, min(first + block_items, len(values))) if values[index])
+    return indices
+
+
+def _volume_field(value):
+    """
+    Parse a packets, bytes or timestamp field. Values that are not non-negative integers count as 0.
+    """
+    try:
+        value = int(value)
+    except ValueError:
+        return 0
+    return value if value > 0 else 0
+
+
+class VolumeCounter:
+    """
+    This class sums the packets, bytes and durations of flows per tag and per port-protocol
+    combination in parallel integer arrays.
+
+    The per-tag sums are arrays indexed by the lookup table's tag IDs, and the per-port
+    sums are one 65536-slot array per protocol and metric, like PortProtocolCounter, so
+    adding a flow is six array updates rather than nested dictionary lookups.
+    """
+    METRICS = ("packets", "bytes", "seconds")
+
+    def __init__(self, tag_names, protocols=('tcp', 'udp')):
+        """
+        Initialize the VolumeCounter class.
+
+        Args:
+            tag_names (sequence): The lookup table's tag names, indexed by tag ID.
+            protocols (iterable): The protocols to allocate arrays for up front.
+        """
+        self.tag_names = tuple(tag_names)
+        self.tag_index = {tag: tag_id for tag_id, tag in enumerate(self.tag_names)}
+        self.tag_sums = tuple(array('Q', bytes(8 * len(self.tag_names))) for _ in self.METRICS)
+        self.port_sums = {}
+        for protocol in protocols:
+            self.sums_for(protocol)
+
+    def sums_for(self, protocol):
+        """
+        Get the (packets, bytes, seconds) arrays indexed by port for a protocol, allocating them on first use.
+        """
+        port_sums = self.port_sums.get(protocol)
+        if port_sums is None:
+            port_sums = self.port_sums[protocol] = tuple(array('Q', bytes(8 * (MAX_PORT + 1))) for _ in self.METRICS)
+        return port_sums
+
+    def add(self, tag_id, port, protocol, packets, byte_count, seconds):
+        """
+        Add the volume of one flow.
+
+        Args:
+            tag_id (int): The tag ID of the flow.
+            port (int): The destination port.
+            protocol (str): The protocol.
+            packets (int): The number of packets.
+            byte_count (int): The number of bytes.
+            seconds (int): The duration of the flow.
+
+        Time Complexity:
+            O(1) - Six array updates.
+
+        Space Complexity:
+            O(1) - The arrays have a fixed size.
+        """
+        tag_packets, tag_bytes, tag_seconds = self.tag_sums
+        tag_packets[tag_id] += packets
+        tag_bytes[tag_id] += byte_count
+        tag_seconds[tag_id] += seconds
+        port_packets, port_bytes, port_seconds = self.sums_for(protocol)
+        port_packets[port] += packets
+        port_bytes[port] += byte_count
+        port_seconds[port] += seconds
+
+    def merge(self, other):
+        """
+        Add the sums of another counter for the same lookup table into this one.
+
+        Args:
+            other (VolumeCounter): The counter to merge.
+
+        Raises:
+            ValueError: If other was built for a lookup table with other tag names, whose
+                tag IDs would add its sums to the wrong tags.
+
+        Time Complexity:
+            O(t + p), where t is the number of tags and p the number of ports with a
+            non-zero sum in other.
+
+        Space Complexity:
+            O(1) - The arrays have a fixed size.
+        """
+        if self.tag_names != other.tag_names:
+            raise ValueError("Cannot merge volume counts of lookup tables with different tags")
+        for sums, other_sums in zip(self.tag_sums, other.tag_sums):
+            for tag_id, value in enumerate(other_sums):
+                sums[tag_id] += value
+        for protocol, port, volume in other._nonzero_ports():
+            for sums, value in zip(self.sums_for(protocol), volume):
+                sums[port] += value
+
+    def _nonzero_ports(self):
+        """
+        Yield (protocol, port, (packets, bytes, seconds)) for every port with a non-zero sum.
+        """
+        for protocol, (port_packets, port_bytes, port_seconds) in self.port_sums.items():
+            ports = set(nonzero_indices(port_packets))
+            ports.update(nonzero_indices(port_bytes))
+            ports.update(nonzero_indices(port_seconds))
+            for port in sorted(ports):
+                yield protocol, port, (port_packets[port], port_bytes[port], port_seconds[port])
+
+    def for_tag(self, tag):
+        """
+        Get the (packets, bytes, seconds) sums of a tag, zeros for an unknown tag.
+        """
+        tag_id = self.tag_index.get(tag)
+        if tag_id is None:
+            return (0, 0, 0)
+        return tuple(sums[tag_id] for sums in self.tag_sums)
+
+    def for_port_protocol(self, port, protocol):
+        """
+        Get the (packets, bytes, seconds) sums of a port-protocol combination.
+        """
+        port_sums = self.port_sums.get(protocol)
+        if port_sums is None:
+            return (0, 0, 0)
+        return tuple(sums[port] for sums in port_sums)
+
+    def __reduce__(self):
+        # Only the non-zero port sums are pickled, so results sent back by worker processes stay small
+        return (_volume_counter_from_state, (self.tag_names, self.tag_sums, list(self._nonzero_ports())))
+
+
+def _volume_counter_from_state(tag_names, tag_sums, nonzero_ports):
+    """
+    Rebuild a pickled VolumeCounter.
+    """
+    counter = VolumeCounter(tag_names)
+    counter.tag_sums = tag_sums
+    for protocol, port, volume in nonzero_ports:
+        for sums, value in zip(counter.sums_for(protocol), volume):
+            sums[port] = value
+    return counter
+
+
+def throughput(byte_count, seconds):
+    """
+    Get the throughput in bytes per second of a byte count sent over a number of seconds,
+    or 0.0 if the duration is 0.
+    """
+    return byte_count / seconds if seconds else 0.0
+
+
 class LookupTable:
     """
     This class represents a lookup table that maps a port and protocol combination to a tag.
+
+    Besides the lookup_table dictionary, the table is compiled into one dense 65536-slot array
+    of tag IDs per protocol, with tag_names mapping an ID back to its tag. ID 0 is "untagged".
+
+    Rows that are not an exact (port, protocol) pair are rules: the port may be a range such
+    as 8000-8100 or *, the protocol may be *, and an optional fourth column restricts the rule
+    to a destination CIDR block. Rules are compiled into a RuleMatcher. Exact entries take
+    precedence over rules, and among rules the first matching one in file order wins.
     """
-    def __init__(self, lookup_table_file):
+    def __init__(self, lookup_table_file, cache_size=65536, negative_cache_size=65536):
+        build_start = time.perf_counter()
+        self.rule_rows = []
         self.lookup_table = self.load_lookup_table(lookup_table_file)
+        self.tag_names, self.tag_ids = self.build_dense_table(self.lookup_table or {})
+        self.rule_matcher = self.compile_rules(self.rule_rows, cache_size, negative_cache_size)
+        self.build_time = time.perf_counter() - build_start
+
+    def compile_rules(self, rule_rows, cache_size, negative_cache_size):
+        """
+        Compile the rule rows of the lookup table into a RuleMatcher.
+
+        Rule tags that are not used by an exact entry are appended to self.tag_names.
+
+        Args:
+            rule_rows (list): (low_port, high_port, protocol, network, tag) tuples in file order.
+            cache_size (int): The maximum number of matches the matcher caches.
+            negative_cache_size (int): The maximum number of misses the matcher caches.
+
+        Returns:
+            RuleMatcher: The compiled matcher, or None if the table has no rules.
+
+        Time Complexity:
+            O(r log r + r * p), where r is the number of rules and p is the longest prefix length.
+
+        Space Complexity:
+            O(r * p) - The interval index and the prefix trie.
+        """
+        if not rule_rows:
+            return None
+        tag_id_of = {tag: tag_id for tag_id, tag in enumerate(self.tag_names)}
+        rules = []
+        for rule_id, (low_port, high_port, protocol, network, tag) in enumerate(rule_rows):
+            if tag not in tag_id_of:
+                tag_id_of[tag] = len(self.tag_names)
+                self.tag_names.append(tag)
+            rules.append(Rule(rule_id, low_port, high_port, protocol, network, tag_id_of[tag]))
+        return RuleMatcher(rules, cache_size, negative_cache_size)
+
+    def get_stats(self):
+        """
+        Get the build time of the lookup table and the hit rates of its match caches.
+
+        Returns:
+            dict: The build time in seconds, the number of exact entries and rules, the cache
+            size, hits, misses and hit rate of the rule matcher, and the size and hits of its
+            negative cache.
+
+        Time Complexity:
+            O(1) - The statistics are kept as the table is used.
+
+        Space Complexity:
+            O(1) - A small dictionary.
+        """
+        stats = {
+            "build_time_seconds": self.build_time,
+            "exact_entries": len(self.lookup_table or {}),
+            "rules": 0,
+        }
+        if self.rule_matcher is not None:
+            cache = self.rule_matcher.cache
+            stats.update({
+                "rules": len(self.rule_matcher.rules),
+                "cache_size": len(cache),
+                "cache_hits": cache.hits,
+                "cache_misses": cache.misses,
+                "cache_hit_rate": cache.hit_rate(),
+                "negative_cache_size": len(self.rule_matcher.negative_cache),
+                "negative_cache_hits": self.rule_matcher.negative_cache.hits,
+            })
+        return stats
+
+    def build_dense_table(self, lookup_table):
+        """
+        Compile a (port, protocol) to tag dictionary into dense arrays of tag IDs.
+
+        Args:
+            lookup_table (dict): A dictionary mapping (port, protocol) to tag.
+
+        Returns:
+            tuple: The list of tag names indexed by tag ID, and a dictionary mapping each
+            protocol to a 65536-slot array of tag IDs indexed by port.
+
+        Time Complexity:
+            O(n + p * 65536), where n is the number of entries and p is the number of protocols.
+
+        Space Complexity:
+            O(p * 65536) - One fixed-size array per protocol.
+        """
+        tag_names = ["untagged"]
+        tag_id_of = {}
+        for tag in lookup_table.values():
+            if tag not in tag_id_of:
+                tag_id_of[tag] = len(tag_names)
+                tag_names.append(tag)
+        typecode = 'H' if len(tag_names) <= 0xFFFF else 'I'
+        tag_ids = {}
+        for (port, protocol), tag in lookup_table.items():
+            if not 0 <= port <= MAX_PORT:
+                continue
+            if protocol not in tag_ids:
+                tag_ids[protocol] = array(typecode, bytes(array(typecode).itemsize * (MAX_PORT + 1)))
+            tag_ids[protocol][port] = tag_id_of[tag]
+        return tag_names, tag_ids
  
     def load_lookup_table(self, lookup_table_file):
         """
         Loads the lookup table from a file and stores it in a dictionary.
 
+        Exact rows go into the dictionary. Rows with a port range, a wildcard or a destination
+        CIDR block are appended to self.rule_rows instead.
+
         Args:
             lookup_table_file (str): The path to the lookup table file.
 
@@ -29,76 +969,233 @@ class LookupTable:
             with open(lookup_table_file, "r", encoding='utf-8') as lookup_file:
                 next(lookup_file)  # ignore the first line which has the destport, protocol, tag header
                 for line in lookup_file:
-                    port, protocol, tag = line.strip().split(',')
-                    lookup_table[(int(port), protocol)] = tag
+                    if not line.strip():
+                        continue
+                    port, protocol, tag, *cidr = line.strip().split(',')
+                    if len(cidr) > 1:
+                        raise ValueError(f"Too many columns in lookup table row: {line.strip()}")
+                    network = ipaddress.ip_network(cidr[0].strip(), strict=False) if cidr and cidr[0].strip() else None
+                    if network is None and protocol != WILDCARD:
+                        try:
+                            lookup_table[(int(port), protocol)] = tag
+                            continue
+                        except ValueError:
+                            pass  # not a single port, so it must be a range or a wildcard
+                    low_port, high_port = parse_port_range(port)
+                    self.rule_rows.append((low_port, high_port, None if protocol == WILDCARD else protocol, network, tag))
             lookup_file.close()
         except FileNotFoundError:
             print(f"Error: File {lookup_table_file} not found.")
             return None
         return lookup_table
 
-    def get_tag(self, port, protocol):
+    def get_tag(self, port, protocol, dst_ip=None):
         """
         Get the tag associated with a given port and protocol combination.
 
         Args:
             port (int): The destination port.
             protocol (str): The protocol.
+            dst_ip (str): The destination IP address, only needed for rules with a CIDR block.
 
         Returns:
             str: The tag associated with the port and protocol.
 
         Time Complexity:
-            O(1) - Dictionary lookup is constant time on average.
+            O(1) - An array lookup for valid ports, otherwise a dictionary lookup. Rules are
+            matched through the rule matcher's cache and indexes.
 
         Space Complexity:
             O(1) - The function uses a constant amount of extra space,
-            regardless of the input size. However, note that if the
-            (port, protocol) combination is not in the lookup table,
-            it adds a new entry, which could potentially increase the
-            space used by the lookup table over multiple calls.
+            regardless of the input size. A miss does not modify the lookup table; missed
+            rule matches are remembered in the rule matcher's bounded negative cache.
         """
-        if (port, protocol) in self.lookup_table: 
-            return self.lookup_table[(port,protocol)]
-        else:
-            self.lookup_table[(port,protocol)] = "untagged"
-            return "untagged"
+        port_tags = self.tag_ids.get(protocol)
+        if port_tags is not None and 0 <= port <= MAX_PORT and port_tags[port]:
+            return self.tag_names[port_tags[port]]
+        if self.rule_matcher is not None and 0 <= port <= MAX_PORT:
+            tag_id = self.rule_matcher.match(port, protocol, dst_ip)
+            if tag_id:
+                return self.tag_names[tag_id]
+        if self.lookup_table and (port, protocol) in self.lookup_table:  # ports outside the dense range
+            return self.lookup_table[(port, protocol)]
+        return "untagged"
+
+    def freeze(self):
+        """
+        Get an immutable copy of the lookup table.
+
+        Returns:
+            FrozenLookupTable: A read-only lookup table with the same entries and rules.
+
+        Time Complexity:
+            O(n + r + p * 65536), where n is the number of exact entries, r the number of
+            rules and p the number of protocols in the dense table.
+
+        Space Complexity:
+            O(n + r + p * 65536) - The entries, rules and dense arrays are copied.
+        """
+        rules = self.rule_matcher.rules if self.rule_matcher is not None else ()
+        cache_sizes = (self.rule_matcher.cache.maxsize, self.rule_matcher.negative_cache.maxsize) if self.rule_matcher is not None else ()
+        return FrozenLookupTable(self.lookup_table or {}, self.tag_names, self.tag_ids, rules, self.build_time, *cache_sizes)
+
+    def fingerprint(self):
+        """
+        Get a digest of the entries, rules and tag IDs of the lookup table.
+
+        Aggregates that are indexed by tag ID, or that were counted with a table mapping
+        ports to other tags, are only valid for a table with the same fingerprint.
+
+        Returns:
+            str: A hex digest that is identical in every process and run for the same table.
+
+        Time Complexity:
+            O(n log n + r), where n is the number of exact entries and r the number of rules.
+
+        Space Complexity:
+            O(n + r) - The entries and rules are formatted before they are hashed.
+        """
+        rules = self.rule_matcher.rules if self.rule_matcher is not None else ()
+        entries = sorted((self.lookup_table or {}).items())
+        return hashlib.sha256(repr((tuple(self.tag_names), entries, tuple(rules))).encode('utf-8')).hexdigest()
+
+
+class FrozenLookupTable(LookupTable):
+    """
+    This class represents an immutable lookup table.
+
+    The exact entries are a read-only mapping, the tag names a tuple and the dense tag ID
+    arrays read-only memoryviews, and assigning an attribute raises an AttributeError. Only
+    the rule matcher's bounded caches change as the table is used. A frozen table pickles to
+    its compact state (the entries, the rules and the raw bytes of the dense arrays), so it
+    can be sent once to every worker process of a pool and reused across runs.
+    """
+    def __init__(self, lookup_table, tag_names, tag_ids, rules=(), build_time=0.0, cache_size=65536, negative_cache_size=65536):
+        """
+        Initialize the FrozenLookupTable class.
+
+        Args:
+            lookup_table (dict): A dictionary mapping (port, protocol) to tag.
+            tag_names (list): The tag names indexed by tag ID.
+            tag_ids (dict): A dictionary mapping each protocol to a 65536-slot buffer of tag IDs.
+            rules (tuple): The compiled Rule tuples.
+            build_time (float): The time it took to build the original table, in seconds.
+            cache_size (int): The maximum number of matches kept in the rule matcher's cache.
+            negative_cache_size (int): The maximum number of misses kept in its negative cache.
+        """
+        frozen_tag_ids = {}
+        for protocol, port_tags in tag_ids.items():
+            view = memoryview(port_tags)
+            frozen_tag_ids[protocol] = view if view.readonly else memoryview(bytes(view)).cast(view.format)
+        rule_matcher = RuleMatcher(tuple(rules), cache_size, negative_cache_size) if rules else None
+        set_attribute = super().__setattr__
+        set_attribute("lookup_table", MappingProxyType(dict(lookup_table)))
+        set_attribute("tag_names", tuple(tag_names))
+        set_attribute("tag_ids", MappingProxyType(frozen_tag_ids))
+        set_attribute("rule_matcher", rule_matcher)
+        set_attribute("rule_rows", ())
+        set_attribute("build_time", build_time)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"FrozenLookupTable is immutable; cannot set {name}")
+
+    def freeze(self):
+        return self
+
+    def __reduce__(self):
+        tag_ids = {protocol: (bytes(view), view.format) for protocol, view in self.tag_ids.items()}
+        cache_sizes = (self.rule_matcher.cache.maxsize, self.rule_matcher.negative_cache.maxsize) if self.rule_matcher is not None else ()
+        rules = self.rule_matcher.rules if self.rule_matcher is not None else ()
+        return (_frozen_lookup_table_from_state,
+                (dict(self.lookup_table), self.tag_names, tag_ids, rules, self.build_time, cache_sizes))
+
+
+def _frozen_lookup_table_from_state(lookup_table, tag_names, tag_ids, rules, build_time, cache_sizes):
+    """
+    Rebuild a pickled FrozenLookupTable.
+    """
+    tag_ids = {protocol: memoryview(raw_tag_ids).cast(tag_id_format) for protocol, (raw_tag_ids, tag_id_format) in tag_ids.items()}
+    return FrozenLookupTable(lookup_table, tag_names, tag_ids, rules, build_time, *cache_sizes)
 
 class FlowLogProcessor:
     """
     This class processes flow logs using a lookup table to categorize them based on port and protocol.
+
+    Five tuples are counted exactly in a dictionary by default, keyed by a single integer
+    that pack_five_tuple packs both addresses, both ports and the protocol into; the keys are
+    only decoded back into tuples by get_five_tuple_counts_dict and the Writer. When a HeavyHitterSketch is
+    passed in, five tuples are counted approximately under the sketch's memory budget
+    instead, while tags and port-protocol combinations are still counted exactly. With
+    count_five_tuples=False, five tuples are not counted at all and five_tuple_counts is None.
+    With volume_metrics=True, the packets, bytes and durations of the accepted flows are also
+    summed per tag and per port-protocol combination in a VolumeCounter, in the same pass.
+    With an Instrumentation, every sampled line goes through the same lookup and aggregation
+    functions as the others, with timers around them; without one, the loop is not changed.
+
+    Lines are parsed according to a FlowLogSchema, which defaults to the version 2 default
+    format. A flow log file that starts with a header line is parsed with the schema of its
+    header instead, so files of different formats can be processed together.
     """
-    def __init__(self, lookup_table, flow_log_file): 
+    def __init__(self, lookup_table, flow_log_file, error_sink=None, five_tuple_sketch=None, count_five_tuples=True,
+                 volume_metrics=False, instrumentation=None, schema=None): 
         self.lookup_table = lookup_table
         self.flow_log_file = flow_log_file
+        self.error_sink = error_sink if error_sink is not None else ErrorSink()
         self.tag_counts = {}
-        self.port_protocol_counts = {}
-        self.five_tuple_counts = {}
+        self.port_protocol_counts = PortProtocolCounter()
+        self.five_tuple_counts = None
+        if count_five_tuples:
+            self.five_tuple_counts = five_tuple_sketch if five_tuple_sketch is not None else {}
+        self.volume_counts = VolumeCounter(lookup_table.tag_names) if volume_metrics else None
+        self.instrumentation = instrumentation
+        self.restored_lines = 0  # accepted lines and rejections restored from a checkpoint rather than processed
+        self.restored_rejections = {}
+        self.schema = schema if schema is not None else DEFAULT_SCHEMA
+        self._compiled_schemas = {}
+        self.parse_line, self.validate_line, self.parse_volume = self.compile_schema(self.schema)
     
+    AGGREGATES = ("tag_counts", "port_protocol_counts", "five_tuple_counts", "volume_counts")
+
     def write_to_error_log(self, line, error_msg):
         """
-        Write an error message to the error log file.
+        Write an error message to the error log through the error sink.
 
         Args:
             line (str): The original log line that caused the error.
             error_msg (str): The error message describing the issue.
 
         Time Complexity:
-            O(1) - The operation of writing to a file is generally considered constant time,
-            as it doesn't depend on the size of the input.
+            O(1) amortized - The error sink keeps the error log open and buffers its writes.
 
         Space Complexity:
             O(n) - Where n is the combined length of the line and error_msg strings.
             The space used is proportional to the length of these strings.
         """
-        with open("error_log.txt", "a", encoding='utf-8') as error_file:
-            error_file.write(f"Error in line: {line}\n")
-            error_file.write(f"Error message: {error_msg}\n")
+        self.error_sink.record(line, error_msg)
+
+    def get_error_summary(self):
+        """
+        Get the number of rejected lines per error reason.
+
+        Returns:
+            dict: A dictionary mapping error reason to the number of rejected lines.
+
+        Time Complexity:
+            O(r), where r is the number of error reasons.
+
+        Space Complexity:
+            O(r) - A copy of the rejection counts is returned.
+        """
+        return self.error_sink.get_rejection_summary()
 
     def process_log(self):
         """
         Process the flow log file by categorizing based on port and protocol.
 
+        The flow log path may also be a directory or a glob pattern, in which case every
+        matching file is processed in sorted order as if the files were concatenated.
+        gzip, bz2 and zstd compressed files are decompressed while they are read.
+
         Time Complexity:
             O(n), where n is the number of lines in the flow log file.
             Each line is processed once, with constant-time operations per line.
@@ -108,73 +1205,447 @@ class FlowLogProcessor:
             and k is the number of unique tags encountered.
             The space is used by self.port_protocol_counts and self.tag_counts dictionaries.
         """
-        with open(self.flow_log_file, "r", encoding='utf-8') as flow_file:
-            for line in flow_file:
+        try:
+            for flow_log_path in resolve_flow_log_files(self.flow_log_file):
+                schema = detect_flow_log_schema(flow_log_path, self.schema)
+                self._process_lines(iter_flow_log_lines(flow_log_path), schema)
+        finally:
+            self.error_sink.close()
 
-                data = line.split(',')
-                if len(data) != 14:  # validate data to check that dst_port and protocol are in the right locations
-                    error_msg = f"Incorrect size of data: {len(data)}"
-                    self.write_to_error_log(line.strip(), error_msg)
-                    continue
+    def process_log_parallel(self, workers=None, shard_size=None):
+        """
+        Process the flow log with a pool of worker processes.
 
-                try:
-                    dst_port = int(data[6])  # according to AWS VPC Flow Log Documentation for version 2, destination port is the 7th field. If AWS changes the format or Illumio upgrades versions, this will need to be updated.
-                    if dst_port < 0 or dst_port > 65535:  # the universally acceptable range for ports is (0, 65535) according to RFC 793
-                        error_msg = f"Port not within acceptable range: {dst_port}"
-                        self.write_to_error_log(line.strip(), error_msg)
-                        continue
-                except ValueError:
-                    error_msg = f"Invalid port number: {data[6]}"
-                    self.write_to_error_log(line.strip(), error_msg)
-                    continue
-                
-                protocol = data[7].lower()  # according to AWS VPC Flow Log Documentation for version 2, protocol is the 8th field. If AWS changes the format or Illumio upgrades versions, this will need to be updated.
-                if protocol not in ['tcp', 'udp']:
-                    error_msg = f"Protocol not within accepted values: {protocol}"
-                    self.write_to_error_log(line.strip(), error_msg)
-                    continue
-            
-                
-                try:
-                    source_port = int(data[5])  # according to AWS VPC Flow Log Documentation for version 2, source port is the 6th field. If AWS changes the format or Illumio upgrades versions, this will need to be updated.
-                    if source_port < 0 or source_port > 65535:  # the universally acceptable range for ports is (0, 65535) according to RFC 793
-                        error_msg = f"Port not within acceptable range: {source_port}"
-                        self.write_to_error_log(line.strip(), error_msg)
-                        continue
-                except ValueError:
-                    error_msg = f"Invalid port number: {data[5]}"
-                    self.write_to_error_log(line.strip(), error_msg)
-                    continue
-
-                # update the port_protocol dictionary with the number of combination occurrences
-                port_protocol_key = (dst_port, protocol)
-                if port_protocol_key in self.port_protocol_counts:
-                    self.port_protocol_counts[port_protocol_key] += 1
-                else:
-                    self.port_protocol_counts[port_protocol_key] = 1
-                
-                # update the tag_counts dictionary with the number of tag occurrences
-                tag = self.lookup_table.get_tag(dst_port, protocol)
-                if tag not in self.tag_counts:
-                    self.tag_counts[tag] = 1
+        Every input file is split into newline-aligned byte ranges (shards). Each worker
+        builds partial tag, port-protocol and five tuple counts for its shard, and the
+        partial results are merged in shard order so that the counts, their ordering and
+        the error log are identical to a serial run of process_log.
+
+        Args:
+            workers (int): The number of worker processes. Defaults to os.cpu_count().
+            shard_size (int): The approximate size of a shard in bytes. Defaults to
+                splitting every file into four shards per worker.
+
+        Time Complexity:
+            O(n / w + s), where n is the number of lines, w is the number of workers
+            and s is the total size of the partial results that have to be merged.
+
+        Space Complexity:
+            O(w * (m + k + t)) - Every worker holds its own partial dictionaries until
+            they are merged into self.tag_counts, self.port_protocol_counts and
+            self.five_tuple_counts.
+        """
+        workers = workers or os.cpu_count() or 1
+        shards = []
+        shard_schemas = []
+        for flow_log_path in resolve_flow_log_files(self.flow_log_file):
+            file_shards = compute_shards(flow_log_path, workers, shard_size)
+            shards.extend(file_shards)
+            if file_shards:
+                shard_schemas.extend([detect_flow_log_schema(flow_log_path, self.schema)] * len(file_shards))
+        if workers == 1 or len(shards) <= 1:
+            self.process_log()
+            return
+
+        error_sink = self.error_sink
+        initargs = self.worker_initargs()
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker,
+                                     initargs=initargs) as executor:
+                for partial_results in executor.map(_process_shard, shards, shard_schemas):
+                    self.merge_partial_results(partial_results)
+        finally:
+            error_sink.close()
+
+    def worker_initargs(self):
+        """
+        Get the arguments of _init_shard_worker for the workers of this processor.
+
+        Returns:
+            tuple: The frozen lookup table, the error sink's mode and sample limit, an empty
+            copy of the five tuple sketch (or None), and whether volume metrics are summed.
+        """
+        five_tuple_sketch = None
+        if isinstance(self.five_tuple_counts, HeavyHitterSketch):
+            five_tuple_sketch = self.five_tuple_counts.empty_copy()
+        return (self.lookup_table.freeze(), self.error_sink.mode, self.error_sink.max_samples, five_tuple_sketch,
+                self.volume_counts is not None)
+
+    def merge_partial_results(self, partial_results):
+        """
+        Merge the partial results of a worker into the aggregates and the error sink.
+
+        Args:
+            partial_results (tuple): The partial tag counts, port-protocol counts, five tuple
+                counts, volume counts, errors and rejection counts, as _process_shard returns them.
+
+        Time Complexity:
+            O(s), where s is the size of the partial results.
+
+        Space Complexity:
+            O(s) - New keys are added to the aggregates in the order the worker saw them.
+        """
+        tag_counts, port_protocol_counts, five_tuple_counts, volume_counts, errors, rejection_counts = partial_results
+        self.error_sink.absorb(errors, rejection_counts)
+        _merge_counts(self.tag_counts, tag_counts)
+        self.port_protocol_counts.merge(port_protocol_counts)
+        if volume_counts is not None:
+            self.volume_counts.merge(volume_counts)
+        if isinstance(self.five_tuple_counts, HeavyHitterSketch):
+            self.five_tuple_counts.merge(five_tuple_counts)
+        else:
+            _merge_counts(self.five_tuple_counts, five_tuple_counts)
+
+    def process_log_incremental(self, checkpoint_file):
+        """
+        Process only the lines appended to the flow log since the previous incremental run.
+
+        The byte offset reached in every input file and the aggregate counts are saved in a
+        checkpoint. The next run restores the counts and resumes every file from its offset,
+        so its cost depends on the amount of new data rather than on the size of the files.
+        Only complete lines are processed; a partially written last line is picked up by the
+        next run. If a file was rotated (its inode changed), truncated (it is smaller than its
+        offset), removed, or is a compressed file that changed, if the checkpoint holds a
+        different kind of five tuple or volume counts, or if it was saved with a lookup table
+        or schema with another fingerprint (the saved counts are keyed by that table's tags
+        and tag IDs), the checkpoint is discarded and everything is rescanned from the start.
+
+        Args:
+            checkpoint_file (str or Path): The path to the checkpoint file.
+
+        Time Complexity:
+            O(d + s), where d is the number of new lines and s is the size of the saved
+            aggregates, which are loaded and saved again.
+
+        Space Complexity:
+            O(m + k + t) - The same aggregates as process_log.
+        """
+        checkpoint = Checkpoint(checkpoint_file)
+        saved_files, saved_aggregates, saved_fingerprint = checkpoint.load()
+        flow_log_paths = resolve_flow_log_files(self.flow_log_file)
+        fingerprint = (self.lookup_table.fingerprint(), self.schema)
+        offsets = {}
+        if self._can_resume(saved_files, saved_aggregates, flow_log_paths, saved_fingerprint, fingerprint):
+            for name in self.AGGREGATES:
+                setattr(self, name, saved_aggregates[name])
+            self.error_sink.absorb([], saved_aggregates["rejection_counts"])
+            self.restored_lines = sum(self.tag_counts.values())
+            self.restored_rejections = dict(saved_aggregates["rejection_counts"])
+            offsets = {path: offset for path, (identity, offset) in saved_files.items()}
+
+        files = {}
+        try:
+            for flow_log_path in flow_log_paths:
+                identity, file_size = Checkpoint.file_identity(flow_log_path)
+                start = offsets.get(flow_log_path, 0)
+                if is_compressed(flow_log_path):
+                    end = file_size
+                    if start != end:
+                        schema = detect_flow_log_schema(flow_log_path, self.schema)
+                        self._process_lines(iter_flow_log_lines(flow_log_path), schema)
                 else:
-                    self.tag_counts[tag] += 1
-
-                # update the five_tuple dictionary with the number of tuple occurences
-                # TODO: Add error checking for each data value that hasn't already been accounted for above
-                
-                # 172.31.16.139 172.31.16.21 143 22 6
-                source_ip = data[3]
-                dest_ip = data[4]
-                
-                five_tuple_key = (source_ip, dest_ip, source_port, dst_port, protocol)
-                if five_tuple_key in self.five_tuple_counts:
-                    self.five_tuple_counts[five_tuple_key] += 1 
-                else: 
-                    self.five_tuple_counts[five_tuple_key] = 1
-
-        flow_file.close()
-    
+                    end = complete_lines_end(flow_log_path, start, file_size)
+                    if end > start:
+                        schema = detect_flow_log_schema(flow_log_path, self.schema)  # the header is at the start of the file
+                        self._process_lines(iter_flow_log_lines(flow_log_path, start, end), schema)
+                files[flow_log_path] = (identity, end)
+        finally:
+            self.error_sink.close()
+
+        aggregates = {name: getattr(self, name) for name in self.AGGREGATES}
+        aggregates["rejection_counts"] = self.error_sink.rejection_counts
+        checkpoint.save(files, aggregates, fingerprint)
+
+    def _can_resume(self, saved_files, saved_aggregates, flow_log_paths, saved_fingerprint=None, fingerprint=None):
+        """
+        Check whether a saved checkpoint is still consistent with the input files.
+
+        Returns:
+            bool: True if the checkpoint was saved with the same lookup table and schema
+            fingerprint, and every checkpointed file still exists with the same identity, has
+            not shrunk below its offset and, if compressed, has not changed.
+        """
+        if saved_files is None or saved_fingerprint != fingerprint:
+            return False
+        if type(saved_aggregates["five_tuple_counts"]) is not type(self.five_tuple_counts):
+            return False
+        if type(saved_aggregates["volume_counts"]) is not type(self.volume_counts):
+            return False
+        current_paths = set(flow_log_paths)
+        for flow_log_path, (saved_identity, offset) in saved_files.items():
+            if flow_log_path not in current_paths:
+                return False
+            identity, file_size = Checkpoint.file_identity(flow_log_path)
+            if identity != saved_identity or file_size < offset:
+                return False
+            if is_compressed(flow_log_path) and file_size != offset:
+                return False
+        return True
+
+    def compile_schema(self, schema):
+        """
+        Compile a flow log schema into the functions that parse its lines.
+
+        The positions of the aggregated fields, the delimiter, the number of fields a
+        line must have and the accepted protocol spellings are fixed once here and bound
+        into closures, so parsing a line of a custom format costs the same as parsing a
+        line of the default format. The functions are cached per schema; the ones of
+        self.schema are also available as self.parse_line, self.validate_line and
+        self.parse_volume.
+
+        parse_line is the fast path: the delimiters are counted instead of splitting the
+        whole line, only the fields up to the last aggregated one are split off, and the
+        ports and protocol are looked up in PORT_NUMBERS and the schema's protocol names
+        instead of being converted. Any line the lookups don't accept outright, valid or
+        not, is handed to validate_line, so the accepted lines and error messages are
+        exactly those of validate_line.
+
+        validate_line splits the line into all of its fields and converts the ports with
+        int(). Only the IP address fields are decoded, and the whole line is only decoded
+        when it has to be written to the error log. The port fields of accepted lines are
+        added to PORT_NUMBERS when they are written canonically, so parse_line can accept
+        the next line with the same ports without calling validate_line. A line that is
+        the schema's header is skipped without an error.
+
+        parse_volume extracts the packets, bytes and duration of an accepted line. Fields
+        that are not non-negative integers, or that the schema does not have, count as 0,
+        and so does the duration of a flow that ends before it starts.
+
+        Args:
+            schema (FlowLogSchema): The schema of the flow log lines.
+
+        Returns:
+            tuple: (parse_line, validate_line, parse_volume). parse_line and validate_line
+            take a line as bytes and return (source_ip, dest_ip, source_port, dst_port,
+            protocol), or None if the line is invalid; parse_volume returns (packets, bytes,
+            seconds).
+
+        Time Complexity:
+            O(f) to compile, where f is the number of fields, and O(l) per parsed line,
+            where l is the length of the line.
+
+        Space Complexity:
+            O(f) - The field positions are bound into the functions.
+        """
+        compiled = self._compiled_schemas.get(schema)
+        if compiled is not None:
+            return compiled
+        delimiter = schema.delimiter
+        field_count = schema.field_count
+        separators = field_count - 1
+        source_ip_index, dest_ip_index, source_port_index, dst_port_index, protocol_index = (
+            schema.indices[field] for field in AGGREGATED_FIELDS)
+        split_count = max(source_ip_index, dest_ip_index, source_port_index, dst_port_index, protocol_index) + 1
+        strip_newline = split_count == field_count  # the last field is aggregated, so its newline has to go
+        packets_index, bytes_index, start_index, end_index = (schema.indices.get(field) for field in VOLUME_FIELDS)
+        volume_split_count = max((index for index in (packets_index, bytes_index, start_index, end_index)
+                                  if index is not None), default=-1) + 1
+        protocol_names = schema.protocol_names
+        port_numbers = PORT_NUMBERS
+        header = schema.header
+        write_to_error_log = self.write_to_error_log
+
+        def validate_line(line):
+            if strip_newline:
+                line = line.rstrip(b"\r\n")
+            data = line.split(delimiter)
+            if len(data) != field_count:  # validate data to check that dst_port and protocol are in the right locations
+                error_msg = f"Incorrect size of data: {len(data)}"
+                write_to_error_log(line.decode('utf-8').strip(), error_msg)
+                return None
+            if line.rstrip(b"\r\n") == header:
+                return None
+
+            try:
+                dst_port = int(data[dst_port_index])
+                if dst_port < 0 or dst_port > 65535:  # the universally acceptable range for ports is (0, 65535) according to RFC 793
+                    error_msg = f"Port not within acceptable range: {dst_port}"
+                    write_to_error_log(line.decode('utf-8').strip(), error_msg)
+                    return None
+            except ValueError:
+                error_msg = f"Invalid port number: {data[dst_port_index].decode('utf-8')}"
+                write_to_error_log(line.decode('utf-8').strip(), error_msg)
+                return None
+
+            protocol = protocol_names.get(data[protocol_index].lower())
+            if protocol is None:
+                error_msg = f"Protocol not within accepted values: {data[protocol_index].decode('utf-8').lower()}"
+                write_to_error_log(line.decode('utf-8').strip(), error_msg)
+                return None
+
+            try:
+                source_port = int(data[source_port_index])
+                if source_port < 0 or source_port > 65535:  # the universally acceptable range for ports is (0, 65535) according to RFC 793
+                    error_msg = f"Port not within acceptable range: {source_port}"
+                    write_to_error_log(line.decode('utf-8').strip(), error_msg)
+                    return None
+            except ValueError:
+                error_msg = f"Invalid port number: {data[source_port_index].decode('utf-8')}"
+                write_to_error_log(line.decode('utf-8').strip(), error_msg)
+                return None
+
+            for port_field, port in ((data[source_port_index], source_port), (data[dst_port_index], dst_port)):
+                if port_field == b"%d" % port:  # " 80" or "080" would make the table grow without bound
+                    port_numbers[port_field] = port
+            return data[source_ip_index].decode('utf-8'), data[dest_ip_index].decode('utf-8'), source_port, dst_port, protocol
+
+        def parse_line(line):
+            if strip_newline:
+                line = line.rstrip(b"\r\n")
+            if line.count(delimiter) == separators:
+                data = line.split(delimiter, split_count)  # the fields after the last aggregated one are not needed
+                dst_port = port_numbers.get(data[dst_port_index])
+                source_port = port_numbers.get(data[source_port_index])
+                protocol = protocol_names.get(data[protocol_index])
+                if dst_port is not None and source_port is not None and protocol is not None:
+                    return data[source_ip_index].decode('utf-8'), data[dest_ip_index].decode('utf-8'), source_port, dst_port, protocol
+            return validate_line(line)
+
+        def parse_volume(line):
+            data = line.split(delimiter, volume_split_count)
+            packets = _volume_field(data[packets_index]) if packets_index is not None else 0
+            byte_count = _volume_field(data[bytes_index]) if bytes_index is not None else 0
+            seconds = 0
+            if start_index is not None and end_index is not None:
+                seconds = _volume_field(data[end_index]) - _volume_field(data[start_index])
+            return packets, byte_count, seconds if seconds > 0 else 0
+
+        compiled = self._compiled_schemas[schema] = (parse_line, validate_line, parse_volume)
+        return compiled
+
+    def _process_lines(self, lines, schema=None):
+        """
+        Validate and aggregate an iterable of flow log lines.
+
+        Args:
+            lines (iterable): The flow log lines to process, as bytes.
+            schema (FlowLogSchema): The schema of the lines. Defaults to self.schema.
+
+        Time Complexity:
+            O(n), where n is the number of lines.
+
+        Space Complexity:
+            O(m + k + t), where m, k and t are the number of unique port-protocol
+            combinations, tags and five tuples encountered. t is bounded by the sketch's
+            memory budget in approximate mode.
+        """
+        parse_line, _, parse_volume = self.compile_schema(schema if schema is not None else self.schema)
+        lookup_tag_id, aggregate = self._compile_aggregation(parse_volume)
+        if self.instrumentation is not None:
+            lines = self.instrumentation.sample_lines(
+                lines, lambda line: self._process_sampled_line(line, parse_line, lookup_tag_id, aggregate))
+        for line in lines:
+            record = parse_line(line)
+            if record is None:
+                continue
+            aggregate(line, record, lookup_tag_id(record[3], record[4], record[1]))
+
+    def _compile_aggregation(self, parse_volume):
+        """
+        Bind the lookup table and the current aggregates into the functions that process an
+        accepted line.
+
+        Both _process_lines and the timed path of _process_sampled_line go through these
+        functions, so an instrumented run updates the aggregates exactly like a plain one.
+
+        Args:
+            parse_volume (callable): The parse_volume of the schema of the lines.
+
+        Returns:
+            tuple: (lookup_tag_id, aggregate). lookup_tag_id takes the destination port,
+            protocol and destination IP of a line and returns its tag ID; aggregate takes the
+            line, its parsed record and its tag ID and adds the line to every aggregate.
+        """
+        five_tuple_counts = self.five_tuple_counts
+        five_tuple_sketch = five_tuple_counts if isinstance(five_tuple_counts, HeavyHitterSketch) else None
+        port_protocol_counts = self.port_protocol_counts
+        port_protocol_arrays = port_protocol_counts.counts
+        port_protocol_order = port_protocol_counts.order
+        tag_counts = self.tag_counts
+        tag_names = self.lookup_table.tag_names
+        tag_ids = self.lookup_table.tag_ids
+        rule_matcher = self.lookup_table.rule_matcher
+        volume_counts = self.volume_counts
+        if volume_counts is not None:
+            tag_packets, tag_bytes, tag_seconds = volume_counts.tag_sums
+            port_sums = volume_counts.port_sums
+
+        def lookup_tag_id(dst_port, protocol, dest_ip):
+            port_tags = tag_ids.get(protocol)
+            tag_id = port_tags[dst_port] if port_tags is not None else 0
+            if not tag_id and rule_matcher is not None:
+                tag_id = rule_matcher.match(dst_port, protocol, dest_ip)
+            return tag_id
+
+        def aggregate(line, record, tag_id):
+            source_ip, dest_ip, source_port, dst_port, protocol = record
+
+            # update the dense port_protocol counters with the number of combination occurrences
+            port_counts = port_protocol_arrays[protocol]
+            if not port_counts[dst_port]:
+                port_protocol_order.append((dst_port, protocol))
+            port_counts[dst_port] += 1
+
+            # update the tag_counts dictionary with the number of tag occurrences
+            tag = tag_names[tag_id]
+            if tag not in tag_counts:
+                tag_counts[tag] = 1
+            else:
+                tag_counts[tag] += 1
+
+            # add the packets, bytes and duration of the flow to the volume sums
+            if volume_counts is not None:
+                packets, byte_count, seconds = parse_volume(line)
+                tag_packets[tag_id] += packets
+                tag_bytes[tag_id] += byte_count
+                tag_seconds[tag_id] += seconds
+                port_packets, port_bytes, port_seconds = port_sums[protocol]
+                port_packets[dst_port] += packets
+                port_bytes[dst_port] += byte_count
+                port_seconds[dst_port] += seconds
+
+            # update the five_tuple dictionary with the number of tuple occurences
+            if five_tuple_counts is None:
+                return
+            five_tuple_key = pack_five_tuple(source_ip, dest_ip, source_port, dst_port, protocol)
+            if five_tuple_sketch is not None:
+                five_tuple_sketch.add(five_tuple_key)
+            elif five_tuple_key in five_tuple_counts:
+                five_tuple_counts[five_tuple_key] += 1
+            else:
+                five_tuple_counts[five_tuple_key] = 1
+
+        return lookup_tag_id, aggregate
+
+    def _process_sampled_line(self, line, parse_line, lookup_tag_id, aggregate):
+        """
+        Process one line with the functions of _process_lines, timing its parsing, tag lookup
+        and aggregation for self.instrumentation.
+
+        Args:
+            line (bytes): The sampled flow log line.
+            parse_line (callable): The parse_line of the schema of the line.
+            lookup_tag_id (callable): The lookup_tag_id of _compile_aggregation.
+            aggregate (callable): The aggregate of _compile_aggregation.
+        """
+        clock = time.perf_counter
+        start = clock()
+        record = parse_line(line)
+        parsed = clock()
+        if record is None:
+            self.instrumentation.record_line(parsed - start)
+            return
+        tag_id = lookup_tag_id(record[3], record[4], record[1])
+        looked_up = clock()
+        aggregate(line, record, tag_id)
+        aggregated = clock()
+
+        lookup_source = "untagged"
+        if tag_id:
+            port_tags = self.lookup_table.tag_ids.get(record[4])
+            lookup_source = "exact" if port_tags is not None and port_tags[record[3]] else "rule"
+        self.instrumentation.record_line(parsed - start, looked_up - parsed, aggregated - looked_up, lookup_source)
+
     def get_tag_counts(self, tag):
         """
         Get the count associated with a specific tag from self.tag_counts.
@@ -216,34 +1687,231 @@ class FlowLogProcessor:
         Get the entire port_protocol_counts dictionary.
 
         Returns:
-            dict: A dictionary containing all port-protocol combination counts.
+            dict: A dictionary containing all port-protocol combination counts, in first-seen order.
 
         Time Complexity:
-            O(1) - This operation is a simple attribute access, which is constant time.
+            O(m), where m is the number of unique port-protocol combinations, since the
+            dictionary is built from the dense counters.
 
         Space Complexity:
-            O(1) - No additional space is used; the function returns a reference to the existing dictionary.
+            O(m) - A new dictionary holding every port-protocol combination.
         """
-        return self.port_protocol_counts
+        return dict(self.port_protocol_counts.items())
     
     def get_five_tuple_counts_dict(self):
+        """
+        Get the five tuple counts, keyed by (source_ip, dest_ip, source_port, dst_port, protocol) tuples.
+
+        Returns:
+            dict or HeavyHitterSketch: A dictionary containing all five tuple counts, or the
+            heavy hitter sketch holding the top five tuples in approximate mode, whose keys
+            are still packed.
+
+        Time Complexity:
+            O(t), where t is the number of five tuples - Every key is decoded.
+
+        Space Complexity:
+            O(t) - A new dictionary is built; use get_packed_five_tuple_counts to avoid it.
+        """
+        if not isinstance(self.five_tuple_counts, dict):
+            return self.five_tuple_counts
+        return {decode_five_tuple(key): count for key, count in self.five_tuple_counts.items()}
+
+    def get_packed_five_tuple_counts(self):
+        """
+        Get the five tuple counts with their packed keys, which the Writer decodes as it writes them.
+
+        Returns:
+            dict or HeavyHitterSketch: The five tuple counts.
+
+        Time Complexity:
+            O(1) - This operation is a simple attribute access, which is constant time.
+
+        Space Complexity:
+            O(1) - No additional space is used; the function returns a reference to the existing counts.
+        """
         return self.five_tuple_counts
 
 class Writer:
     """
     A class responsible for writing output files.
+
+    Rows are formatted and written in chunks of chunk_lines, so a large output costs one
+    write call per chunk instead of one per row. With sort_by, rows are written in
+    descending count order ("count", ties in first-seen order) or in key order ("key"); outputs
+    with more than sort_memory_lines rows are sorted externally, in sorted runs that are
+    spilled to temporary files and merged. With compression ("gzip", "bz2" or "zstd", which
+    needs the zstandard package), the output files are compressed while they are written and
+    get the matching suffix, for example five_tuple_counts.txt.gz. The heavy hitters of a
+    sketch are always written most frequent first.
     """
+    SORT_ORDERS = (None, "count", "key")
 
-    def __init__(self, tag_counts, port_protocol_counts, five_tuple_counts):
+    def __init__(self, tag_counts, port_protocol_counts, five_tuple_counts, volume_counts=None, sort_by=None,
+                 compression=None, chunk_lines=65536, sort_memory_lines=1000000):
         """
         Initialize the Writer class.
 
         Args:
             port_protocol_counts (dict): A dictionary containing port-protocol combination counts.
+            volume_counts (VolumeCounter): If given, the tag and port-protocol outputs get
+                packets, bytes and bytes_per_second columns.
+            sort_by (str): None to keep the first-seen order, "count" or "key".
+            compression (str): None, "gzip", "bz2" or "zstd".
+            chunk_lines (int): The number of rows formatted and written at once.
+            sort_memory_lines (int): The number of rows sorted in memory at once; larger
+                outputs are sorted in runs of this many rows.
         """
+        if sort_by not in self.SORT_ORDERS:
+            raise ValueError(f"Unknown output sort order: {sort_by}")
+        if compression not in OUTPUT_SUFFIXES:
+            raise ValueError(f"Unknown output compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd output requires the zstandard package to be installed")
         self.port_protocol_counts = port_protocol_counts
         self.tag_counts = tag_counts
         self.five_tuple_counts = five_tuple_counts
+        self.volume_counts = volume_counts
+        self.sort_by = sort_by
+        self.compression = compression
+        self.chunk_lines = chunk_lines
+        self.sort_memory_lines = sort_memory_lines
+
+    VOLUME_HEADER = ",packets,bytes,bytes_per_second"
+
+    @staticmethod
+    def _volume_columns(volume):
+        """
+        Format (packets, bytes, seconds) sums as the extra columns of an output row.
+        """
+        packets, byte_count, seconds = volume
+        return f",{packets},{byte_count},{throughput(byte_count, seconds):.2f}"
+
+    def _open_output(self, file_name):
+        """
+        Open an output file for writing text, compressed according to self.compression.
+
+        Args:
+            file_name (str): The name of the uncompressed output file.
+
+        Returns:
+            file: A text file object; the file name gets the suffix of the compression.
+        """
+        output_path = file_name + OUTPUT_SUFFIXES[self.compression]
+        if self.compression == "gzip":
+            return gzip.open(output_path, "wt", encoding='utf-8', compresslevel=6)
+        if self.compression == "bz2":
+            return bz2.open(output_path, "wt", encoding='utf-8')
+        if self.compression == "zstd":
+            return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(output_path, "wb")),
+                                    encoding='utf-8')
+        return open(output_path, "w", encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE)
+
+    def _write_lines(self, output_file, lines):
+        """
+        Write formatted rows in chunks of self.chunk_lines.
+
+        Args:
+            output_file (file): The open output file.
+            lines (iterable): The rows, each ending with a newline.
+
+        Time Complexity:
+            O(n), where n is the number of rows.
+
+        Space Complexity:
+            O(c), where c is the chunk size.
+        """
+        lines = iter(lines)
+        while True:
+            chunk = list(islice(lines, self.chunk_lines))
+            if not chunk:
+                return
+            output_file.write("".join(chunk))
+
+    def _ordered_items(self, counts, decode_key=None):
+        """
+        Get the (key, count) items of an aggregate in the order given by self.sort_by.
+
+        Args:
+            counts (Mapping): The aggregate.
+            decode_key (callable): If given, every key is decoded with it before it is sorted.
+
+        Returns:
+            iterable: The items in output order.
+
+        Time Complexity:
+            O(n log n), where n is the number of items, if they are sorted, else O(1).
+
+        Space Complexity:
+            O(min(n, s)), where s is sort_memory_lines, if the items are sorted, else O(1).
+        """
+        items = counts.items()
+        if decode_key is not None:
+            items = ((decode_key(key), count) for key, count in items)
+        if self.sort_by is None:
+            return items
+        # a stable sort on the count alone keeps ties in first-seen order and avoids comparing keys
+        sort_key, reverse = (itemgetter(1), True) if self.sort_by == "count" else (itemgetter(0), False)
+        if len(counts) <= self.sort_memory_lines:
+            return sorted(items, key=sort_key, reverse=reverse)
+        return self._external_sort(items, sort_key, reverse)
+
+    def _external_sort(self, items, sort_key, reverse=False):
+        """
+        Sort items that should not all be sorted in memory at once.
+
+        The items are cut into runs of sort_memory_lines, every run is sorted and pickled to a
+        temporary file in blocks, and the runs are merged lazily with heapq.merge. Both sorts
+        are stable, so the result is the same as sorting all items at once.
+
+        Args:
+            items (iterable): The (key, count) items.
+            sort_key (callable): The sort key of an item.
+            reverse (bool): Sort in descending order.
+
+        Yields:
+            tuple: The items in sorted order.
+
+        Time Complexity:
+            O(n log n), where n is the number of items.
+
+        Space Complexity:
+            O(s + r * b), where s is sort_memory_lines, r the number of runs and b the
+            number of items per pickled block.
+        """
+        items = iter(items)
+        with tempfile.TemporaryDirectory(prefix="writer_sort_") as run_dir:
+            run_paths = []
+            while True:
+                run = sorted(islice(items, self.sort_memory_lines), key=sort_key, reverse=reverse)
+                if not run:
+                    break
+                run_path = os.path.join(run_dir, f"run_{len(run_paths)}")
+                with open(run_path, "wb") as run_file:
+                    for block_start in range(0, len(run), SORT_RUN_BLOCK_ITEMS):
+                        pickle.dump(run[block_start:block_start + SORT_RUN_BLOCK_ITEMS], run_file,
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+                run_paths.append(run_path)
+                del run
+            run_files = [open(run_path, "rb") for run_path in run_paths]
+            try:
+                yield from heapq.merge(*(self._read_run(run_file) for run_file in run_files), key=sort_key,
+                                       reverse=reverse)
+            finally:
+                for run_file in run_files:
+                    run_file.close()
+
+    @staticmethod
+    def _read_run(run_file):
+        """
+        Read the pickled blocks of a sorted run back one block at a time.
+        """
+        while True:
+            try:
+                block = pickle.load(run_file)
+            except EOFError:
+                return
+            yield from block
 
     def output_tag_counts(self, test, test_tag_counts):
         """
@@ -256,27 +1924,26 @@ class Writer:
         Time Complexity:
             O(n), where n is the number of tags in the dictionary.
             We iterate through all tags once to write them to the file.
+            O(n log n) if the tags are sorted.
 
         Space Complexity:
             O(1) - We use a constant amount of extra space regardless of input size.
             The file writing is done in a streaming manner, not storing the entire output in memory.
         """
-        if test:
-            try:
-                with open("tag_counts.txt", "w", encoding='utf-8') as tc_file:
-                    tc_file.write("tag,count\n")
-                    for tag, count in test_tag_counts.items():
-                        tc_file.write(f"{tag},{count}\n")
-            except IOError as e:
-                print(f"An error occurred while writing tag counts: {e}")
-        else:
-            try:
-                with open("tag_counts.txt", "w", encoding='utf-8') as tc_file:
+        tag_counts = test_tag_counts if test else self.tag_counts
+        volume_counts = self.volume_counts
+        try:
+            with self._open_output("tag_counts.txt") as tc_file:
+                if volume_counts is None:
                     tc_file.write("tag,count\n")
-                    for tag, count in self.tag_counts.items():
-                        tc_file.write(f"{tag},{count}\n")
-            except IOError as e:
-                print(f"An error occurred while writing tag counts: {e}")
+                    lines = (f"{tag},{count}\n" for tag, count in self._ordered_items(tag_counts))
+                else:
+                    tc_file.write(f"tag,count{self.VOLUME_HEADER}\n")
+                    lines = (f"{tag},{count}{self._volume_columns(volume_counts.for_tag(tag))}\n"
+                             for tag, count in self._ordered_items(tag_counts))
+                self._write_lines(tc_file, lines)
+        except IOError as e:
+            print(f"An error occurred while writing tag counts: {e}")
         
     def output_port_protocol_counts(self, test, test_pp_counts):
         """
@@ -289,29 +1956,39 @@ class Writer:
         Time Complexity:
             O(n), where n is the number of port-protocol combinations in the dictionary.
             We iterate through all combinations once to write them to the file.
+            O(n log n) if the combinations are sorted.
 
         Space Complexity:
             O(1) - We use a constant amount of extra space regardless of input size.
             The file writing is done in a streaming manner, not storing the entire output in memory.
         """
-        if test:
-            try:
-                with open("pp_counts.txt", "w", encoding='utf-8') as ppc_file:
-                    ppc_file.write("port,protocol,count\n")
-                    for (port, protocol), count in test_pp_counts.items():
-                        ppc_file.write(f"{port},{protocol},{count}\n")
-            except IOError as e:
-                print(f"An error occurred while writing port-protocol counts: {e}")
-        else:
-            try:
-                with open("pp_counts.txt", "w", encoding='utf-8') as ppc_file:
+        port_protocol_counts = test_pp_counts if test else self.port_protocol_counts
+        volume_counts = self.volume_counts
+        try:
+            with self._open_output("pp_counts.txt") as ppc_file:
+                if volume_counts is None:
                     ppc_file.write("port,protocol,count\n")
-                    for (port, protocol), count in self.port_protocol_counts.items():
-                        ppc_file.write(f"{port},{protocol},{count}\n")
-            except IOError as e:
-                print(f"An error occurred while writing port-protocol counts: {e}")
+                    lines = (f"{port},{protocol},{count}\n"
+                             for (port, protocol), count in self._ordered_items(port_protocol_counts))
+                else:
+                    ppc_file.write(f"port,protocol,count{self.VOLUME_HEADER}\n")
+                    lines = (f"{port},{protocol},{count}{self._volume_columns(volume_counts.for_port_protocol(port, protocol))}\n"
+                             for (port, protocol), count in self._ordered_items(port_protocol_counts))
+                self._write_lines(ppc_file, lines)
+        except IOError as e:
+            print(f"An error occurred while writing port-protocol counts: {e}")
         
     def output_five_tuple_counts(self):
+        """
+        Output the five tuple counts to a file, or the heavy hitters of a sketch. Packed
+        five tuple keys are decoded as they are written.
+
+        Time Complexity:
+            O(n), where n is the number of five tuples, or O(n log n) if they are sorted.
+
+        Space Complexity:
+            O(c), where c is the chunk size, plus the sort runs if the five tuples are sorted.
+        """
         # if test:
         #     try:
         #         with open("pp_counts.txt", "w", encoding='utf-8') as ppc_file:
@@ -321,11 +1998,39 @@ class Writer:
         #     except IOError as e:
         #         print(f"An error occurred while writing port-protocol counts: {e}")
         # else:
+        if isinstance(self.five_tuple_counts, HeavyHitterSketch):
+            self.output_five_tuple_heavy_hitters()
+            return
         try:
-            with open("five_tuple_counts.txt", "w", encoding='utf-8') as ftc_file:
+            with self._open_output("five_tuple_counts.txt") as ftc_file:
                 ftc_file.write("(source_ip, dest_ip, source_port, dest_port, protocol),count\n")
-                for (src_ip, dest_ip, src_port, dst_port, protocol), count in self.five_tuple_counts.items():
-                    ftc_file.write(f"({src_ip},{dest_ip},{src_port},{dst_port},{protocol}),{count}\n")
+                self._write_lines(ftc_file, (f"({src_ip},{dest_ip},{src_port},{dst_port},{protocol}),{count}\n"
+                                             for (src_ip, dest_ip, src_port, dst_port, protocol), count
+                                             in self._ordered_items(self.five_tuple_counts, decode_five_tuple)))
+        except IOError as e:
+            print(f"An error occurred while writing five tuple counts: {e}")
+
+    def output_five_tuple_heavy_hitters(self):
+        """
+        Output the top five tuples of a heavy hitter sketch to a file, most frequent first.
+
+        Every count is an estimate that overestimates the true count by at most max_error,
+        so the true count lies between count - max_error and count.
+
+        Time Complexity:
+            O(k log k), where k is the number of top five tuples tracked by the sketch.
+
+        Space Complexity:
+            O(k) - The top five tuples are sorted before they are written.
+        """
+        max_error = self.five_tuple_counts.error_bound()
+        try:
+            with self._open_output("five_tuple_counts.txt") as ftc_file:
+                ftc_file.write("(source_ip, dest_ip, source_port, dest_port, protocol),count,max_error\n")
+                self._write_lines(ftc_file, (f"({src_ip},{dest_ip},{src_port},{dst_port},{protocol}),{count},{max_error}\n"
+                                             for (src_ip, dest_ip, src_port, dst_port, protocol), count
+                                             in ((decode_five_tuple(key), count)
+                                                 for key, count in self.five_tuple_counts.items())))
         except IOError as e:
             print(f"An error occurred while writing five tuple counts: {e}")
 